@@ -0,0 +1,238 @@
+"""Sales analytics over the whole history, computed with NumPy.
+
+The lines of every sale, archived ones included, are read in chunks into
+columnar arrays (sale id, product id, quantity and price in paise, net of
+any line discount) and matched to the day and hour of their sale, read once
+per sale rather than per line. Each chunk is folded into running totals
+(per product, per hour, per weekday, per basket size and per pair of
+products bought together) and then dropped, so memory stays small however
+long the history is. A chunk only ever holds whole sales; the lines of the
+last sale in it are carried into the next.
+
+Sale ids grow with time, so the totals are keyed by the newest sale id
+they include. A refresh reads only the sales after it, and the report is
+rebuilt only when something new was read. Clearing the sales history must
+be followed by ``reset``; a newest id lower than the cached one also starts
+over.
+"""
+import itertools
+import threading
+
+import numpy as np
+
+ANALYTICS_CHUNK_ROWS = 100_000
+# Cumulative revenue share closing classes A and B; the remaining products are class C.
+ABC_SHARES = (0.80, 0.95)
+TOP_PRODUCTS = 50
+TOP_PAIRS = 50
+# Pair codes collected before they are merged into the running pair counts.
+PAIR_MERGE_CODES = 4_000_000
+EPOCH_WEEKDAY = 3  # 1970-01-01, day 0, was a Thursday; weekdays count from Monday = 0.
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+
+def read_chunks(cursor, columns, chunk_rows=ANALYTICS_CHUNK_ROWS):
+    """The rows of ``cursor`` as (n, ``columns``) float arrays of at most ``chunk_rows`` rows each."""
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            return
+        # One fromiter over the flattened tuples is several times faster than np.array(rows).
+        flat = np.fromiter(itertools.chain.from_iterable(rows), dtype=np.float64, count=len(rows) * columns)
+        yield flat.reshape(len(rows), columns)
+
+
+def _grown(array, size):
+    """``array`` zero-padded to at least ``size`` entries."""
+    if len(array) >= size:
+        return array
+    return np.concatenate((array, np.zeros(size - len(array), dtype=array.dtype)))
+
+
+def abc_classes(revenue, shares=ABC_SHARES):
+    """Class per index of ``revenue``: 'A' for the best sellers making up the first ``shares[0]`` of revenue,
+    'B' up to ``shares[1]`` and 'C' for the rest; '' where nothing was sold."""
+    classes = np.full(len(revenue), "", dtype="<U1")
+    sold = np.flatnonzero(revenue > 0)
+    if not len(sold):
+        return classes
+    ranked = sold[np.argsort(-revenue[sold], kind="stable")]
+    # Share of revenue before each product, so the product that crosses a threshold stays in the class.
+    before = (np.cumsum(revenue[ranked]) - revenue[ranked]) / revenue[ranked].sum()
+    classes[ranked] = np.where(before < shares[0], "A", np.where(before < shares[1], "B", "C"))
+    return classes
+
+
+class SalesAnalytics:
+    """Running totals over every sale up to ``newest_sale_id``, refreshed incrementally from a Storage."""
+
+    def __init__(self, chunk_rows=ANALYTICS_CHUNK_ROWS):
+        self.chunk_rows = chunk_rows
+        self._lock = threading.Lock()  # Refreshes come from worker threads; one at a time.
+        self._clear()
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.newest_sale_id = 0
+        self.sales = 0
+        self.lines = 0
+        self.revenue = 0.0
+        self.product_quantity = np.zeros(0, dtype=np.float64)
+        self.product_revenue = np.zeros(0, dtype=np.float64)
+        self.product_sales = np.zeros(0, dtype=np.int64)  # Baskets containing the product.
+        self.hour_sales = np.zeros(24, dtype=np.int64)
+        self.hour_revenue = np.zeros(24, dtype=np.float64)
+        self.weekday_sales = np.zeros(7, dtype=np.int64)
+        self.weekday_revenue = np.zeros(7, dtype=np.float64)
+        self.basket_sizes = np.zeros(1, dtype=np.int64)  # Sales by number of lines.
+        # Product pairs bought together, as sorted codes (smaller id << 32 | larger id) and their sale counts.
+        self.pair_codes = np.zeros(0, dtype=np.int64)
+        self.pair_counts = np.zeros(0, dtype=np.int64)
+        self._new_pairs = []
+        self._report = None
+
+    def refresh(self, storage, top=TOP_PRODUCTS, pairs=TOP_PAIRS):
+        """Bring the totals up to the newest sale in ``storage`` and return the report (see ``report``)."""
+        with self._lock:
+            newest = storage.newest_sale_id()
+            if newest < self.newest_sale_id:
+                self._clear()
+            if newest > self.newest_sale_id:
+                self._read(storage, newest)
+                self.newest_sale_id, self._report = newest, None
+            if self._report is None or self._report["top"] != (top, pairs):
+                self._report = self.report(top, pairs)
+            return self._report
+
+    def _read(self, storage, newest):
+        for sales, lines in storage.sale_lines(self.newest_sale_id, newest):
+            days = np.concatenate([np.zeros((0, 3))] + list(read_chunks(sales, 3, self.chunk_rows)))
+            sale_ids = days[:, 0].astype(np.int64)
+            carried = None
+            for chunk in read_chunks(lines, 4, self.chunk_rows):
+                if carried is not None:
+                    chunk = np.concatenate((carried, chunk))
+                # Lines are in sale order; hold back the last sale, which may continue in the next chunk.
+                cut = np.searchsorted(chunk[:, 0], chunk[-1, 0])
+                self.add_lines(chunk[:cut], sale_ids, days)
+                carried = chunk[cut:]
+            if carried is not None:
+                self.add_lines(carried, sale_ids, days)
+        self.merge_pairs()
+
+    def add_lines(self, chunk, sale_ids, days):
+        """Fold whole sales into the totals: ``chunk`` holds their lines as rows of (sale_id, product_id,
+        quantity, price) in sale order, ``days`` rows of (sale_id, day, hour) with ``sale_ids`` its sorted
+        first column. Lines of sales missing from ``days`` are skipped. Pair counts are brought up to date
+        by ``merge_pairs``."""
+        if not len(chunk) or not len(sale_ids):
+            return
+        sale = chunk[:, 0].astype(np.int64)
+        found = np.minimum(np.searchsorted(sale_ids, sale), len(sale_ids) - 1)
+        known = sale_ids[found] == sale
+        if not known.all():
+            chunk, sale, found = chunk[known], sale[known], found[known]
+            if not len(chunk):
+                return
+        product = chunk[:, 1].astype(np.int64)
+        quantity = chunk[:, 2]
+        revenue = quantity * chunk[:, 3]
+        starts = np.flatnonzero(np.concatenate(([True], sale[1:] != sale[:-1])))
+        sizes = np.diff(np.append(starts, len(sale)))
+        sale_revenue = np.add.reduceat(revenue, starts)
+        hour = np.clip(days[found[starts], 2].astype(np.int64), 0, 23)
+        weekday = (days[found[starts], 1].astype(np.int64) + EPOCH_WEEKDAY) % 7
+
+        size = int(product.max()) + 1
+        self.product_quantity = _grown(self.product_quantity, size)
+        self.product_revenue = _grown(self.product_revenue, size)
+        self.product_sales = _grown(self.product_sales, size)
+        self.product_quantity[:size] += np.bincount(product, weights=quantity, minlength=size)
+        self.product_revenue[:size] += np.bincount(product, weights=revenue, minlength=size)
+        self.product_sales[:size] += np.bincount(product, minlength=size)
+        self.hour_sales += np.bincount(hour, minlength=24)
+        self.hour_revenue += np.bincount(hour, weights=sale_revenue, minlength=24)
+        self.weekday_sales += np.bincount(weekday, minlength=7)
+        self.weekday_revenue += np.bincount(weekday, weights=sale_revenue, minlength=7)
+        counts = np.bincount(sizes)
+        self.basket_sizes = _grown(self.basket_sizes, len(counts))
+        self.basket_sizes[:len(counts)] += counts
+        self.sales += len(starts)
+        self.lines += len(sale)
+        self.revenue += float(sale_revenue.sum())
+        self._add_pairs(sale, product)
+
+    def _add_pairs(self, sale, product):
+        # With each sale's lines sorted by product, every pair in a basket of n lines sits 1..n-1 rows apart.
+        order = np.lexsort((product, sale))
+        sale, product = sale[order], product[order]
+        codes = []
+        for gap in range(1, len(sale)):
+            same = sale[gap:] == sale[:-gap]
+            if not same.any():
+                break
+            first, second = product[:-gap][same], product[gap:][same]
+            distinct = first != second
+            codes.append(first[distinct] << 32 | second[distinct])
+        self._new_pairs += codes
+        if sum(len(c) for c in self._new_pairs) >= PAIR_MERGE_CODES:
+            self.merge_pairs()
+
+    def merge_pairs(self):
+        """Add the pairs collected since the last merge to the running pair counts."""
+        if not self._new_pairs:
+            return
+        codes, counts = np.unique(np.concatenate(self._new_pairs), return_counts=True)
+        self._new_pairs = []
+        codes = np.concatenate((self.pair_codes, codes))
+        weights = np.concatenate((self.pair_counts, counts))
+        self.pair_codes, index = np.unique(codes, return_inverse=True)
+        self.pair_counts = np.bincount(index, weights=weights).astype(np.int64)
+
+    def report(self, top=TOP_PRODUCTS, pairs=TOP_PAIRS):
+        """The totals as plain lists for display:
+
+        ``top_sellers``  (product_id, quantity, revenue, class) of the ``top`` products by revenue
+        ``abc``          (class, products, revenue, share of revenue) for A, B and C
+        ``hours``        (hour, sales, revenue) for 0..23
+        ``weekdays``     (weekday name, sales, revenue), Monday first
+        ``basket_sizes`` (lines, sales, share of sales) for each basket size seen
+        ``pairs``        (product_id, product_id, sales, support, lift) of the ``pairs`` most frequent pairs
+
+        plus ``sales``, ``lines``, ``revenue`` and ``newest_sale_id``. Revenue is in paise. Support is the share of all sales
+        containing the pair; lift is how many times more often than chance the two are bought together.
+        """
+        classes = abc_classes(self.product_revenue)
+        sold = np.flatnonzero(self.product_revenue > 0)
+        best = sold[np.argsort(-self.product_revenue[sold], kind="stable")[:top]]
+        total = self.revenue or 1.0
+        abc = []
+        for name in "ABC":
+            members = classes == name
+            revenue = float(self.product_revenue[members].sum())
+            abc.append((name, int(members.sum()), revenue, revenue / total))
+        sales = max(self.sales, 1)
+        frequent = np.argsort(-self.pair_counts, kind="stable")[:pairs]
+        pair_rows = []
+        for code, count in zip(self.pair_codes[frequent].tolist(), self.pair_counts[frequent].tolist()):
+            first, second = code >> 32, code & 0xFFFFFFFF
+            expected = self.product_sales[first] * self.product_sales[second] / sales
+            pair_rows.append((first, second, count, count / sales, float(count / expected)))
+        return {
+            "top": (top, pairs),
+            "newest_sale_id": self.newest_sale_id,
+            "sales": self.sales,
+            "lines": self.lines,
+            "revenue": self.revenue,
+            "top_sellers": [(int(p), float(self.product_quantity[p]), float(self.product_revenue[p]), str(classes[p]))
+                            for p in best],
+            "abc": abc,
+            "hours": list(zip(range(24), self.hour_sales.tolist(), self.hour_revenue.tolist())),
+            "weekdays": list(zip(WEEKDAYS, self.weekday_sales.tolist(), self.weekday_revenue.tolist())),
+            "basket_sizes": [(size, count, count / sales) for size, count in enumerate(self.basket_sizes.tolist())
+                             if count],
+            "pairs": pair_rows,
+        }
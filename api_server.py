@@ -0,0 +1,541 @@
+"""Headless HTTP/JSON API over the POS core, for handhelds and web clients.
+
+Runs next to the till, or on its own, against the same database::
+
+    python api_server.py                        # http://127.0.0.1:8765
+    python api_server.py --host 0.0.0.0 --token SECRET
+
+Bodies and replies are JSON, with amounts of money as whole paise. With a
+token every request needs an ``Authorization: Bearer <token>`` header.
+Endpoints:
+
+    GET  /api/health
+    GET  /api/products/ID                one product
+    GET  /api/products?barcode=CODE      the product a barcode belongs to
+    GET  /api/search?q=TERM&in_stock=1&limit=50
+    POST /api/cart       {"lines": [{"product_id" or "barcode": ..., "quantity": n, "discount": paise}, ...],
+                          "discount": paise}
+                         prices the cart, with the tax set on the tills, and lists lines the stock
+                         cannot cover; nothing is written. Discounts are optional.
+    POST /api/checkout   same body; records the sale
+    POST /api/stock      {"adjustments": [{"product_id" or "barcode": ..., "quantity": n or "delta": n}, ...]}
+                         stock counts set the quantity, deliveries and write-offs add a delta
+    GET  /api/sales?date_from=&date_to=&min_total=&max_total=&limit=&after_date=&after_id=
+    GET  /api/sales/ID                   one sale with its lines
+    GET  /api/reports/daily?date_from=&date_to=
+    POST /api/batch      [{"method": "GET", "path": "/api/products/7"}, {"method": "POST", "path": ..., "body": ...}]
+                         runs the requests concurrently and returns [{"status": ..., "body": ...}, ...]
+
+Product lookups and searches are answered from an in-memory Catalog, kept
+current from the product change log like the till's. Other reads run on a
+small pool of threads, each with its own connection. Checkouts go to one
+writer thread, which records every sale that queued up while it was busy in
+a single transaction; a sale that runs out of stock is rolled back on its
+own without failing the others.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from cart import Cart, parse_tax_rates
+from catalog import Catalog
+from search_index import MAX_RESULTS
+from storage import SALES_PAGE_SIZE, InsufficientStockError, Storage, ThreadLocalStorage
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "retail.db")
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+POOL_SIZE = 4
+# Most sales recorded in one transaction.
+CHECKOUT_BATCH = 64
+CHANGE_POLL_SECONDS = 0.5
+SEARCH_LIMIT = 50
+MAX_BODY_BYTES = 1 << 20
+MAX_BATCH_REQUESTS = 100
+# An idle keep-alive connection is closed after this long.
+IDLE_TIMEOUT = 60
+REPORT_DAYS = 30
+
+ROUTES = (
+    ("GET", r"/api/health", "health"),
+    ("GET", r"/api/products/(\d+)", "get_product"),
+    ("GET", r"/api/products", "find_product"),
+    ("GET", r"/api/search", "search"),
+    ("POST", r"/api/cart", "price_cart"),
+    ("POST", r"/api/checkout", "checkout"),
+    ("POST", r"/api/stock", "adjust_stock"),
+    ("GET", r"/api/sales", "list_sales"),
+    ("GET", r"/api/sales/(\d+)", "get_sale"),
+    ("GET", r"/api/reports/daily", "daily_report"),
+    ("POST", r"/api/batch", "batch"),
+)
+
+
+class ApiError(Exception):
+    """A request that cannot be served, with the HTTP status to answer it with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class StoragePool:
+    """A fixed set of threads, each with its own connection to the database, to run Storage calls on."""
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self.storages = ThreadLocalStorage(db_path)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="api-db")
+
+    async def run(self, fn, *args):
+        """``fn(storage, *args)`` on a pool thread. Read cursors there too; they belong to its connection."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, lambda: fn(self.storages.get(), *args))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.storages.close_all()
+
+
+class CheckoutBatcher:
+    """Records queued sales on one writer thread, as many as have queued up per transaction."""
+
+    def __init__(self, db_path, max_batch=CHECKOUT_BATCH):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.storage = None
+        self.batches = 0
+        self.sales = 0
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="api-checkout",
+                                            initializer=self._open)
+
+    def _open(self):
+        self.storage = Storage(self.db_path)
+
+    async def submit(self, items, total, discount=0, tax=0):
+        """Record a sale; returns (its id, its stored date) and the sold products' catalog rows, or raises
+        InsufficientStockError."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(((items, total, discount, tax), future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                results, rows = await loop.run_in_executor(self._executor, self._write,
+                                                           [sale for sale, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.sales += len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.done():
+                    continue  # The client went away.
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result((result, rows))
+
+    def _write(self, sales):
+        results = [result if isinstance(result, Exception) else (result, self.storage.sale_date(result))
+                   for result in self.storage.record_sales(sales)]
+        product_ids = dict.fromkeys(item[0] for items, _, _, _ in sales for item in items)
+        return results, [row for row in map(self.storage.get_catalog_row, product_ids) if row]
+
+    def close(self):
+        self._executor.submit(lambda: self.storage.close())
+        self._executor.shutdown(wait=True)
+
+
+# --- Request parsing ---
+def int_param(query, name, default=None, minimum=None, maximum=None):
+    value = query.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise ApiError(400, f"'{name}' must be a whole number.") from None
+    if (minimum is not None and value < minimum) or (maximum is not None and value > maximum):
+        raise ApiError(400, f"'{name}' is out of range.")
+    return value
+
+
+def date_param(query, name, default=None):
+    value = query.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ApiError(400, f"'{name}' must be a date, YYYY-MM-DD.") from None
+
+
+def body_list(body, key):
+    items = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ApiError(400, f"The body needs a non-empty '{key}' list.")
+    if not all(isinstance(item, dict) for item in items):
+        raise ApiError(400, f"Each entry of '{key}' must be an object.")
+    return items
+
+
+def whole_number(item, name, minimum=None):
+    value = item.get(name)
+    if isinstance(value, bool) or not isinstance(value, int) or (minimum is not None and value < minimum):
+        raise ApiError(400, f"'{name}' must be a whole number" + (f" of {minimum} or more." if minimum is not None
+                                                                   else "."))
+    return value
+
+
+def product_json(record):
+    return {"id": record.id, "name": record.name, "price": record.price, "quantity": record.quantity,
+            "barcodes": list(record.barcodes)}
+
+
+def cart_json(cart):
+    return {"lines": [{"product_id": line.product_id, "name": line.name, "quantity": line.quantity,
+                       "price": line.price, "discount": line.discount, "amount": line.amount} for line in cart],
+            "subtotal": cart.subtotal, "discount": cart.total_discount,
+            "taxes": [{"label": label, "rate": rate, "amount": amount} for label, rate, amount in cart.taxes()],
+            "tax_inclusive": cart.tax_inclusive, "total": cart.total}
+
+
+class ApiServer:
+    """Routes JSON requests to the catalog, the storage pool and the checkout batcher."""
+
+    def __init__(self, db_path, pool_size=POOL_SIZE, token=None):
+        self.db_path = db_path
+        self.token = token
+        self.storage = Storage(db_path)  # Event-loop thread only: schema setup and change polling.
+        self.storage.create_tables()
+        self.pool = StoragePool(db_path, pool_size)
+        self.checkouts = CheckoutBatcher(db_path)
+        self.catalog = Catalog()
+        self.catalog_seq = 0
+        self.tax = ((), False)  # (rates, prices include tax) as set on the tills
+        self.requests = 0
+        self._data_version = None
+        self._routes = [(method, re.compile(pattern), getattr(self, name)) for method, pattern, name in ROUTES]
+        self._tasks = []
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self._data_version = self.storage.data_version()
+        self.catalog_seq, rows = await self.pool.run(Storage.load_catalog)
+        self.catalog.load(rows)
+        self.load_tax(await self.pool.run(Storage.get_tax))
+        self._tasks = [asyncio.create_task(self.checkouts.run()), asyncio.create_task(self.poll_changes())]
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self.checkouts.close()
+        self.pool.close()
+        self.storage.close()
+
+    def load_tax(self, tax):
+        rates, inclusive = tax
+        self.tax = (parse_tax_rates(rates or ""), inclusive)
+
+    async def poll_changes(self):
+        """Pick up product and tax changes made by the tills, and by our own writers."""
+        while True:
+            await asyncio.sleep(CHANGE_POLL_SECONDS)
+            version = self.storage.data_version()
+            if version == self._data_version:
+                continue
+            self._data_version = version
+            try:
+                self.load_tax(await self.pool.run(Storage.get_tax))
+                changes = await self.pool.run(Storage.product_changes_since, self.catalog_seq)
+                if changes is None:
+                    # Too far behind the change log; start over from a fresh snapshot.
+                    self.catalog_seq, rows = await self.pool.run(Storage.load_catalog)
+                    self.catalog.load(rows)
+                    continue
+                seq, deleted, rows = changes
+                for product_id in deleted:
+                    self.catalog.remove(product_id)
+                for row in rows:
+                    self.catalog.apply(row)
+                self.catalog_seq = max(self.catalog_seq, seq)
+            except Exception:
+                traceback.print_exc()
+
+    # --- HTTP ---
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    length = int(headers.get("content-length") or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Malformed request."}, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {"error": "The body is too large."}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" or (version == "HTTP/1.1" and connection != "close")
+                if method == "OPTIONS":  # CORS preflight from a web page.
+                    await self.respond(writer, 204, None, keep_alive)
+                    continue
+                if self.token and headers.get("authorization") != f"Bearer {self.token}":
+                    status, payload = 401, {"error": "A valid token is required."}
+                else:
+                    try:
+                        payload = json.loads(body) if body else None
+                    except ValueError:
+                        status, payload = 400, {"error": "The body is not valid JSON."}
+                    else:
+                        status, payload = await self.dispatch(method, target, payload)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        data = b"" if payload is None else json.dumps(payload, separators=(",", ":")).encode()
+        head = (f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                "Access-Control-Allow-Origin: *\r\nAccess-Control-Allow-Headers: Authorization, Content-Type\r\n"
+                "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+                + ("" if keep_alive else "Connection: close\r\n") + "\r\n")
+        writer.write(head.encode() + data)
+        await writer.drain()
+
+    async def dispatch(self, method, target, body):
+        """(status, reply) for one request."""
+        self.requests += 1
+        url = urlsplit(target)
+        allowed = False
+        for route_method, pattern, handler in self._routes:
+            match = pattern.fullmatch(url.path)
+            if match is None:
+                continue
+            if route_method != method:
+                allowed = True
+                continue
+            try:
+                return 200, await handler(dict(parse_qsl(url.query)), body, *match.groups())
+            except ApiError as e:
+                return e.status, {"error": str(e)}
+            except InsufficientStockError as e:
+                return 409, {"error": str(e), "product_id": e.product_id, "available": e.available}
+            except Exception as e:
+                traceback.print_exc()
+                return 500, {"error": f"An error occurred: {e}"}
+        return (405, {"error": "Method not allowed."}) if allowed else (404, {"error": "No such endpoint."})
+
+    # --- Catalog ---
+    def product(self, item):
+        """The catalog record an object with a ``product_id`` or ``barcode`` names."""
+        if "product_id" in item:
+            record = self.catalog.get(whole_number(item, "product_id"))
+        elif "barcode" in item:
+            record = self.catalog.lookup_barcode(str(item["barcode"]))
+        else:
+            raise ApiError(400, "Each line needs a 'product_id' or a 'barcode'.")
+        if record is None:
+            raise ApiError(404, f"No product matches {json.dumps(item)}.")
+        return record
+
+    async def health(self, query, body):
+        return {"status": "ok", "products": len(self.catalog), "requests": self.requests,
+                "checkout_batches": self.checkouts.batches, "sales": self.checkouts.sales}
+
+    async def get_product(self, query, body, product_id):
+        record = self.catalog.get(int(product_id))
+        if record is None:
+            raise ApiError(404, f"There is no product with ID {product_id}.")
+        return product_json(record)
+
+    async def find_product(self, query, body):
+        if "barcode" not in query:
+            raise ApiError(400, "Give a 'barcode' to look up, or use /api/search.")
+        return product_json(self.product({"barcode": query["barcode"]}))
+
+    async def search(self, query, body):
+        limit = int_param(query, "limit", SEARCH_LIMIT, 1, MAX_RESULTS)
+        tiles = self.catalog.search(query.get("q", ""), in_stock_only=query.get("in_stock", "1") != "0")
+        return {"products": [product_json(self.catalog.get(tile[0])) for tile in tiles[:limit]]}
+
+    # --- Cart and checkout ---
+    def cart(self, body):
+        """A Cart of a cart body's lines at the catalog's current prices, with the discounts it asks for."""
+        cart = Cart(*self.tax)
+        discounts = []
+        for item in body_list(body, "lines"):
+            record = self.product(item)
+            cart.add(record.id, record.name, record.price, whole_number(item, "quantity", 1))
+            if "discount" in item:
+                discounts.append((record.id, whole_number(item, "discount", 0)))
+        try:
+            for product_id, discount in discounts:
+                cart.set_line_discount(product_id, cart.get(product_id).discount + discount)
+            if isinstance(body, dict) and "discount" in body:
+                cart.set_discount(whole_number(body, "discount", 0))
+        except ValueError as e:
+            raise ApiError(400, str(e)) from None
+        return cart
+
+    async def price_cart(self, query, body):
+        cart = self.cart(body)
+        reply = cart_json(cart)
+        reply["short"] = [{"product_id": line.product_id, "name": line.name, "requested": line.quantity,
+                           "available": self.catalog.get(line.product_id).quantity}
+                          for line in cart if self.catalog.get(line.product_id).quantity < line.quantity]
+        return reply
+
+    async def checkout(self, query, body):
+        cart = self.cart(body)
+        (sale_id, sale_date), rows = await self.checkouts.submit(cart.items(), cart.total, cart.total_discount, cart.tax)
+        for row in rows:
+            self.catalog.apply(row)
+        reply = cart_json(cart)
+        reply.update(sale_id=sale_id, date=sale_date)
+        return reply
+
+    async def adjust_stock(self, query, body):
+        adjustments = []
+        for item in body_list(body, "adjustments"):
+            record = self.product(item)
+            if "quantity" in item:
+                adjustments.append((record.id, whole_number(item, "quantity", 0), None))
+            elif "delta" in item:
+                adjustments.append((record.id, None, whole_number(item, "delta")))
+            else:
+                raise ApiError(400, "Each adjustment needs a 'quantity' (a count) or a 'delta'.")
+        rows = await self.pool.run(Storage.adjust_stock, adjustments)
+        for row in rows:
+            self.catalog.apply(row)
+        return {"products": [product_json(self.catalog.get(row[0])) for row in rows]}
+
+    # --- Sales ---
+    async def list_sales(self, query, body):
+        limit = int_param(query, "limit", SALES_PAGE_SIZE, 1, 1000)
+        after = None
+        if query.get("after_date") or query.get("after_id"):
+            after = (query.get("after_date", ""), int_param(query, "after_id", 0))
+        filters = {"date_from": date_param(query, "date_from"), "date_to": date_param(query, "date_to"),
+                   "min_total": int_param(query, "min_total"), "max_total": int_param(query, "max_total")}
+        rows = await self.pool.run(lambda storage: storage.list_sales_page(after=after, limit=limit, **filters))
+        reply = {"sales": [{"sale_id": sale_id, "total": total, "date": sale_date}
+                           for sale_id, total, sale_date in rows]}
+        if len(rows) == limit:
+            reply["next"] = {"after_date": rows[-1][2], "after_id": rows[-1][0]}
+        return reply
+
+    async def get_sale(self, query, body, sale_id):
+        sale = await self.pool.run(Storage.get_receipt, int(sale_id))
+        if sale is None:
+            raise ApiError(404, f"There is no sale with ID {sale_id}.")
+        del sale["reprint"]
+        sale["taxes"] = [{"label": label, "rate": rate, "amount": amount} for label, rate, amount in sale["taxes"]]
+        return sale
+
+    async def daily_report(self, query, body):
+        today = date.today()
+        date_to = date_param(query, "date_to", today.isoformat())
+        date_from = date_param(query, "date_from", (today - timedelta(days=REPORT_DAYS - 1)).isoformat())
+
+        def read(storage):
+            with storage.transaction():
+                return (storage.daily_totals(date_from, date_to).fetchall(),
+                        storage.range_totals(date_from, date_to))
+
+        days, (sale_count, item_count, revenue) = await self.pool.run(read)
+        return {"date_from": date_from, "date_to": date_to,
+                "totals": {"sales": sale_count, "items": item_count, "revenue": revenue},
+                "days": [{"day": day, "sales": sales, "items": items, "revenue": day_revenue}
+                         for day, sales, items, day_revenue in days]}
+
+    # --- Batching ---
+    async def batch(self, query, body):
+        if not isinstance(body, list) or not body or len(body) > MAX_BATCH_REQUESTS:
+            raise ApiError(400, f"The body must be a list of 1 to {MAX_BATCH_REQUESTS} requests.")
+        if not all(isinstance(item, dict) and isinstance(item.get("path"), str) for item in body):
+            raise ApiError(400, "Each request needs a 'path'.")
+        if any(urlsplit(item["path"]).path == "/api/batch" for item in body):
+            raise ApiError(400, "Batches cannot be nested.")
+        # Run together, so checkouts in one batch share a transaction.
+        replies = await asyncio.gather(*(self.dispatch(str(item.get("method", "GET")).upper(), item["path"],
+                                                       item.get("body")) for item in body))
+        return [{"status": status, "body": reply} for status, reply in replies]
+
+
+async def serve(db_path, host, port, pool_size=POOL_SIZE, token=None, on_ready=None):
+    """Run the API until cancelled."""
+    api = ApiServer(db_path, pool_size, token)
+    try:
+        server = await api.start(host, port)
+        if on_ready is not None:
+            on_ready()
+        async with server:
+            await server.serve_forever()
+    finally:
+        api.close()
+
+
+def run(db_path, host=DEFAULT_HOST, port=DEFAULT_PORT, pool_size=POOL_SIZE, token=None, ready=None):
+    """Entry point for a separate process; ``ready`` is an Event set once requests are being accepted."""
+    try:
+        asyncio.run(serve(db_path, host, port, pool_size, token, on_ready=ready.set if ready is not None else None))
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the Retail POS over HTTP/JSON.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="database file (default: the till's)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--pool", type=int, default=POOL_SIZE, help="database connections for reads")
+    parser.add_argument("--token", default=os.environ.get("RETAIL_API_TOKEN"),
+                        help="require this bearer token (default: $RETAIL_API_TOKEN)")
+    args = parser.parse_args(argv)
+    if args.host not in ("127.0.0.1", "localhost", "::1") and not args.token:
+        print("Warning: serving beyond this machine without --token; anyone on the network can sell and "
+              "adjust stock.", file=sys.stderr)
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    print(f"Serving {args.db} on http://{args.host}:{args.port}", file=sys.stderr)
+    run(args.db, args.host, args.port, args.pool, args.token)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,591 @@
+"""Headless performance benchmarks for the Retail POS.
+
+Generates a synthetic store of a chosen size in a scratch ``retail.db`` and
+times the operations a till performs, without opening a window::
+
+    python benchmark.py --size small                     # 1k products, 10k sale lines
+    python benchmark.py --size large --out after.json    # 100k products, 5M sale lines
+    python benchmark.py --compare before.json after.json
+    python benchmark.py --terminals 4                    # also race 1, 2 and 4 tills against each other
+    python benchmark.py --api 32                         # also load the HTTP API with 32 clients
+
+The store is generated once per size and reused (``--regenerate`` starts
+over); it is deterministic for a given seed, so two runs of the same size on
+the same machine are comparable. Checkouts are written to the scratch
+database, so each run adds a few hundred sales to it. Results are JSON: run
+metadata plus, per benchmark, the sample count and latency percentiles in
+milliseconds. ``--compare`` prints the change in median and p95 for every
+benchmark present in both files and exits with status 1 if any got slower
+than the threshold.
+
+``--terminals N`` additionally runs 1, 2, 4 ... N till processes checking
+out concurrently against the same database, with a few products stocked so
+thinly that they sell out mid-run. It reports the combined sales per second
+and checks that no product was sold beyond its stock.
+
+``--api N`` starts ``api_server`` on the store in its own process and has N
+keep-alive clients send it searches, product lookups and checkouts for the
+same number of seconds, reporting requests per second and the latency of
+reads and of checkouts.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from analytics import SalesAnalytics
+from cart import Cart
+from catalog import Catalog
+from checkout import CheckoutEngine
+from delta_export import export_changes
+from export import export
+from forecast import StockForecast
+from importer import import_products
+from storage import InsufficientStockError
+from storage import Storage
+
+# name -> (products, sale lines)
+SIZES = {
+    "small": (1_000, 10_000),
+    "medium": (10_000, 500_000),
+    "large": (100_000, 5_000_000),
+}
+DEFAULT_SEED = 42
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "bench")
+# Rows handed to each executemany while generating.
+GENERATE_BATCH = 50_000
+# Sales are spread over this many days before the generation date.
+HISTORY_DAYS = 365
+# A median or p95 this much slower than the baseline counts as a regression.
+REGRESSION_THRESHOLD = 0.10
+# Multi-terminal runs: how long each lasts, how many scarce products there are and how many of each.
+TERMINAL_SECONDS = 5.0
+SCARCE_PRODUCTS = 10
+SCARCE_STOCK = 100
+# ...and this much slower in absolute terms; sub-millisecond timings jitter by more than the threshold.
+NOISE_FLOOR_MS = 0.1
+
+BRANDS = ("Amul", "Tata", "Nestle", "Britannia", "Parle", "Haldiram", "Dabur", "Patanjali", "Surf", "Colgate",
+          "Lifebuoy", "Maggi", "Kissan", "Fortune", "Aashirvaad", "Bournvita", "Horlicks", "Lays", "Kurkure", "Dove")
+ITEMS = ("Butter", "Milk", "Tea", "Coffee", "Biscuits", "Namkeen", "Honey", "Atta", "Rice", "Dal", "Oil", "Soap",
+         "Shampoo", "Toothpaste", "Noodles", "Ketchup", "Jam", "Chips", "Salt", "Sugar", "Ghee", "Paneer",
+         "Detergent", "Cornflakes", "Juice", "Bread", "Cheese", "Curd", "Masala", "Pickle")
+VARIANTS = ("100g", "200g", "250g", "500g", "1kg", "2kg", "5kg", "500ml", "1L", "Pack of 4", "Family Pack",
+            "Classic", "Gold", "Lite", "Spicy", "Mint", "Original", "Premium")
+
+
+# --- Synthetic store ---
+def product_name(index):
+    brand = BRANDS[index % len(BRANDS)]
+    item = ITEMS[(index // len(BRANDS)) % len(ITEMS)]
+    variant = VARIANTS[(index // (len(BRANDS) * len(ITEMS))) % len(VARIANTS)]
+    # Beyond the 10,800 combinations, a running number keeps names distinct.
+    serial = index // (len(BRANDS) * len(ITEMS) * len(VARIANTS))
+    return f"{brand} {item} {variant}" + (f" #{serial}" if serial else "")
+
+
+def product_barcode(product_id):
+    return str(8_900_000_000_000 + product_id)
+
+
+def generate_store(db_path, products, lines, seed=DEFAULT_SEED, log=print):
+    """Create a fresh database at ``db_path`` with the given number of products and sale lines."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    rng = random.Random(seed)
+    storage = Storage(db_path)
+    storage.create_tables()
+    started = time.perf_counter()
+    prices = [round(rng.uniform(5, 2000) * 100) for _ in range(products)]  # paise
+    with storage.transaction():
+        # Plenty of stock so benchmark checkouts never run out.
+        storage.conn.executemany("INSERT INTO products (id, name, price, quantity, image_path) VALUES (?, ?, ?, ?, '')",
+                                 ((i + 1, product_name(i), prices[i], 1_000_000) for i in range(products)))
+        storage.conn.executemany("INSERT INTO product_barcodes (barcode, product_id) VALUES (?, ?)",
+                                 ((product_barcode(i + 1), i + 1) for i in range(products)))
+    # A few products sell far more than the rest, as in a real shop.
+    popularity, total = [], 0.0
+    for rank in range(products):
+        total += 1.0 / (rank + 1)
+        popularity.append(total)
+    ranks = list(range(products))
+    rng.shuffle(ranks)
+
+    start = datetime.now() - timedelta(days=HISTORY_DAYS)
+    span = HISTORY_DAYS * 86400
+    average_basket = 3.5
+    sale_count = max(1, int(lines / average_basket))
+    sale_id = line_id = 0
+    sales, items = [], []
+    with storage.transaction():
+        while line_id < lines:
+            sale_id += 1
+            # Sales advance through the year; only shop hours are used.
+            moment = start + timedelta(seconds=span * min(sale_id, sale_count) / sale_count)
+            moment = moment.replace(hour=9 + int(12 * rng.random() ** 1.5), minute=rng.randrange(60))
+            basket = min(rng.randint(1, 6), lines - line_id)
+            chosen = rng.choices(ranks, cum_weights=popularity, k=basket)
+            total_price = 0
+            for pid in chosen:
+                qty = rng.randint(1, 3)
+                line_id += 1
+                items.append((line_id, sale_id, pid + 1, product_name(pid), qty, prices[pid]))
+                total_price += qty * prices[pid]
+            sales.append((sale_id, total_price, moment.strftime("%Y-%m-%d %H:%M:%S")))
+            if len(items) >= GENERATE_BATCH:
+                flush_sales(storage, sales, items)
+                log(f"  {line_id:,} / {lines:,} sale lines")
+        flush_sales(storage, sales, items)
+        storage._rebuild_rollups()
+    storage.conn.execute("ANALYZE")
+    storage.close()
+    log(f"Generated {products:,} products, {sale_id:,} sales, {lines:,} lines "
+        f"in {time.perf_counter() - started:.1f}s")
+
+
+def flush_sales(storage, sales, items):
+    storage.conn.executemany("INSERT INTO sales (id, total_price, sale_date) VALUES (?, ?, ?)", sales)
+    storage.conn.executemany("INSERT INTO sale_items (id, sale_id, product_id, product_name, quantity, price) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", items)
+    sales.clear()
+    items.clear()
+
+
+def prepare_store(size, products, lines, seed, regenerate, log=print):
+    """Path of a scratch database of the requested size, generating it if needed."""
+    directory = os.path.join(BENCH_DIR, size)
+    os.makedirs(directory, exist_ok=True)
+    db_path = os.path.join(directory, "retail.db")
+    spec_path = db_path + ".json"
+    # Bump "layout" whenever generate_store changes what it writes, so older stores are regenerated.
+    spec = {"products": products, "lines": lines, "seed": seed, "layout": 2}
+    if not regenerate and os.path.exists(db_path) and os.path.exists(spec_path):
+        with open(spec_path) as handle:
+            if json.load(handle) == spec:
+                return db_path
+    log(f"Generating the {size} store in {db_path}")
+    generate_store(db_path, products, lines, seed, log)
+    with open(spec_path, "w") as handle:
+        json.dump(spec, handle)
+    return db_path
+
+
+# --- Measurement ---
+def summarize(samples):
+    """Latency statistics in milliseconds for a list of durations in seconds."""
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {"count": len(ordered), "mean_ms": sum(ordered) / len(ordered) * 1000, "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95), "p99_ms": percentile(0.99), "max_ms": ordered[-1] * 1000}
+
+
+def measure(operation, arguments):
+    """Call ``operation`` once per argument and return the latency statistics."""
+    samples = []
+    for argument in arguments:
+        started = time.perf_counter()
+        operation(argument)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+def search_terms(catalog, rng, count):
+    """A mix of what cashiers type: first letters, whole words, multi-word names and typos."""
+    names = [record.name for record in catalog.records.values()]
+    terms = []
+    for i in range(count):
+        name = rng.choice(names).lower()
+        word = rng.choice(name.split())
+        kind = i % 5
+        if kind == 0:
+            terms.append(name[:rng.randint(1, 3)])
+        elif kind == 1:
+            terms.append(word)
+        elif kind == 2:
+            terms.append(" ".join(name.split()[:2]))
+        elif kind == 3 and len(word) > 3:
+            position = rng.randrange(1, len(word) - 1)
+            terms.append(word[:position] + word[position + 1:])  # A dropped letter.
+        else:
+            terms.append(word[:3])
+    return terms
+
+
+def run_benchmarks(db_path, repeat, seed, log=print):
+    rng = random.Random(seed)
+    results = {}
+    storage = Storage(db_path)
+    storage.create_tables()  # Brings stores generated by older revisions up to the current schema.
+    product_ids = [row[0] for row in storage.conn.execute("SELECT id FROM products")]
+    sale_bounds = storage.conn.execute("SELECT MIN(id), MAX(id) FROM sales").fetchone()
+
+    def record(name, stats):
+        results[name] = stats
+        log(f"  {name:<24} p50 {stats['p50_ms']:9.3f} ms   p95 {stats['p95_ms']:9.3f} ms   n={stats['count']}")
+
+    def startup(_):
+        # The database work RetailApp does before the POS screen shows: open, check the schema, load products.
+        till = Storage(db_path)
+        try:
+            till.create_tables()
+            Catalog().load(till.load_catalog()[1])
+        finally:
+            till.close()
+
+    record("startup", measure(startup, range(3)))
+    catalog = Catalog()
+    record("catalog_load", measure(lambda _: catalog.load(storage.list_catalog()), range(3)))
+    record("search", measure(catalog.search, search_terms(catalog, rng, repeat)))
+
+    cart = Cart((("CGST", 900), ("SGST", 900)))
+
+    def add_to_cart(product_id):
+        # The catalog lookup and cart update of RetailApp.add_to_cart, and the totals shown, without the widgets.
+        product = catalog.get(product_id)
+        cart.add(product_id, product.name, product.price)
+        cart.total
+        if len(cart) > 20:
+            cart.clear()
+
+    record("add_to_cart", measure(add_to_cart, rng.choices(product_ids, k=repeat)))
+    record("scan_to_cart", measure(lambda code: add_to_cart(catalog.lookup_barcode(code).id),
+                                   [product_barcode(pid) for pid in rng.choices(product_ids, k=repeat)]))
+
+    def wholesale_basket(pids):
+        # A thousand-line order rung up line by line, the totals shown after every line.
+        basket = Cart((("CGST", 900), ("SGST", 900)))
+        for pid in pids:
+            product = catalog.get(pid)
+            basket.add(pid, product.name, product.price)
+            basket.total
+        return basket
+
+    record("wholesale_basket", measure(wholesale_basket, [rng.sample(product_ids, min(1000, len(product_ids)))
+                                                          for _ in range(5)]))
+
+    # The reorder check the till makes for every product of a sale after checkout.
+    forecast = StockForecast()
+    forecast.update(storage)
+    record("stock_status", measure(lambda pid: forecast.status(pid, catalog.get(pid).quantity),
+                                   rng.choices(product_ids, k=repeat)))
+
+    # The whole history read into the analytics totals, then (after the checkouts below) only the new sales.
+    analytics = SalesAnalytics()
+    record("analytics_full", measure(lambda _: SalesAnalytics().refresh(storage), range(1)))
+    analytics.refresh(storage)
+
+    # The change export timed below picks up from here, so it writes just the checkouts in between.
+    storage.set_export_watermark("benchmark", storage.latest_change(), storage.export_watermark("benchmark"))
+    engine = CheckoutEngine(db_path)
+    baskets = []
+    for _ in range(repeat):
+        basket = {}
+        for pid in rng.choices(product_ids, k=rng.randint(1, 6)):
+            basket[pid] = basket.get(pid, 0) + 1
+        cart = Cart()
+        for pid, qty in basket.items():
+            cart.add(pid, *storage.get_product(pid)[:2], qty)
+        baskets.append(cart)
+    record("checkout", measure(lambda cart: engine.submit(cart).result(), baskets))
+    engine.shutdown()
+    record("analytics_incremental", measure(lambda _: analytics.refresh(storage), range(1)))
+
+    record("sales_history_first", measure(lambda _: storage.list_sales_page(), range(repeat)))
+    # Deep pages continue from keys picked all over the history.
+    keys = []
+    if sale_bounds[0] is not None:
+        for sale_id in (rng.randint(*sale_bounds) for _ in range(repeat)):
+            row = storage.conn.execute("SELECT sale_date, id FROM sales WHERE id = ?", (sale_id,)).fetchone()
+            if row:
+                keys.append(row)
+    if keys:
+        record("sales_history_page", measure(lambda key: storage.list_sales_page(after=key), keys))
+        months = [key[0][:7] for key in keys]
+        record("sales_history_month", measure(
+            lambda month: storage.list_sales_page(date_from=f"{month}-01", date_to=f"{month}-31"), months))
+        record("sale_detail", measure(storage.get_sale_items, [key[1] for key in keys]))
+        record("sales_summary", measure(lambda month: storage.range_totals(f"{month}-01", f"{month}-31"), months))
+
+    # A supplier price list as long as the catalog, imported into a scratch store: first every row is a new
+    # product, then every row updates one.
+    directory = tempfile.mkdtemp(prefix="retail-bench-")
+    try:
+        price_list = os.path.join(directory, "price_list.csv")
+        with open(price_list, "w", newline="", encoding="utf-8") as handle:
+            handle.write("Name,Price,Quantity,Barcode\n")
+            handle.writelines(f"{product_name(i)},{rng.uniform(5, 2000):.2f},{rng.randint(0, 500)},"
+                              f"{product_barcode(i + 1)}\n" for i in range(len(product_ids)))
+        scratch = Storage(os.path.join(directory, "import.db"))
+        scratch.create_tables()
+        record("import_price_list_new", measure(lambda _: import_products(scratch, price_list), range(1)))
+        record("import_price_list_update", measure(lambda _: import_products(scratch, price_list), range(1)))
+        scratch.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    directory = tempfile.mkdtemp(prefix="retail-bench-")
+    date_from = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
+    date_to = datetime.now().strftime("%Y-%m-%d")
+    try:
+        for extension in ("csv", "xlsx"):
+            if extension == "xlsx" and importlib.util.find_spec("openpyxl") is None:
+                log("  xlsx export skipped: openpyxl is not installed")
+                continue
+            filename = os.path.join(directory, f"export.{extension}")
+            record(f"export_30_days_{extension}",
+                   measure(lambda _: export(storage, filename, date_from, date_to), range(3)))
+        record("export_changes", measure(lambda _: export_changes(storage, directory, "benchmark"), range(1)))
+        storage.forget_export("benchmark")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    storage.close()
+    return results
+
+
+# --- Multi-terminal ---
+def terminal_process(db_path, products, scarce, seconds, seed, start, results):
+    """One till: check out random baskets as fast as possible for ``seconds``."""
+    rng = random.Random(seed)
+    engine = CheckoutEngine(db_path)
+    sales = rejected = 0
+    start.wait()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        basket = {}
+        for pid in rng.choices(products, k=rng.randint(1, 4)) + (rng.sample(scarce, 1) if rng.random() < 0.3 else []):
+            basket[pid] = basket.get(pid, 0) + rng.randint(1, 2)
+        cart = Cart()
+        for pid, qty in basket.items():
+            cart.add(pid, f"Product {pid}", 100, qty)
+        try:
+            engine.submit(cart).result()
+            sales += 1
+        except InsufficientStockError:
+            rejected += 1
+    engine.shutdown()
+    results.put((sales, rejected))
+
+
+def run_terminals(db_path, terminals, seconds, seed, log=print):
+    """Race ``terminals`` till processes against one database; returns throughput and the oversell check."""
+    storage = Storage(db_path)
+    ids = [row[0] for row in storage.conn.execute("SELECT id FROM products ORDER BY id")]
+    scarce, products = ids[:SCARCE_PRODUCTS], ids[SCARCE_PRODUCTS:]
+    with storage.transaction():
+        storage.conn.executemany("UPDATE products SET quantity = ? WHERE id = ?", [(SCARCE_STOCK, pid) for pid in scarce])
+    first_sale = storage.conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0]
+
+    context = multiprocessing.get_context("spawn")
+    results, start = context.Queue(), context.Barrier(terminals + 1)
+    processes = [context.Process(target=terminal_process,
+                                 args=(db_path, products, scarce, seconds, seed + i, start, results))
+                 for i in range(terminals)]
+    for process in processes:
+        process.start()
+    start.wait()  # All tills are up; from here on only checkouts are being timed.
+    started = time.perf_counter()
+    outcomes = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+
+    sold = dict(storage.conn.execute(
+        "SELECT product_id, SUM(quantity) FROM sale_items WHERE sale_id > ? AND product_id IN (%s) GROUP BY product_id"
+        % ",".join("?" * len(scarce)), (first_sale, *scarce)).fetchall())
+    left = dict(storage.conn.execute("SELECT id, quantity FROM products WHERE id IN (%s)" % ",".join("?" * len(scarce)),
+                                     scarce).fetchall())
+    oversold = [pid for pid in scarce if left[pid] < 0 or sold.get(pid, 0) + left[pid] != SCARCE_STOCK]
+    with storage.transaction():
+        storage.conn.executemany("UPDATE products SET quantity = 1000000 WHERE id = ?", [(pid,) for pid in scarce])
+    storage.close()
+    sales = sum(outcome[0] for outcome in outcomes)
+    result = {"terminals": terminals, "seconds": elapsed, "sales": sales,
+              "rejected": sum(outcome[1] for outcome in outcomes), "sales_per_second": sales / elapsed,
+              "oversold_products": len(oversold)}
+    log(f"  {terminals:>2} terminals: {result['sales_per_second']:8.1f} sales/s, {result['rejected']} rejected "
+        f"for stock, {'NO oversells' if not oversold else f'{len(oversold)} products OVERSOLD'}")
+    return result
+
+
+# --- HTTP API ---
+async def api_client(port, products, terms, deadline, rng, samples):
+    """One keep-alive client sending a mix of searches, lookups and checkouts until ``deadline``."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    errors = 0
+    while time.monotonic() < deadline:
+        roll = rng.random()
+        if roll < 0.5:
+            method, path, body = "GET", f"/api/search?limit=20&q={quote(rng.choice(terms))}", b""
+        elif roll < 0.8:
+            method, path, body = "GET", f"/api/products/{rng.choice(products)}", b""
+        else:
+            lines = [{"product_id": pid, "quantity": rng.randint(1, 2)} for pid in rng.sample(products, 3)]
+            method, path, body = "POST", "/api/checkout", json.dumps({"lines": lines}).encode()
+        started = time.perf_counter()
+        writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while (line := await reader.readline()) != b"\r\n":
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        samples[method == "POST"].append(time.perf_counter() - started)
+        errors += status != 200
+    writer.close()
+    return errors
+
+
+def run_api(db_path, clients, seconds, seed, log=print):
+    """Load the HTTP API with ``clients`` concurrent connections for ``seconds``; returns requests per second."""
+    import api_server
+    storage = Storage(db_path)
+    products = [row[0] for row in storage.conn.execute("SELECT id FROM products ORDER BY id")][SCARCE_PRODUCTS:]
+    catalog = Catalog()
+    catalog.load(storage.list_catalog())
+    storage.close()
+    rng = random.Random(seed)
+    terms = search_terms(catalog, rng, 500)
+    with socket.socket() as probe:  # A free port for the server.
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    server = context.Process(target=api_server.run, args=(db_path, "127.0.0.1", port), kwargs={"ready": ready})
+    server.start()
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("The API server did not start.")
+
+        async def load():
+            samples = ([], [])
+            deadline = time.monotonic() + seconds
+            errors = await asyncio.gather(*(api_client(port, products, terms, deadline,
+                                                       random.Random(seed + i), samples) for i in range(clients)))
+            return samples, sum(errors)
+
+        started = time.perf_counter()
+        (reads, checkouts), errors = asyncio.run(load())
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.join()
+    requests = len(reads) + len(checkouts)
+    result = {"clients": clients, "seconds": elapsed, "requests": requests, "errors": errors,
+              "requests_per_second": requests / elapsed, "reads": summarize(reads),
+              "checkouts": summarize(checkouts)}
+    log(f"  API, {clients} clients: {result['requests_per_second']:8.1f} requests/s, {errors} errors, "
+        f"reads p50 {result['reads']['p50_ms']:.1f} ms, checkouts p50 {result['checkouts']['p50_ms']:.1f} ms "
+        f"p95 {result['checkouts']['p95_ms']:.1f} ms")
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# --- Comparison ---
+def compare(baseline_path, current_path, threshold=REGRESSION_THRESHOLD):
+    """Print per-benchmark changes between two result files. Returns True if nothing regressed."""
+    with open(baseline_path) as handle:
+        baseline = json.load(handle)
+    with open(current_path) as handle:
+        current = json.load(handle)
+    for label, run in (("baseline", baseline), ("current", current)):
+        meta = run["meta"]
+        print(f"{label:<9} {meta['size']} @ {meta['revision']} ({meta['timestamp']}, {meta['python']})")
+    if baseline["meta"]["store"] != current["meta"]["store"]:
+        print("warning: the runs used differently sized stores")
+    ok = True
+    for name, stats in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        keys = ("p50_ms", "p95_ms")
+        changes = [(stats[key] - before[key]) / before[key] if before[key] else 0.0 for key in keys]
+        slower = any(change > threshold and stats[key] - before[key] > NOISE_FLOOR_MS
+                     for key, change in zip(keys, changes))
+        ok = ok and not slower
+        print(f"{name:<24} p50 {before['p50_ms']:9.3f} -> {stats['p50_ms']:9.3f} ms ({changes[0]:+7.1%})   "
+              f"p95 {before['p95_ms']:9.3f} -> {stats['p95_ms']:9.3f} ms ({changes[1]:+7.1%})"
+              + ("   SLOWER" if slower else ""))
+    before_terminals = {run["terminals"]: run for run in baseline.get("terminals", [])}
+    for run in current.get("terminals", []):
+        before = before_terminals.get(run["terminals"])
+        if before is None:
+            continue
+        change = (run["sales_per_second"] - before["sales_per_second"]) / before["sales_per_second"]
+        slower = change < -threshold
+        ok = ok and not slower and not run["oversold_products"]
+        print(f"{run['terminals']:>2} terminals{'':<13} {before['sales_per_second']:9.1f} -> "
+              f"{run['sales_per_second']:9.1f} sales/s ({change:+7.1%})" + ("   SLOWER" if slower else "")
+              + ("   OVERSOLD" if run["oversold_products"] else ""))
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Retail POS on a synthetic store.")
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--products", type=int, help="override the product count of --size")
+    parser.add_argument("--lines", type=int, help="override the sale line count of --size")
+    parser.add_argument("--repeat", type=int, default=200, help="samples per benchmark")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--regenerate", action="store_true", help="rebuild the scratch store first")
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="compare two result files")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--terminals", type=int, default=0, help="also race up to this many till processes")
+    parser.add_argument("--terminal-seconds", type=float, default=TERMINAL_SECONDS)
+    parser.add_argument("--api", type=int, default=0, metavar="CLIENTS",
+                        help="also load the HTTP API with this many concurrent clients")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return 0 if compare(*args.compare, threshold=args.threshold) else 1
+
+    products, lines = SIZES[args.size]
+    products, lines = args.products or products, args.lines or lines
+    size = args.size if (products, lines) == SIZES[args.size] else f"{products}p-{lines}l"
+    db_path = prepare_store(size, products, lines, args.seed, args.regenerate)
+    print(f"Benchmarking {db_path}")
+    results = run_benchmarks(db_path, args.repeat, args.seed)
+    terminals = []
+    if args.terminals:
+        counts = sorted({min(2 ** i, args.terminals) for i in range(args.terminals.bit_length() + 1)})
+        terminals = [run_terminals(db_path, count, args.terminal_seconds, args.seed) for count in counts]
+    api = run_api(db_path, args.api, args.terminal_seconds, args.seed) if args.api else None
+    report = {"meta": {"size": size, "store": {"products": products, "lines": lines, "seed": args.seed},
+                       "repeat": args.repeat, "revision": git_revision(),
+                       "timestamp": datetime.now().isoformat(timespec="seconds"),
+                       "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                       "platform": platform.platform(), "machine": platform.machine()},
+              "results": results, "terminals": terminals, "api": api}
+    if args.out:
+        with open(args.out, "w") as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Results written to {args.out}")
+    return 1 if any(run["oversold_products"] for run in terminals) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
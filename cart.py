@@ -0,0 +1,200 @@
+"""The cart of the sale being rung up.
+
+Amounts are whole paise (see money.py). The cart keeps its subtotal, line
+discounts and unit count as running sums, adjusted by each change to a
+line, so the totals cost the same for a wholesale basket of a thousand
+lines as for a single item. Taxes are worked out from those sums when
+asked for, a multiplication per tax rate.
+
+A line's discount comes off that line; the cart's own discount comes off
+the rest of the sale. Tax rates apply to what is left after discounts:
+added on top of it, or, when prices already include tax, split out of it
+for the receipt.
+"""
+from decimal import Decimal, InvalidOperation
+
+from money import format_amount, share, to_paise
+
+BASIS_POINTS = 10_000  # A rate of 18% is 1800 basis points.
+
+
+class CartLine:
+    """One product in the cart: its unit price when added, the quantity and the discount on the line."""
+
+    __slots__ = ("product_id", "name", "price", "quantity", "discount")
+
+    def __init__(self, product_id, name, price, quantity=0, discount=0):
+        self.product_id = product_id
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+        self.discount = discount
+
+    @property
+    def gross(self):
+        return self.price * self.quantity
+
+    @property
+    def amount(self):
+        return self.price * self.quantity - self.discount
+
+
+class Cart:
+    """Lines keyed by product id, in the order they were added, with running totals."""
+
+    __slots__ = ("lines", "tax_rates", "tax_inclusive", "subtotal", "line_discounts", "discount", "units")
+
+    def __init__(self, tax_rates=(), tax_inclusive=False):
+        self.lines = {}
+        self.tax_rates = tuple(tax_rates)  # (label, basis points)
+        self.tax_inclusive = tax_inclusive
+        self.subtotal = 0  # Price times quantity over every line.
+        self.line_discounts = 0
+        self.discount = 0  # Off the whole sale, after the line discounts.
+        self.units = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __contains__(self, product_id):
+        return product_id in self.lines
+
+    def __iter__(self):
+        return iter(self.lines.values())
+
+    def get(self, product_id):
+        return self.lines.get(product_id)
+
+    def quantity(self, product_id):
+        line = self.lines.get(product_id)
+        return line.quantity if line is not None else 0
+
+    def add(self, product_id, name, price, quantity=1):
+        """Add ``quantity`` of a product; a product already in the cart keeps the price it was added at."""
+        line = self.lines.get(product_id)
+        if line is None:
+            line = self.lines[product_id] = CartLine(product_id, name, price)
+        self._set_quantity(line, line.quantity + quantity)
+        return line
+
+    def set_quantity(self, product_id, quantity):
+        """Change a line's quantity; 0 or less removes it."""
+        if quantity <= 0:
+            return self.remove(product_id)
+        self._set_quantity(self.lines[product_id], quantity)
+
+    def _set_quantity(self, line, quantity):
+        self.subtotal += line.price * (quantity - line.quantity)
+        self.units += quantity - line.quantity
+        line.quantity = quantity
+        if line.discount > line.gross:  # A discount never exceeds what is left of the line.
+            self.line_discounts -= line.discount - line.gross
+            line.discount = line.gross
+
+    def remove(self, product_id):
+        line = self.lines.pop(product_id, None)
+        if line is not None:
+            self.subtotal -= line.gross
+            self.units -= line.quantity
+            self.line_discounts -= line.discount
+
+    def clear(self):
+        self.lines.clear()
+        self.subtotal = self.line_discounts = self.discount = self.units = 0
+
+    def set_line_discount(self, product_id, paise):
+        """Take ``paise`` off a line. Raises ValueError if it is negative or more than the line."""
+        line = self.lines[product_id]
+        if not 0 <= paise <= line.gross:
+            raise ValueError(f"The discount must be between 0 and {format_amount(line.gross)}.")
+        self.line_discounts += paise - line.discount
+        line.discount = paise
+
+    def set_discount(self, paise):
+        """Take ``paise`` off the whole sale. Raises ValueError if it is negative or more than the sale."""
+        most = self.subtotal - self.line_discounts
+        if not 0 <= paise <= most:
+            raise ValueError(f"The discount must be between 0 and {format_amount(most)}.")
+        self.discount = paise
+
+    @property
+    def total_discount(self):
+        # Lines removed after the sale discount was set can leave it larger than the rest of the sale.
+        return min(self.line_discounts + self.discount, self.subtotal)
+
+    @property
+    def net(self):
+        return self.subtotal - self.total_discount
+
+    def taxes(self):
+        """(label, basis points, paise) per tax rate, on the sale after discounts."""
+        net, rates = self.net, self.tax_rates
+        if not self.tax_inclusive:
+            return [(label, rate, share(net, rate, BASIS_POINTS)) for label, rate in rates]
+        combined = sum(rate for _, rate in rates)
+        if not combined:
+            return [(label, rate, 0) for label, rate in rates]
+        included = net - share(net, BASIS_POINTS, BASIS_POINTS + combined)
+        # Split by rate; the last rate takes the rounding remainder so the parts add up to the tax included.
+        parts = [share(included, rate, combined) for _, rate in rates[:-1]]
+        parts.append(included - sum(parts))
+        return [(label, rate, part) for (label, rate), part in zip(rates, parts)]
+
+    @property
+    def tax(self):
+        return sum(amount for _, _, amount in self.taxes())
+
+    @property
+    def total(self):
+        return self.net if self.tax_inclusive else self.net + self.tax
+
+    def items(self):
+        """(product_id, name, quantity, price, discount) per line, as Storage.record_sale takes them."""
+        return [(line.product_id, line.name, line.quantity, line.price, line.discount) for line in self.lines.values()]
+
+    def copy(self):
+        """An independent copy, to hand to another thread while this one keeps changing."""
+        cart = Cart(self.tax_rates, self.tax_inclusive)
+        cart.lines = {pid: CartLine(line.product_id, line.name, line.price, line.quantity, line.discount)
+                      for pid, line in self.lines.items()}
+        cart.subtotal, cart.line_discounts = self.subtotal, self.line_discounts
+        cart.discount, cart.units = self.discount, self.units
+        return cart
+
+
+def parse_discount(text, amount):
+    """Paise off ``amount`` for a discount typed as rupees ('50') or a percentage ('10%'); 0 for blank text.
+    Raises ValueError if it is not a valid discount."""
+    text = text.strip()
+    if not text:
+        return 0
+    if text.endswith("%"):
+        try:
+            percent = Decimal(text[:-1].strip())
+        except InvalidOperation:
+            raise ValueError(f"'{text}' is not a percentage.") from None
+        if not 0 <= percent <= 100:
+            raise ValueError("A percentage discount must be between 0% and 100%.")
+        return share(amount, int(percent * 100), BASIS_POINTS)
+    return to_paise(text)
+
+
+def parse_tax_rates(text):
+    """(label, basis points) pairs from text such as 'CGST 9%, SGST 9%'; a rate without a label is called Tax.
+    Raises ValueError if a rate is missing or not a percentage from 0 to 100."""
+    rates = []
+    for part in filter(None, (part.strip() for part in text.split(","))):
+        label, _, rate = part.rstrip("%").strip().rpartition(" ")
+        try:
+            percent = Decimal(rate)
+        except InvalidOperation:
+            raise ValueError(f"'{part}' needs a rate, such as 'GST 18%'.") from None
+        if not 0 <= percent <= 100:
+            raise ValueError(f"The rate of '{part}' must be between 0% and 100%.")
+        rates.append((label.strip() or "Tax", int(percent * 100)))
+    return tuple(rates)
+
+
+def format_tax_rates(rates):
+    """The text parse_tax_rates reads back, such as 'CGST 9%, SGST 9%'."""
+    return ", ".join(f"{label} {Decimal(rate) / 100:g}%" for label, rate in rates)
@@ -0,0 +1,111 @@
+"""In-memory product catalog for the till.
+
+Every product is held in a small slotted record keyed by id, so clicking a
+tile, scanning an item or selecting an inventory row is a dict lookup rather
+than a database round trip. Name searches go through the SearchIndex kept
+alongside it. The screens write through: each product insert, update, stock
+clear and checkout hands the fresh database row to ``apply``. Barcodes map
+straight to their product, so a scan resolves with one dict lookup.
+
+Rows carry the product's ``version`` column, which every UPDATE of the
+product increments. A row older than the record already held is stale, for
+instance a lookup that was overtaken by a checkout, and is ignored. The
+catalog's own ``version`` counts applied changes, so a view can tell whether
+anything changed since it last drew.
+"""
+from search_index import SearchIndex
+from storage import parse_barcodes
+
+
+class ProductRecord:
+    """One product as last read from the database."""
+
+    __slots__ = ("id", "name", "price", "quantity", "image_path", "version", "barcodes")
+
+    def __init__(self, product_id, name, price, quantity, image_path, version, barcodes=()):
+        self.id = product_id
+        self.name = name
+        self.price = price
+        self.quantity = quantity
+        self.image_path = image_path
+        self.version = version
+        self.barcodes = barcodes
+
+
+class Catalog:
+    """Products keyed by id plus a name index, kept current by write-through."""
+
+    def __init__(self):
+        self.records = {}
+        self.barcodes = {}  # barcode -> product id
+        self.index = SearchIndex()
+        self.version = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, product_id):
+        return product_id in self.records
+
+    def get(self, product_id):
+        return self.records.get(product_id)
+
+    def lookup_barcode(self, barcode):
+        """The record a scanned barcode belongs to, or None."""
+        product_id = self.barcodes.get(barcode)
+        return None if product_id is None else self.records.get(product_id)
+
+    def load(self, rows):
+        """Replace the contents with ``rows`` of (id, name, price, quantity, image_path, version, barcodes)."""
+        self.clear()
+        for row in rows:
+            self.apply(row)
+
+    def apply(self, row):
+        """Store a product row unless a newer version is already held. Returns True if anything changed."""
+        product_id, name, price, quantity, image_path, version, barcodes = row
+        image_path, barcodes = image_path or "", parse_barcodes(barcodes)
+        record = self.records.get(product_id)
+        if record is None:
+            record = self.records[product_id] = ProductRecord(product_id, name, price, quantity, image_path, version)
+        elif version < record.version or (version == record.version and (
+                record.name, record.price, record.quantity, record.image_path, record.barcodes) == (
+                name, price, quantity, image_path, barcodes)):
+            return False
+        else:
+            record.name, record.price, record.quantity = name, price, quantity
+            record.image_path, record.version = image_path, version
+        if barcodes != record.barcodes:
+            self._forget_barcodes(record)
+            record.barcodes = barcodes
+            for barcode in barcodes:
+                self.barcodes[barcode] = product_id
+        self.index.upsert(product_id, name, price, quantity, image_path)
+        self.version += 1
+        return True
+
+    def _forget_barcodes(self, record):
+        for barcode in record.barcodes:
+            if self.barcodes.get(barcode) == record.id:
+                del self.barcodes[barcode]
+
+    def remove(self, product_id):
+        record = self.records.pop(product_id, None)
+        if record is not None:
+            self._forget_barcodes(record)
+            self.index.remove(product_id)
+            self.version += 1
+
+    def clear(self):
+        self.records.clear()
+        self.barcodes.clear()
+        self.index.clear()
+        self.version += 1
+
+    def search(self, term, in_stock_only=True):
+        """Grid tiles (id, name, price, image_path) matching ``term``; see SearchIndex.search."""
+        return self.index.search(term, in_stock_only)
+
+    def inventory_rows(self):
+        """(id, name, price, quantity) for every product, in id order, for the Inventory list."""
+        return [(r.id, r.name, r.price, r.quantity) for _, r in sorted(self.records.items())]
@@ -0,0 +1,82 @@
+"""Headless checkout engine.
+
+Sales are written by a dedicated writer thread with its own SQLite
+connection, so the Tk thread never waits on a commit. Each sale is one
+immediate transaction with batched line inserts and conditional stock
+decrements (see ``Storage.record_sale``), which keeps several tills selling
+from the same database from overselling.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import recorder
+from storage import Storage
+
+# Sales per second are averaged over this many recent seconds.
+THROUGHPUT_WINDOW = 60.0
+
+
+class CheckoutEngine:
+    """Serializes checkouts onto one writer thread and tracks their throughput."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.storage = None
+        self.completed = 0
+        self.failed = 0
+        self._recent = deque()  # time.monotonic() of each sale inside the throughput window
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkout", initializer=self._open)
+        self._executor.submit(time.monotonic)  # Starts the writer and opens its connection before the first sale.
+
+    def _open(self):
+        self.storage = Storage(self.db_path)
+
+    def submit(self, cart):
+        """Queue the sale of a Cart and return a Future resolving to its details.
+
+        The cart is copied here, so it can be cleared or changed at once.
+        The Future's result is a dict with ``sale_id``, ``items``,
+        ``subtotal``, ``discount``, ``taxes``, ``tax_inclusive``, ``total``,
+        ``date`` and ``products``, the sold products' catalog rows as they
+        stand after the sale; it raises InsufficientStockError if stock ran
+        out.
+        """
+        return self._executor.submit(recorder.bind(self.checkout), cart.copy())
+
+    def checkout(self, cart):
+        """Record a sale on the calling thread. Normally reached through submit()."""
+        total, taxes = cart.total, cart.taxes()
+        try:
+            sale_id = self.storage.record_sale(cart.items(), total, cart.total_discount,
+                                               sum(amount for _, _, amount in taxes))
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        products = [self.storage.get_catalog_row(line.product_id) for line in cart]
+        now = time.monotonic()
+        with self._lock:
+            self.completed += 1
+            self._recent.append(now)
+        return {"sale_id": sale_id, "total": total, "date": self.storage.sale_date(sale_id),
+                "subtotal": cart.subtotal, "discount": cart.total_discount, "taxes": taxes,
+                "tax_inclusive": cart.tax_inclusive,
+                "items": [{'product_id': line.product_id, 'name': line.name, 'quantity': line.quantity,
+                           'price': line.price, 'discount': line.discount} for line in cart],
+                "products": [row for row in products if row]}
+
+    def sales_per_second(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] > THROUGHPUT_WINDOW:
+                self._recent.popleft()
+            if not self._recent:
+                return 0.0
+            return len(self._recent) / max(now - self._recent[0], 1.0)
+
+    def shutdown(self):
+        self._executor.submit(lambda: self.storage.close())
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,152 @@
+"""Export what changed since the last export, for nightly syncs to the accounting system.
+
+Every write to a product, and every sale and sale line recorded, is logged
+in the database's change log under an increasing sequence number. An
+export target ('accounting' unless told otherwise) keeps a watermark in the
+database: the last change it has written out. A run reads the changes
+after the watermark, in one read transaction so the tills keep selling, and
+writes the rows they touched, so it costs what the day's activity costs
+rather than what the whole database does. A target's first run, or one that
+has fallen behind the changes the database keeps, writes every product,
+sale and sale line in the live database instead.
+
+A run writes a folder named after its time and change range, holding
+products, sales and sale_items as CSV or JSON Lines and a manifest.json.
+The folder only gets its name once every file is complete, and the
+watermark moves only after that, in one transaction. A run that fails in
+between leaves the watermark where it was and the next one writes those
+changes again; rows carry their ids, and products the operation ('I', 'U'
+or 'D'), so applying a batch twice does no harm. Amounts are written out
+in rupees, as in the Excel export.
+
+Sales moved to the sales archive are no longer in the live tables, so
+export a target more often than the archive's ARCHIVE_KEEP_MONTHS::
+
+    python delta_export.py export --out exports/accounting
+    python delta_export.py export --out exports/accounting --format jsonl
+    python delta_export.py status
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+from datetime import datetime
+
+from export import EXPORT_CHUNK_ROWS, in_rupees
+from storage import Storage
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "retail.db")
+DEFAULT_TARGET = "accounting"
+FORMATS = ("csv", "jsonl")
+# (file name, columns, Storage method reading the rows, indexes of the columns holding money)
+TABLES = (("products", ("op", "id", "name", "price", "quantity", "image_path"), "changed_products", (3,)),
+          ("sales", ("id", "total_price", "sale_date", "discount", "tax"), "changed_sales", (1, 3, 4)),
+          ("sale_items", ("id", "sale_id", "product_id", "product_name", "quantity", "price", "discount"),
+           "changed_sale_items", (5, 6)))
+
+
+class WatermarkMoved(Exception):
+    """Another export of the same target finished first; this run's files were removed."""
+
+
+def write_table(path, columns, cursor, money, fmt, chunk_size=EXPORT_CHUNK_ROWS):
+    """Write ``cursor``'s rows to ``path`` as CSV with a header row, or as one JSON object per line.
+    Returns the number of rows written."""
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle) if fmt == "csv" else None
+        if writer is not None:
+            writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            rows = in_rupees(rows, money)
+            if writer is not None:
+                writer.writerows(rows)
+            else:
+                handle.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+            count += len(rows)
+        handle.flush()
+        os.fsync(handle.fileno())  # On disk before the watermark says it was exported.
+    return count
+
+
+def export_changes(storage, out_dir, target=DEFAULT_TARGET, fmt="csv", full=False, chunk_size=EXPORT_CHUNK_ROWS):
+    """Write the rows changed since ``target``'s watermark to a new folder of ``out_dir`` and move the
+    watermark on. Returns (folder name, {table: rows written}), or None when nothing has changed.
+
+    ``full`` writes every live row regardless of the watermark, to start a
+    target over. Raises WatermarkMoved if another export of the target
+    finished while this one ran.
+    """
+    started = datetime.now()
+    with storage.transaction():
+        watermark, until, first = storage.export_watermark(target), storage.latest_change(), storage.first_change()
+        after = None if full else watermark
+        # A log pruned past the watermark, or one older than it after a restore, cannot give the changes since.
+        if after is not None and (after > until or (first is not None and first > after + 1)):
+            after = None
+        if after == until:
+            return None
+        name = started.strftime("%Y-%m-%d_%H%M%S") + (f"_{after + 1}-{until}" if after is not None else f"_full-{until}")
+        folder, part = os.path.join(out_dir, name), os.path.join(out_dir, name + ".part")
+        shutil.rmtree(part, ignore_errors=True)
+        os.makedirs(part)
+        try:
+            counts = {table: write_table(os.path.join(part, f"{table}.{fmt}"), columns,
+                                         getattr(storage, method)(after, until), money, fmt, chunk_size)
+                      for table, columns, method, money in TABLES}
+            with open(os.path.join(part, "manifest.json"), "w", encoding="utf-8") as handle:
+                json.dump({"target": target, "full": after is None, "after_seq": after, "until_seq": until,
+                           "exported_at": started.strftime("%Y-%m-%d %H:%M:%S"), "format": fmt,
+                           "amounts": "rupees", "rows": counts}, handle, indent=2)
+        except BaseException:
+            shutil.rmtree(part, ignore_errors=True)
+            raise
+    os.replace(part, folder)
+    if not storage.set_export_watermark(target, until, watermark):
+        shutil.rmtree(folder, ignore_errors=True)
+        raise WatermarkMoved(f"Another export of '{target}' finished first; nothing was kept from this one.")
+    return name, counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the products, sales and sale items changed since the "
+                                                 "last export.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="database file (default: the till's)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write the changes since the target's last export")
+    export.add_argument("--out", required=True, help="folder the export folders are written to")
+    export.add_argument("--target", default=DEFAULT_TARGET, help=f"whose watermark to use (default: {DEFAULT_TARGET})")
+    export.add_argument("--format", choices=FORMATS, default="csv")
+    export.add_argument("--full", action="store_true", help="write every live row and start over from here")
+    commands.add_parser("status", help="list the export targets and their watermarks")
+    forget = commands.add_parser("forget", help="stop keeping changes for a target no longer exported")
+    forget.add_argument("target")
+    args = parser.parse_args(argv)
+
+    storage = Storage(args.db)
+    try:
+        storage.create_tables()
+        if args.command == "export":
+            os.makedirs(args.out, exist_ok=True)
+            exported = export_changes(storage, args.out, args.target, args.format, args.full)
+            if exported is None:
+                print("Nothing has changed since the last export.")
+            else:
+                name, counts = exported
+                print(f"{os.path.join(args.out, name)}: " + ", ".join(f"{n} {table}" for table, n in counts.items()))
+        elif args.command == "status":
+            latest = storage.latest_change()
+            for target, seq, exported_at in storage.export_watermarks():
+                print(f"{target}: change {seq} of {latest}, exported {exported_at}")
+        else:
+            storage.forget_export(args.target)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Streaming export of products and sales to Excel or CSV.
+
+Rows are pulled from SQLite in chunks with ``fetchmany`` and written straight
+out, through openpyxl's write-only mode for .xlsx files and the csv module
+otherwise, so memory use stays flat however long the date range is. The
+export runs inside one read transaction, which gives it a consistent
+snapshot without blocking checkouts in WAL mode. It is meant to run off the
+Tk thread: it reports progress through a callback and stops between chunks
+when asked to. The summary sheets come from the sales rollup tables, so
+they cost a row per day or product rather than a scan of every sale line.
+Sales moved to the archive are read from the attached archive files.
+Amounts are stored in paise and written out in rupees.
+"""
+import csv
+import os
+
+from money import rupees
+
+EXPORT_CHUNK_ROWS = 5000
+
+PRODUCT_HEADERS = ["ID", "Name", "Price (Rs.)", "Quantity", "Image Path"]
+SALES_HEADERS = ["Sale ID", "Total Price (Rs.)", "Date", "Discount (Rs.)", "Tax (Rs.)"]
+DAILY_HEADERS = ["Date", "Sales", "Items Sold", "Revenue (Rs.)"]
+PRODUCT_TOTAL_HEADERS = ["Product ID", "Product Name", "Quantity Sold", "Revenue (Rs.)"]
+SALE_ITEM_HEADERS = ["Sale Item ID", "Sale ID", "Product ID", "Product Name", "Quantity", "Price (Rs.)",
+                     "Discount (Rs.)"]
+
+
+def in_rupees(rows, columns):
+    """``rows`` with the paise in ``columns`` (indexes) turned into rupees."""
+    if not columns:
+        return rows
+    converted = []
+    for row in rows:
+        row = list(row)
+        for column in columns:
+            row[column] = rupees(row[column])
+        converted.append(row)
+    return converted
+
+
+class ExportCancelled(Exception):
+    """The export was cancelled before it finished; nothing was written."""
+
+
+class XlsxWriter:
+    """One workbook, one sheet per table, written with openpyxl's write-only mode."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        from openpyxl import Workbook  # Only .xlsx exports need it; importing it is slow.
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+
+    def start_table(self, title, headers):
+        self.sheet = self.workbook.create_sheet(title=title)
+        self.sheet.append(headers)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.sheet.append(row)
+
+    def close(self):
+        # Saved under a temporary name first so a failed save never leaves half a file behind.
+        self.workbook.save(self.filename + ".part")
+        os.replace(self.filename + ".part", self.filename)
+
+    def discard(self):
+        if os.path.exists(self.filename + ".part"):
+            os.remove(self.filename + ".part")
+
+
+class CsvWriter:
+    """One CSV file per table, named after the chosen file: export_products.csv, export_sales.csv, ..."""
+
+    def __init__(self, filename):
+        self.base = os.path.splitext(filename)[0]
+        self.files = []  # (final path, open file)
+        self.writer = None
+
+    def start_table(self, title, headers):
+        path = f"{self.base}_{title.lower().replace(' ', '_')}.csv"
+        handle = open(path + ".part", "w", newline="", encoding="utf-8")
+        self.files.append((path, handle))
+        self.writer = csv.writer(handle)
+        self.writer.writerow(headers)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        for path, handle in self.files:
+            handle.close()
+            os.replace(path + ".part", path)
+
+    def discard(self):
+        for path, handle in self.files:
+            handle.close()
+            if os.path.exists(path + ".part"):
+                os.remove(path + ".part")
+
+
+def export(storage, filename, date_from, date_to, progress=None, cancelled=None, chunk_size=EXPORT_CHUNK_ROWS):
+    """Write all products, then the daily and per-product totals, sales and sale items dated
+    ``date_from``..``date_to`` (inclusive).
+
+    ``progress(done, total)`` is called after every chunk and ``cancelled()``
+    is checked before every chunk; both run on the exporting thread.
+    Returns the number of data rows written.
+    """
+    writer = XlsxWriter(filename) if filename.lower().endswith(".xlsx") else CsvWriter(filename)
+    done = 0
+    try:
+        storage.attach_archives(date_from, date_to)  # Archived months in the range are exported too.
+        with storage.transaction():
+            total = storage.count_export_rows(date_from, date_to)
+            # (title, headers, cursor, indexes of the columns holding money)
+            tables = (("Products", PRODUCT_HEADERS, storage.export_products(), (2,)),
+                      ("Daily Totals", DAILY_HEADERS, storage.daily_totals(date_from, date_to), (3,)),
+                      ("Product Totals", PRODUCT_TOTAL_HEADERS, storage.product_totals(date_from, date_to), (3,)),
+                      ("Sales", SALES_HEADERS, storage.export_sales(date_from, date_to), (1, 3, 4)),
+                      ("Sale Items", SALE_ITEM_HEADERS, storage.export_sale_items(date_from, date_to), (5, 6)))
+            for title, headers, cursor, money in tables:
+                writer.start_table(title, headers)
+                while True:
+                    if cancelled is not None and cancelled():
+                        raise ExportCancelled()
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    writer.write_rows(in_rupees(rows, money))
+                    done += len(rows)
+                    if progress is not None:
+                        progress(done, total)
+        writer.close()
+    except BaseException:
+        writer.discard()
+        raise
+    return done
@@ -0,0 +1,180 @@
+"""Demand forecasting, reorder points and purchase orders.
+
+Each product's demand is tracked as an exponentially weighted moving
+average and variance of the quantity sold per day. Every sale already adds
+to its day's row of the product_sales_daily rollup, so the statistics fold
+in one row per product per completed day rather than reading sale_items.
+Days without a sale count as zero demand. The statistics are saved with
+the last day folded in, shared by every till on the database, so after the
+first run an update only reads the days since then.
+
+From the statistics and the stock on hand, each product gets a reorder
+point, the stock expected to cover demand over the supplier lead time with
+a safety margin, and the days its stock will last. Looking these up is a
+few array reads, cheap enough to repeat after every checkout.
+"""
+import csv
+import itertools
+import math
+import os
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+# Weight of the newest day; about the last 2/alpha days dominate the average.
+DEMAND_ALPHA = 0.1
+# Days from placing an order to the stock arriving, and the days of demand an order should cover beyond that.
+LEAD_DAYS = 7
+COVER_DAYS = 14
+# Standard deviations of lead-time demand held as safety stock; 1.65 runs out in about one lead time in 20.
+SAFETY_Z = 1.65
+# Below this many units a day a product counts as not selling, and gets no reorder point.
+MIN_DAILY_DEMAND = 0.01
+PURCHASE_ORDER_HEADERS = ["Product ID", "Name", "In Stock", "Daily Demand", "Days of Cover", "Reorder At",
+                          "Order Quantity"]
+
+
+class StockStatus:
+    """Where one product's stock stands against its forecast demand."""
+
+    __slots__ = ("daily_demand", "days_of_cover", "reorder_point", "order_quantity")
+
+    def __init__(self, daily_demand, days_of_cover, reorder_point, order_quantity):
+        self.daily_demand = daily_demand
+        self.days_of_cover = days_of_cover
+        self.reorder_point = reorder_point
+        self.order_quantity = order_quantity
+
+    @property
+    def low(self):
+        return self.order_quantity > 0
+
+
+class StockForecast:
+    """Per-product demand statistics, updated a day at a time from the daily rollup."""
+
+    def __init__(self, alpha=DEMAND_ALPHA, lead_days=LEAD_DAYS, cover_days=COVER_DAYS, safety_z=SAFETY_Z):
+        self.alpha = alpha
+        self.lead_days = lead_days
+        self.cover_days = cover_days
+        self.safety_z = safety_z
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the statistics, for instance after the sales history was cleared; update reloads them."""
+        with self._lock:
+            self.through = None  # Last day folded in, 'YYYY-MM-DD'.
+            # (mean, variance) of daily demand indexed by product id, replaced as one so readers need no lock.
+            self.stats = (np.zeros(0), np.zeros(0))
+
+    def stale(self, today=None):
+        """Whether a day has completed since the last update."""
+        yesterday = ((today or date.today()) - timedelta(days=1)).isoformat()
+        return self.through is None or self.through < yesterday
+
+    def update(self, storage, today=None):
+        """Fold the days completed since the last update into the statistics and save them.
+
+        Another till may have done so first; its saved statistics are then
+        used instead. Returns True if the statistics changed.
+        """
+        today = today or date.today()
+        yesterday = (today - timedelta(days=1)).isoformat()
+        with self._lock:
+            if not self.stale(today):
+                return False
+            through, rows = storage.demand_state()
+            changed = self._load(through, rows)
+            if not self.stale(today):
+                return changed
+            daily = storage.daily_quantities(through or "", today.isoformat()).fetchall()
+            if not daily and through is None:
+                return changed  # No sales yet; nothing to start from.
+            mean, variance = self._fold(daily, yesterday)
+            if storage.save_demand([(product_id, float(mean[product_id]), float(variance[product_id]))
+                                    for product_id in np.flatnonzero(mean > 0).tolist()], yesterday, through):
+                self.stats, self.through = (mean, variance), yesterday
+            else:
+                self._load(*storage.demand_state())
+            return True
+
+    def _load(self, through, rows):
+        if through == self.through:
+            return False
+        size = max((product_id for product_id, _, _ in rows), default=-1) + 1
+        mean, variance = np.zeros(size), np.zeros(size)
+        for product_id, product_mean, product_variance in rows:
+            mean[product_id], variance[product_id] = product_mean, product_variance
+        self.stats, self.through = (mean, variance), through
+        return True
+
+    def _fold(self, daily, last_day):
+        """The statistics after folding ``daily`` (day, product_id, quantity) rows, in day order, and zero
+        demand for the days without rows, up to ``last_day``."""
+        old_mean, old_variance = self.stats
+        size = max(len(old_mean), max((row[1] for row in daily), default=-1) + 1)
+        mean, variance = np.zeros(size), np.zeros(size)
+        mean[:len(old_mean)], variance[:len(old_variance)] = old_mean, old_variance
+        alpha, keep = self.alpha, 1 - self.alpha
+        day = date.fromisoformat(self.through) if self.through else None
+
+        def zero_days(count):
+            nonlocal mean, variance
+            for _ in range(count):
+                variance = keep * (variance + alpha * mean * mean)
+                mean = keep * mean
+
+        for day_text, rows in itertools.groupby(daily, key=lambda row: row[0]):
+            current = date.fromisoformat(day_text)
+            if day is not None:
+                zero_days((current - day).days - 1)
+            sold = np.zeros(size)
+            for _, product_id, quantity in rows:
+                sold[product_id] += quantity
+            # A product's first day of sales starts its average rather than being averaged with nothing.
+            new = (mean == 0) & (sold > 0)
+            diff = sold - mean
+            variance = np.where(new, 0.0, keep * (variance + alpha * diff * diff))
+            mean = np.where(new, sold, mean + alpha * diff)
+            day = current
+        if day is not None:
+            zero_days((date.fromisoformat(last_day) - day).days)
+        return mean, variance
+
+    def status(self, product_id, quantity):
+        """StockStatus of a product with ``quantity`` in stock, or None if it has no demand to speak of."""
+        mean, variance = self.stats
+        if product_id >= len(mean) or mean[product_id] < MIN_DAILY_DEMAND:
+            return None
+        daily, deviation = float(mean[product_id]), math.sqrt(float(variance[product_id]))
+        lead, horizon = self.lead_days, self.lead_days + self.cover_days
+        reorder_point = math.ceil(daily * lead + self.safety_z * deviation * math.sqrt(lead))
+        order_quantity = 0
+        if quantity <= reorder_point:
+            order_up_to = math.ceil(daily * horizon + self.safety_z * deviation * math.sqrt(horizon))
+            order_quantity = max(order_up_to - max(quantity, 0), 1)
+        return StockStatus(daily, max(quantity, 0) / daily, reorder_point, order_quantity)
+
+    def purchase_order(self, products):
+        """Rows of PURCHASE_ORDER_HEADERS for the products at or below their reorder point, soonest to run
+        out first. ``products`` are (product_id, name, quantity) of the products to consider."""
+        lines = []
+        for product_id, name, quantity in products:
+            status = self.status(product_id, quantity)
+            if status is not None and status.low:
+                lines.append((product_id, name, quantity, round(status.daily_demand, 2),
+                              round(status.days_of_cover, 1), status.reorder_point, status.order_quantity))
+        lines.sort(key=lambda line: (line[4], line[0]))
+        return lines
+
+
+def write_purchase_order(lines, path):
+    """Save purchase order rows to a CSV file."""
+    with open(path + ".part", "w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(PURCHASE_ORDER_HEADERS)
+        writer.writerows(lines)
+    os.replace(path + ".part", path)
+    return path
@@ -0,0 +1,117 @@
+"""Product image thumbnails: a pre-scaled store on disk and an in-memory LRU.
+
+Product photos are often multi-megabyte camera shots. They are decoded once,
+when a product is saved, into a small PNG under ``data/thumbnails``; screens
+then only ever decode that PNG, and keep the resulting ``CTkImage`` objects
+in a bounded LRU so scrolling and re-searching the grid decodes nothing.
+Decoding (``decode``) is safe on a worker thread; wrapping the result for Tk
+(``store``) and lookups (``cached``) belong on the Tk thread. Pillow is
+imported by the first decode rather than at startup.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import customtkinter as ctk
+
+from metrics import recorder
+from product_grid import TILE_IMAGE_SIZE
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class ThumbnailCache:
+    """LRU of decoded thumbnails keyed by (source path, source mtime, display size)."""
+
+    def __init__(self, thumb_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.thumb_dir = thumb_dir
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.entries = OrderedDict()  # key -> (CTkImage, cost in bytes)
+        os.makedirs(thumb_dir, exist_ok=True)
+
+    def thumbnail_path(self, src_path):
+        digest = hashlib.sha1(os.path.abspath(src_path).encode()).hexdigest()
+        return os.path.join(self.thumb_dir, f"{digest}.png")
+
+    def write_thumbnail(self, src_path):
+        """Scale ``src_path`` down to the tile size and store it. Returns the thumbnail path or None."""
+        if not src_path:
+            return None
+        from PIL import Image
+        thumb_path = self.thumbnail_path(src_path)
+        try:
+            with Image.open(src_path) as img:
+                img.draft("RGB", TILE_IMAGE_SIZE)  # Lets the JPEG decoder skip most of a large photo.
+                img.convert("RGB").resize(TILE_IMAGE_SIZE, Image.LANCZOS).save(thumb_path, "PNG")
+        except OSError:
+            return None
+        return thumb_path
+
+    def cached(self, src_path, size=TILE_IMAGE_SIZE):
+        """Return the cached CTkImage for ``src_path`` at ``size``, or None without decoding anything."""
+        try:
+            key = (src_path, os.stat(src_path).st_mtime_ns, size)
+        except (OSError, TypeError, ValueError):
+            return None
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def decode(self, src_path):
+        """Load the thumbnail of ``src_path`` as a PIL image, (re)building it if needed.
+
+        Touches no Tk state, so it can run on a worker thread. Returns None if
+        the image cannot be read.
+        """
+        started = time.perf_counter()
+        try:
+            return self._decode(src_path)
+        finally:
+            recorder.charge("image", time.perf_counter() - started)
+
+    def _decode(self, src_path):
+        try:
+            mtime = os.stat(src_path).st_mtime_ns
+        except (OSError, TypeError, ValueError):
+            return None
+        thumb_path = self.thumbnail_path(src_path)
+        try:
+            stale = os.stat(thumb_path).st_mtime_ns < mtime
+        except OSError:
+            stale = True
+        if stale and self.write_thumbnail(src_path) is None:
+            return None
+        from PIL import Image
+        try:
+            with Image.open(thumb_path) as img:
+                img.load()
+                return img.copy()
+        except OSError:
+            return None
+
+    def store(self, src_path, pil_image, size=TILE_IMAGE_SIZE):
+        """Wrap a decoded thumbnail in a CTkImage and keep it in the LRU. Tk thread only."""
+        try:
+            key = (src_path, os.stat(src_path).st_mtime_ns, size)
+        except OSError:
+            return None
+        image = ctk.CTkImage(light_image=pil_image, size=size)
+        # The decoded thumbnail plus the scaled copy Tk keeps for display.
+        cost = (TILE_IMAGE_SIZE[0] * TILE_IMAGE_SIZE[1] + size[0] * size[1]) * 4
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.used_bytes -= old[1]
+        self.entries[key] = (image, cost)
+        self.used_bytes += cost
+        while self.used_bytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, evicted_cost) = self.entries.popitem(last=False)
+            self.used_bytes -= evicted_cost
+        return image
+
+    def clear(self):
+        self.entries.clear()
+        self.used_bytes = 0
@@ -0,0 +1,246 @@
+"""Bulk import of supplier price lists from CSV or Excel.
+
+The file is read a row at a time, through openpyxl's read-only mode for
+.xlsx files and the csv module otherwise, so a large price list never sits
+in memory whole. The first row names the columns; the Products sheet of an
+export can be imported back as it is. Each row is checked on its own and a
+bad row is reported by line number rather than stopping the import.
+
+Rows are matched to existing products by ID, then by barcode, then by name
+(ignoring case). Matched products get the row's price and quantity, new
+ones are added. Writes go to the database in chunks of a few thousand rows,
+each its own transaction, so other tills are never locked out for long. It
+is meant to run off the Tk thread: it reports progress through a callback
+and stops between chunks when asked to, keeping the chunks already written.
+"""
+import csv
+import math
+import os
+
+from money import to_paise
+from storage import parse_barcodes
+
+IMPORT_CHUNK_ROWS = 2000
+# Header spellings accepted for each column, compared in lower case.
+COLUMN_ALIASES = {
+    "id": ("id", "product id"),
+    "name": ("name", "product", "product name", "item", "item name", "description"),
+    "price": ("price", "price (rs.)", "unit price", "rate", "mrp"),
+    "quantity": ("quantity", "qty", "stock", "quantity in stock"),
+    "barcodes": ("barcode", "barcodes", "sku", "skus", "barcodes / skus", "ean", "upc"),
+}
+ERROR_HEADERS = ["Line", "Error"]
+
+
+class ImportCancelled(Exception):
+    """The import was cancelled; chunks written before it stay in the database."""
+
+
+class ImportReport:
+    """What an import did: counts of added and updated products and the rows it skipped."""
+
+    def __init__(self):
+        self.added = 0
+        self.updated = 0
+        self.errors = []  # (line number, message)
+
+    def summary(self):
+        text = f"Added {self.added:,} and updated {self.updated:,} products."
+        if self.errors:
+            text += f" {len(self.errors):,} rows were skipped."
+        return text
+
+
+class XlsxReader:
+    """Rows of the first sheet of a workbook, read with openpyxl's read-only mode."""
+
+    def __init__(self, filename):
+        from openpyxl import load_workbook  # Only .xlsx imports need it; importing it is slow.
+        self.workbook = load_workbook(filename, read_only=True, data_only=True)
+        self.sheet = self.workbook.worksheets[0]
+        self.total = self.sheet.max_row or 0  # From the sheet's stored dimensions; may be missing.
+
+    def rows(self):
+        return self.sheet.iter_rows(values_only=True)
+
+    def close(self):
+        self.workbook.close()
+
+
+class CsvReader:
+    """Rows of a CSV file; the delimiter (comma, semicolon or tab) is detected from the start of the file."""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as handle:
+            self.total = sum(chunk.count(b"\n") for chunk in iter(lambda: handle.read(1 << 20), b""))
+        self.handle = open(filename, newline="", encoding="utf-8-sig")
+        try:
+            dialect = csv.Sniffer().sniff(self.handle.read(4096), delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        self.handle.seek(0)
+        self.reader = csv.reader(self.handle, dialect)
+
+    def rows(self):
+        return self.reader
+
+    def close(self):
+        self.handle.close()
+
+
+def map_columns(header):
+    """Column index of each known field in ``header``. Raises ValueError if the file cannot be imported."""
+    columns = {}
+    for index, title in enumerate(header):
+        title = str(title or "").strip().lower()
+        for field, aliases in COLUMN_ALIASES.items():
+            if title in aliases and field not in columns:
+                columns[field] = index
+    if not columns.keys() & {"id", "name", "barcodes"}:
+        raise ValueError("The first row must name an ID, Name or Barcode column.")
+    if not columns.keys() & {"price", "quantity"}:
+        raise ValueError("The first row must name a Price or Quantity column.")
+    return columns
+
+
+def parse_price(value):
+    """The price in paise, or None for an empty cell."""
+    if value is None or value == "":
+        return None
+    price = to_paise(value)
+    if price < 0:
+        raise ValueError
+    return price
+
+
+def parse_quantity(value):
+    if value is None or value == "":
+        return None
+    quantity = float(value.replace(",", "") if isinstance(value, str) else value)
+    if not math.isfinite(quantity) or not quantity.is_integer() or quantity < 0:
+        raise ValueError
+    return int(quantity)
+
+
+def parse_row(values, columns):
+    """(product_id, name, price, quantity, barcodes) from one row; raises ValueError with the reason."""
+
+    def cell(field):
+        index = columns.get(field)
+        value = values[index] if index is not None and index < len(values) else None
+        return value.strip() if isinstance(value, str) else value
+
+    product_id = cell("id")
+    if product_id not in (None, ""):
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"ID '{product_id}' is not a whole number.") from None
+    else:
+        product_id = None
+    name = str(cell("name") or "").strip()
+    try:
+        price = parse_price(cell("price"))
+    except (TypeError, ValueError):
+        raise ValueError(f"Price '{cell('price')}' is not a valid amount.") from None
+    try:
+        quantity = parse_quantity(cell("quantity"))
+    except (TypeError, ValueError):
+        raise ValueError(f"Quantity '{cell('quantity')}' is not a whole number of 0 or more.") from None
+    barcodes = cell("barcodes")
+    barcodes = parse_barcodes(str(barcodes) if barcodes is not None else "")
+    if product_id is None and not name and not barcodes:
+        raise ValueError("The row has no ID, name or barcode.")
+    if price is None and quantity is None:
+        raise ValueError("The row has neither a price nor a quantity.")
+    return product_id, name, price, quantity, barcodes
+
+
+def import_products(storage, filename, add_quantities=False, progress=None, cancelled=None,
+                    chunk_size=IMPORT_CHUNK_ROWS):
+    """Add or update the products listed in ``filename`` and return an ImportReport.
+
+    ``add_quantities`` adds each row's quantity to the stock of a matched
+    product instead of replacing it. ``progress(done, total)`` is called after
+    every chunk, with ``total`` an estimate of the rows in the file or 0, and
+    ``cancelled()`` is checked before every chunk; both run on the importing
+    thread. Raises ValueError if the file has no usable header row.
+    """
+    products, barcode_rows = storage.import_keys()
+    ids = {product_id for product_id, _ in products}
+    by_name = {name.casefold(): product_id for product_id, name in products}
+    # Values are product ids, or ("line", n) for a product a row of this file is adding.
+    owners = dict(barcode_rows)
+    reader = XlsxReader(filename) if filename.lower().endswith(".xlsx") else CsvReader(filename)
+    report = ImportReport()
+    new, updates, columns, line = [], [], None, 0
+
+    def flush():
+        if cancelled is not None and cancelled():
+            raise ImportCancelled()
+        if new or updates:
+            storage.import_products(new, updates, add_quantities)
+            report.added += len(new)
+            report.updated += len(updates)
+            new.clear()
+            updates.clear()
+        if progress is not None:
+            progress(line, reader.total)
+
+    try:
+        for line, values in enumerate(reader.rows(), 1):
+            if not any(value not in (None, "") for value in values):
+                continue
+            if columns is None:
+                columns = map_columns(values)
+                continue
+            try:
+                product_id, name, price, quantity, barcodes = parse_row(values, columns)
+                match = product_id
+                if match is not None and match not in ids:
+                    raise ValueError(f"There is no product with ID {match}.")
+                matches = {owners[code] for code in barcodes if code in owners}
+                if match is None and len(matches) > 1:
+                    raise ValueError("The barcodes belong to different products.")
+                if match is None and matches:
+                    match = matches.pop()
+                if match is None and name:
+                    match = by_name.get(name.casefold())
+                if isinstance(match, tuple):
+                    raise ValueError(f"Line {match[1]} already adds this product.")
+                taken = [code for code in barcodes if owners.get(code, match) != match]
+                if taken:
+                    raise ValueError(f"Barcode '{taken[0]}' already belongs to another product.")
+                if match is None and not name:
+                    raise ValueError("A new product needs a name.")
+                if match is None and price is None:
+                    raise ValueError("A new product needs a price.")
+            except ValueError as e:
+                report.errors.append((line, str(e)))
+                continue
+            codes = [code for code in barcodes if code not in owners]
+            if match is None:
+                new.append((name, price, quantity, codes))
+                by_name[name.casefold()] = ("line", line)
+                owners.update((code, ("line", line)) for code in codes)
+            else:
+                updates.append((match, price, quantity, codes))
+                owners.update((code, match) for code in codes)
+            if len(new) + len(updates) >= chunk_size:
+                flush()
+        if columns is None:
+            raise ValueError("The file is empty.")
+        flush()
+    finally:
+        reader.close()
+    return report
+
+
+def write_error_report(errors, path):
+    """Save the (line, message) pairs of an ImportReport to a CSV file."""
+    with open(path + ".part", "w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(ERROR_HEADERS)
+        writer.writerows(errors)
+    os.replace(path + ".part", path)
+    return path
@@ -0,0 +1,281 @@
+"""Database upkeep while the shop is quiet, and backups to restore from.
+
+The till runs the jobs below when nobody has used it, and no till has
+written to the database, for a while. Each job has an interval; the time
+it last ran is kept in the database, and a till claims a job before running
+it, so with several tills on one database each job runs once per interval
+on whichever till is idle first.
+
+    checkpoint  copy the write-ahead log into the database and empty it
+    vacuum      give unused pages back to the file system, a step at a time
+    analyze     refresh the statistics the query planner chooses indexes by
+    prune       trim the change log the tills sync and exports read from
+    backup      snapshot the database and the sales archive, keeping the newest few
+    integrity   check the database for corruption
+
+A backup is a folder under data/backups named after its time, holding a
+copy of the database made with SQLite's online backup API and copies of
+the sales archive files; archive files unchanged since the previous backup
+are hard links to its copies. Only the newest few scheduled backups are
+kept; labelled ones, taken before clearing stock or sales or before a
+restore, stay until deleted by hand. Restoring one needs every till closed::
+
+    python maintenance.py list
+    python maintenance.py backup
+    python maintenance.py restore 2026-10-18_213000
+
+A database from before incremental vacuum gives its unused pages back only
+through a full VACUUM, which holds up every till while it rewrites the
+file. The vacuum job leaves that to be run at closing time::
+
+    python maintenance.py vacuum
+"""
+import argparse
+import itertools
+import os
+import re
+import shutil
+import sys
+from datetime import datetime, timedelta
+
+from storage import Storage, copy_database_file, restore_database
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "retail.db")
+# (job, how often it runs), in the order they are run when several are due.
+JOB_INTERVALS = (("checkpoint", timedelta(minutes=15)),
+                 ("vacuum", timedelta(hours=6)),
+                 ("analyze", timedelta(days=1)),
+                 ("prune", timedelta(days=1)),
+                 ("backup", timedelta(days=1)),
+                 ("integrity", timedelta(days=7)))
+# Unused pages worth giving back; fewer are left for the database to reuse.
+VACUUM_MIN_FREE_PAGES = 1024
+VACUUM_STEP_PAGES = 1000
+# Unlabelled backups kept; older ones are deleted after each new one.
+BACKUP_KEEP = 7
+BACKUP_TIME_FORMAT = "%Y-%m-%d_%H%M%S"
+# Time, a counter when several backups start in the same second, then the label if any.
+BACKUP_NAME = re.compile(r"\d{4}-\d\d-\d\d_\d{6}(-\d+)?(_[\w-]+)?$")
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class MaintenanceScheduler:
+    """Runs the maintenance jobs that are due, one after another while the till stays idle."""
+
+    def __init__(self, backup_dir, intervals=JOB_INTERVALS, keep=BACKUP_KEEP):
+        self.backup_dir = backup_dir
+        self.intervals = intervals
+        self.keep = keep
+
+    def due(self, storage, now=None):
+        """The jobs whose interval has passed since they last ran, in running order."""
+        now = now or datetime.now()
+        state = storage.maintenance_state()
+        return [job for job, interval in self.intervals
+                if job not in state or state[job][0] <= (now - interval).strftime(TIME_FORMAT)]
+
+    def run_due(self, storage, idle=lambda: True, now=None):
+        """Run the due jobs until one finishes with ``idle()`` false. Returns [(job, result)] of the jobs run.
+
+        A job another till claimed first is skipped; one that fails is
+        recorded with its error and tried again after its next interval.
+        """
+        now = now or datetime.now()
+        intervals = dict(self.intervals)
+        results = []
+        for job in self.due(storage, now):
+            if not idle():
+                break
+            if not storage.claim_maintenance(job, now.strftime(TIME_FORMAT),
+                                             (now - intervals[job]).strftime(TIME_FORMAT)):
+                continue
+            try:
+                result = getattr(self, job)(storage, idle)
+            except Exception as e:
+                result = f"failed: {e}"
+            storage.record_maintenance(job, result)
+            results.append((job, result))
+        return results
+
+    # --- Jobs ---
+    def checkpoint(self, storage, idle):
+        frames, copied = storage.checkpoint()
+        return f"{copied} of {frames} log pages copied"
+
+    def vacuum(self, storage, idle):
+        free, pages = storage.free_pages()
+        if free < VACUUM_MIN_FREE_PAGES:
+            return f"{free} of {pages} pages unused"
+        if not storage.incremental_vacuum_enabled():
+            return f"{free} of {pages} pages unused; run 'python maintenance.py vacuum' with the tills closed"
+        left = free
+        while left and idle():
+            left = storage.vacuum_step(VACUUM_STEP_PAGES)
+        return f"{free - left} pages given back, {left} left"
+
+    def analyze(self, storage, idle):
+        storage.analyze()
+        return "ok"
+
+    def prune(self, storage, idle):
+        storage.prune_changes()
+        return "ok"
+
+    def backup(self, storage, idle):
+        name = take_backup(storage, self.backup_dir)
+        rotate_backups(self.backup_dir, self.keep)
+        return name
+
+    def integrity(self, storage, idle):
+        problems = storage.integrity_check()
+        return "ok" if not problems else f"{len(problems)} problems: {problems[0]}"
+
+
+# --- Backups ---
+def list_backups(backup_dir):
+    """Names of the backups in ``backup_dir``, newest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted((name for name in os.listdir(backup_dir)
+                   if BACKUP_NAME.match(name) and os.path.isdir(os.path.join(backup_dir, name))), reverse=True)
+
+
+def backup_time(name):
+    return datetime.strptime(name[:17], BACKUP_TIME_FORMAT)
+
+
+def take_backup(storage, backup_dir, label=None):
+    """Back up the database and the sales archive into a new folder of ``backup_dir``; returns its name.
+
+    ``label`` is added to the name, for backups taken before something that
+    cannot be undone. The folder only gets its name once every copy is
+    complete, so a failed backup never looks like a good one.
+    """
+    started = datetime.now()
+    previous = next(iter(list_backups(backup_dir)), None)
+    os.makedirs(backup_dir, exist_ok=True)
+    for number in itertools.count(1):
+        name = started.strftime(BACKUP_TIME_FORMAT) + (f"-{number}" if number > 1 else "") + (
+            f"_{label}" if label else "")
+        folder, part = os.path.join(backup_dir, name), os.path.join(backup_dir, name + ".part")
+        if os.path.exists(folder):
+            continue
+        try:
+            os.mkdir(part)  # Fails if another backup started in the same second took the name.
+            break
+        except FileExistsError:
+            continue
+    try:
+        os.mkdir(os.path.join(part, "archive"))
+        storage.backup(os.path.join(part, os.path.basename(storage.db_path)))
+        archives = os.listdir(storage.archive_dir) if os.path.isdir(storage.archive_dir) else []
+        for filename in sorted(archives):
+            if not filename.endswith(".db"):
+                continue
+            source, target = os.path.join(storage.archive_dir, filename), os.path.join(part, "archive", filename)
+            old = previous and os.path.join(backup_dir, previous, "archive", filename)
+            if old and os.path.exists(old) and os.path.getmtime(source) < backup_time(previous).timestamp():
+                try:
+                    os.link(old, target)  # Closed months do not change; no need for another copy.
+                    continue
+                except OSError:
+                    pass
+            copy_database_file(source, target)
+        os.replace(part, folder)
+    except BaseException:
+        shutil.rmtree(part, ignore_errors=True)
+        raise
+    return name
+
+
+def is_labelled(name):
+    return BACKUP_NAME.match(name).group(2) is not None
+
+
+def rotate_backups(backup_dir, keep=BACKUP_KEEP):
+    """Delete all but the ``keep`` newest unlabelled backups. Returns the names deleted."""
+    old = [name for name in list_backups(backup_dir) if not is_labelled(name)][keep:]
+    for name in old:
+        shutil.rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+    return old
+
+
+def restore_backup(name, db_path, backup_dir):
+    """Put the database and sales archive back as they were in backup ``name``. Returns the name of the
+    backup taken of them first, so the restore itself can be undone.
+
+    Every till and API server using the database must be closed first.
+    """
+    folder = os.path.join(backup_dir, name)
+    copy = os.path.join(folder, os.path.basename(db_path))
+    if not os.path.exists(copy):
+        raise FileNotFoundError(f"There is no backup named {name}.")
+    storage = Storage(db_path)
+    try:
+        archive_dir = storage.archive_dir
+        undo = take_backup(storage, backup_dir, label="before-restore")
+    finally:
+        storage.close()
+    restore_database(copy, db_path)
+    kept = set(os.listdir(os.path.join(folder, "archive")))
+    os.makedirs(archive_dir, exist_ok=True)
+    for filename in kept:
+        restore_database(os.path.join(folder, "archive", filename), os.path.join(archive_dir, filename))
+    # Years archived since the backup hold months its database still has as live sales.
+    for filename in os.listdir(archive_dir):
+        if filename.endswith(".db") and filename not in kept:
+            os.remove(os.path.join(archive_dir, filename))
+    return undo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Back up, restore and maintain the Retail POS database.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="database file (default: the till's)")
+    parser.add_argument("--backups", help="backup folder (default: backups next to the database)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list the backups, newest first")
+    backup = commands.add_parser("backup", help="back up now")
+    backup.add_argument("--label", help="added to the backup's name")
+    restore = commands.add_parser("restore", help="restore a backup; close every till first")
+    restore.add_argument("name")
+    commands.add_parser("run", help="run the maintenance jobs that are due")
+    commands.add_parser("check", help="run a full integrity check")
+    commands.add_parser("vacuum", help="give back every unused page; close every till first")
+    args = parser.parse_args(argv)
+    backup_dir = args.backups or os.path.join(os.path.dirname(os.path.abspath(args.db)), "backups")
+
+    if args.command == "list":
+        for name in list_backups(backup_dir):
+            print(name)
+        return
+    if args.command == "restore":
+        undo = restore_backup(args.name, args.db, backup_dir)
+        print(f"Restored {args.name}. The database as it was is in backup {undo}.")
+        return
+    storage = Storage(args.db)
+    try:
+        storage.create_tables()
+        if args.command == "backup":
+            print(take_backup(storage, backup_dir, args.label))
+        elif args.command == "run":
+            for job, result in MaintenanceScheduler(backup_dir).run_due(storage):
+                print(f"{job}: {result}")
+        elif args.command == "vacuum":
+            pages = storage.free_pages()[1]
+            if storage.incremental_vacuum_enabled():
+                while storage.vacuum_step(VACUUM_STEP_PAGES):
+                    pass
+            else:
+                storage.enable_incremental_vacuum()  # Once per database; later runs of the job go a step at a time.
+            storage.checkpoint()
+            print(f"{pages - storage.free_pages()[1]} of {pages} pages given back")
+        else:
+            problems = storage.integrity_check(quick=False)
+            print("\n".join(problems) or "ok")
+            sys.exit(1 if problems else 0)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
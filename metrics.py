@@ -0,0 +1,244 @@
+"""Latency instrumentation for the till's hot paths.
+
+Each instrumented operation (a search, a checkout, ...) is a span. A span
+stays open while work it started is still running on the task runner or the
+checkout thread, so its total is what the cashier waited for, not just the
+time spent in the Tk handler. Time inside a span is split into SQL (charged
+by Storage's cursors), image decoding (charged by the thumbnail cache) and
+widget work (the rest of the span's time on the Tk thread). Totals go into
+per-operation histograms with fixed buckets. Operations slower than the
+threshold are written to the slow-operation log together with the
+statements they ran.
+
+The bookkeeping is a few clock reads and list appends per call, cheap enough
+to leave switched on.
+"""
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+SLOW_OPERATION_MS = 250
+# Upper bounds of the histogram buckets, in milliseconds; a final bucket takes everything slower.
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+# Statements kept per span for the slow-operation log.
+MAX_STATEMENTS = 20
+MAX_STATEMENT_CHARS = 300
+
+log = logging.getLogger("retail.slow")
+
+
+class Span:
+    """One run of an instrumented operation."""
+
+    __slots__ = ("name", "started", "pending", "paused", "sql", "image", "widget", "statements")
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.pending = 1  # The handler itself plus every task still working for it.
+        self.paused = 0.0  # Time spent waiting on modal dialogs, left out of the total.
+        self.sql = self.image = self.widget = 0.0
+        self.statements = []  # (milliseconds, statement)
+
+
+class Histogram:
+    """Latency distribution and time split of one operation."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = self.max_ms = 0.0
+        self.sql_ms = self.image_ms = self.widget_ms = 0.0
+        self.slow = 0
+
+    def add(self, total_ms, span, slow):
+        index = 0
+        while index < len(BUCKET_BOUNDS_MS) and total_ms > BUCKET_BOUNDS_MS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total_ms += total_ms
+        self.max_ms = max(self.max_ms, total_ms)
+        self.sql_ms += span.sql * 1000
+        self.image_ms += span.image * 1000
+        self.widget_ms += span.widget * 1000
+        self.slow += slow
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (the maximum for the last bucket)."""
+        rank, seen = p * self.count, 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else self.max_ms
+        return 0.0
+
+    def as_dict(self):
+        count = self.count or 1
+        return {"count": self.count, "slow": self.slow, "mean_ms": self.total_ms / count, "max_ms": self.max_ms,
+                "p50_ms": self.percentile(0.5), "p95_ms": self.percentile(0.95), "p99_ms": self.percentile(0.99),
+                "mean_sql_ms": self.sql_ms / count, "mean_image_ms": self.image_ms / count,
+                "mean_widget_ms": self.widget_ms / count,
+                "buckets": {f"<={bound}ms": n for bound, n in zip(BUCKET_BOUNDS_MS, self.buckets)}
+                           | {f">{BUCKET_BOUNDS_MS[-1]}ms": self.buckets[-1]}}
+
+
+class Recorder:
+    """Tracks open spans per thread and collects finished ones into histograms."""
+
+    def __init__(self, slow_ms=SLOW_OPERATION_MS):
+        self.slow_ms = slow_ms
+        self.histograms = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _frames(self):
+        # Per thread: [span, seconds already charged to SQL/image/nested operations] for each active span.
+        frames = getattr(self._local, "frames", None)
+        if frames is None:
+            frames = self._local.frames = []
+        return frames
+
+    def current(self):
+        frames = self._frames()
+        return frames[-1][0] if frames else None
+
+    @contextmanager
+    def operation(self, name):
+        """Time the enclosed Tk-thread work, and whatever it hands to workers, as one ``name`` span."""
+        span = Span(name)
+        try:
+            with self.activate(span, widget=True):
+                yield span
+        finally:
+            self.release(span)
+
+    @contextmanager
+    def activate(self, span, widget=False):
+        """Charge SQL and image time on this thread to ``span``; ``widget`` also counts the rest as widget time."""
+        if span is None:
+            yield
+            return
+        frames = self._frames()
+        frame = [span, 0.0]
+        frames.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            frames.pop()
+            elapsed = time.perf_counter() - started
+            if widget:
+                with self._lock:
+                    span.widget += max(0.0, elapsed - frame[1])
+            if frames and widget:
+                frames[-1][1] += elapsed  # A nested operation's time is not the outer one's widget time.
+
+    def charge(self, kind, seconds, statement=None):
+        """Add ``seconds`` of ``kind`` ("sql" or "image") work to the span active on this thread, if any."""
+        frames = getattr(self._local, "frames", None)
+        if not frames:
+            return
+        frame = frames[-1]
+        span = frame[0]
+        frame[1] += seconds
+        with self._lock:
+            if kind == "sql":
+                span.sql += seconds
+                if statement is not None and len(span.statements) < MAX_STATEMENTS:
+                    span.statements.append((seconds * 1000, " ".join(statement.split())[:MAX_STATEMENT_CHARS]))
+            else:
+                span.image += seconds
+
+    @contextmanager
+    def idle(self):
+        """Leave the enclosed wait (a message box, say) out of the active span's total and widget time."""
+        frames = self._frames()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            if frames:
+                elapsed = time.perf_counter() - started
+                frames[-1][1] += elapsed
+                with self._lock:
+                    frames[-1][0].paused += elapsed
+
+    def bind(self, fn, span=None):
+        """Wrap ``fn`` so that it runs inside the current span on whichever thread calls it."""
+        span = span or self.current()
+        if span is None:
+            return fn
+
+        @functools.wraps(fn)
+        def bound(*args, **kwargs):
+            with self.activate(span):
+                return fn(*args, **kwargs)
+
+        return bound
+
+    def hold(self, span):
+        """Keep ``span`` open until a matching release(), e.g. while a task works for it."""
+        if span is not None:
+            with self._lock:
+                span.pending += 1
+
+    def release(self, span):
+        if span is None:
+            return
+        with self._lock:
+            span.pending -= 1
+            if span.pending:
+                return
+            total_ms = (time.perf_counter() - span.started - span.paused) * 1000
+            slow = total_ms >= self.slow_ms
+            self.histograms.setdefault(span.name, Histogram()).add(total_ms, span, slow)
+        if slow:
+            log.warning("%s took %.1f ms (sql %.1f ms, image %.1f ms, widget %.1f ms)%s", span.name, total_ms,
+                        span.sql * 1000, span.image * 1000, span.widget * 1000,
+                        "".join(f"\n    {ms:8.2f} ms  {sql}" for ms, sql in span.statements))
+
+    def stats(self):
+        with self._lock:
+            return {name: histogram.as_dict() for name, histogram in sorted(self.histograms.items())}
+
+    def dump(self, path):
+        """Write the statistics gathered so far to ``path`` as JSON."""
+        with open(path, "w") as handle:
+            json.dump({"slow_ms": self.slow_ms, "operations": self.stats()}, handle, indent=2)
+        return path
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+
+def open_slow_log(path, max_bytes=1024 * 1024, backups=3):
+    """Send the slow-operation log to ``path``, rotating it at ``max_bytes``."""
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    log.addHandler(handler)
+    log.setLevel(logging.WARNING)
+    log.propagate = False
+
+
+def timed(name):
+    """Decorator recording every call of the function as a ``name`` operation."""
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with recorder.operation(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+# Shared by the whole process.
+recorder = Recorder()
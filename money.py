@@ -0,0 +1,49 @@
+"""Amounts of money as whole paise.
+
+Prices, line amounts, discounts, taxes and totals are integers in paise
+(1/100 of a rupee) everywhere from the database through the cart to the
+receipt, so adding up a basket is exact however many lines it has. Rupees
+only appear at the edges: typed in by a person, shown on a screen or a
+receipt, or written to an export.
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+PAISE_PER_RUPEE = 100
+
+
+def to_paise(value):
+    """Paise in ``value`` rupees, given as text ('1,234.50', 'Rs. 12'), a number or a Decimal, rounded half up
+    to the nearest paisa. Raises ValueError if it is not a finite amount."""
+    if isinstance(value, str):
+        value = value.replace(",", "").strip().removeprefix("Rs.").strip()
+    elif isinstance(value, float):
+        value = repr(value)  # The shortest text for the float, so 0.1 is 10 paise rather than 10.000000000000000555.
+    try:
+        amount = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError(f"'{value}' is not an amount of money.") from None
+    if not amount.is_finite():
+        raise ValueError(f"'{value}' is not an amount of money.")
+    return int((amount * PAISE_PER_RUPEE).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def share(paise, numerator, denominator):
+    """``paise * numerator / denominator`` rounded half up to a whole paisa, in integer arithmetic."""
+    value, sign = paise * numerator, 1
+    if value < 0:
+        value, sign = -value, -1
+    return sign * ((2 * value + denominator) // (2 * denominator))
+
+
+def format_amount(paise, grouping=False):
+    """'1234.50' for 123450 paise, with no currency sign so it follows 'Rs.' or sits under a '(Rs.)' heading.
+    ``grouping`` adds thousands separators. Floats, such as NumPy sums, are rounded to a whole paisa first."""
+    paise = round(paise)
+    whole, rest = divmod(abs(paise), PAISE_PER_RUPEE)
+    sign = "-" if paise < 0 else ""
+    return f"{sign}{whole:,}.{rest:02d}" if grouping else f"{sign}{whole}.{rest:02d}"
+
+
+def rupees(paise):
+    """``paise`` as a float number of rupees, for spreadsheets that should treat it as a number."""
+    return None if paise is None else paise / PAISE_PER_RUPEE
@@ -0,0 +1,136 @@
+"""Virtualized product grid for the POS screen.
+
+Only the rows that fit in the visible area are backed by widgets. Scrolling,
+searching and stock changes rebind that fixed pool of tiles to a different
+slice of the product list instead of destroying and recreating widgets.
+"""
+import customtkinter as ctk
+
+from money import format_amount
+
+TILE_IMAGE_SIZE = (150, 120)
+TILE_HEIGHT = 215  # Height of one tile row in pixels, padding included.
+COLUMNS = 4
+
+
+class ProductTile(ctk.CTkFrame):
+    """One reusable grid cell showing a product image, name and price."""
+
+    def __init__(self, master, on_click, on_wheel):
+        super().__init__(master)
+        self.product = None
+        self.image_label = ctk.CTkLabel(self, text="", width=TILE_IMAGE_SIZE[0], height=TILE_IMAGE_SIZE[1])
+        self.image_label.pack(pady=(10, 5))
+        self.name_label = ctk.CTkLabel(self, text="", font=ctk.CTkFont(size=14, weight="bold"))
+        self.name_label.pack()
+        self.price_label = ctk.CTkLabel(self, text="", font=ctk.CTkFont(size=12))
+        self.price_label.pack(pady=(0, 10))
+        for widget in (self, self.image_label, self.name_label, self.price_label):
+            widget.bind("<Button-1>", lambda e: self.product and on_click(self.product[0]))
+            for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+                widget.bind(sequence, on_wheel)
+
+    def show(self, product, image_loader):
+        """Bind the tile to ``product`` = (id, name, price, image_path), touching only what changed."""
+        old = self.product or (None, None, None, None)
+        self.product = product
+        _, name, price, path = product
+        if name != old[1]:
+            self.name_label.configure(text=name)
+        if price != old[2]:
+            self.price_label.configure(text=f"Rs.{format_amount(price)}")
+        if path != old[3] or old[0] is None:
+            image = image_loader(path)
+            if image is not None:
+                self.image_label.configure(image=image, text="")
+            else:
+                self.image_label.configure(image=None, text="No Image")
+
+
+class ProductGrid(ctk.CTkFrame):
+    """Scrollable grid of product tiles backed by a fixed widget pool."""
+
+    def __init__(self, master, on_select, image_loader, columns=COLUMNS, **kwargs):
+        super().__init__(master, **kwargs)
+        self.on_select = on_select
+        self.image_loader = image_loader
+        self.columns = columns
+        self.products = []
+        self.tiles = []
+        self.first_row = 0
+        self.visible_rows = 0
+
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tile_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.tile_frame.pack(side="left", fill="both", expand=True)
+        self.tile_frame.grid_propagate(False)  # The pool is sized to the frame, never the other way round.
+        self.tile_frame.grid_columnconfigure(tuple(range(columns)), weight=1)
+        self.tile_frame.bind("<Configure>", self._on_resize)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.tile_frame.bind(sequence, self._on_wheel)
+
+    @property
+    def total_rows(self):
+        return -(-len(self.products) // self.columns)
+
+    def set_products(self, products):
+        """Show a new product list, reusing the existing tiles."""
+        self.products = products
+        self.first_row = min(self.first_row, max(0, self.total_rows - self.visible_rows))
+        self._render()
+
+    def scroll_to_row(self, row):
+        row = max(0, min(int(row), self.total_rows - self.visible_rows))
+        if row != self.first_row:
+            self.first_row = row
+            self._render()
+
+    def _on_resize(self, event):
+        rows = max(1, event.height // TILE_HEIGHT)
+        if rows == self.visible_rows:
+            return
+        self.visible_rows = rows
+        while len(self.tiles) < rows * self.columns:
+            tile = ProductTile(self.tile_frame, self.on_select, self._on_wheel)
+            row, col = divmod(len(self.tiles), self.columns)
+            tile.grid(row=row, column=col, padx=10, pady=10, sticky="nsew")
+            self.tiles.append(tile)
+        self.first_row = min(self.first_row, max(0, self.total_rows - self.visible_rows))
+        self._render()
+
+    def _render(self):
+        start = self.first_row * self.columns
+        for i, tile in enumerate(self.tiles):
+            index = start + i
+            if i < self.visible_rows * self.columns and index < len(self.products):
+                tile.show(self.products[index], self.image_loader)
+                tile.grid()
+            else:
+                tile.grid_remove()
+        total = self.total_rows
+        if total <= self.visible_rows:
+            self.scrollbar.set(0.0, 1.0)
+        else:
+            self.scrollbar.set(self.first_row / total, (self.first_row + self.visible_rows) / total)
+
+    def refresh_image(self, path):
+        """Reload the image on visible tiles showing ``path``, e.g. once its thumbnail has been decoded."""
+        for tile in self.tiles:
+            if tile.product is not None and tile.product[3] == path and tile.winfo_ismapped():
+                image = self.image_loader(path)
+                if image is not None:
+                    tile.image_label.configure(image=image, text="")
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.scroll_to_row(round(float(value) * self.total_rows))
+        elif action == "scroll":
+            step = self.visible_rows if unit == "pages" else 1
+            self.scroll_to_row(self.first_row + int(value) * step)
+
+    def _on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to_row(self.first_row - 1)
+        elif event.num == 5 or event.delta < 0:
+            self.scroll_to_row(self.first_row + 1)
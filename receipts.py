@@ -0,0 +1,260 @@
+"""Receipt rendering and the print spooler.
+
+Receipts are queued with ``ReceiptSpooler.submit`` and printed by a thread of
+their own, so neither checkout nor the Tk thread ever waits on a printer. A
+job that fails (printer offline, out of paper, cable pulled) is retried a few
+times with growing pauses before its Future reports the error.
+
+Where the receipt goes is a printer spec, as saved in Settings:
+
+    escpos:/dev/usb/lp0   raw ESC/POS to a device or file (most thermal printers)
+    cups:NAME             the CUPS queue NAME via ``lp``; plain ``cups`` for the default queue
+    windows:NAME          the Windows spooler; plain ``windows`` for the default printer
+    file:PATH             append plain text to PATH
+    null                  discard
+
+pywin32 is imported on first use, and only where it is installed, so the
+till starts quickly and runs on Linux too.
+"""
+import os
+import queue
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future
+
+from money import format_amount
+
+PRINT_RETRIES = 3
+# Seconds before the first retry; doubled for each further one.
+PRINT_RETRY_DELAY = 2.0
+LP_TIMEOUT = 30
+RECEIPT_TITLE = "Sale Receipt"
+
+RECEIPT_HEADER = ("SAMARA TRADE CENTER\n"
+                  "--------------------------\n"
+                  "{copy}"
+                  "Sale ID: {sale_id}\n"
+                  "Date: {date}\n"
+                  "--------------------------\n"
+                  "Items:\n")
+RECEIPT_LINE = ("  {name} x {quantity}\n"
+                "    (Rs.{price} each) = Rs.{amount}\n")
+RECEIPT_LINE_DISCOUNT = "    less Rs.{discount}\n"
+# Subtotal, discount and tax lines, printed only when the sale had a discount or tax.
+RECEIPT_ADJUSTMENT = "{label}: Rs.{amount}\n"
+RECEIPT_FOOTER = ("--------------------------\n"
+                  "{adjustments}"
+                  "Total: Rs.{total}\n"
+                  "\n"
+                  "Thank you!\n")
+
+# ESC/POS: reset the printer; feed a few lines and make a partial cut after the receipt.
+ESCPOS_INIT = b"\x1b@"
+ESCPOS_CUT = b"\x1bd\x04\x1dVB\x00"
+ESCPOS_ENCODING = "cp437"
+
+
+class ReceiptTemplate:
+    """A receipt layout whose parts are split and bound once, so rendering is a few format calls and a join."""
+
+    def __init__(self, header=RECEIPT_HEADER, line=RECEIPT_LINE, footer=RECEIPT_FOOTER,
+                 line_discount=RECEIPT_LINE_DISCOUNT, adjustment=RECEIPT_ADJUSTMENT):
+        self._header = header.format
+        self._line = line.format
+        self._footer = footer.format
+        self._line_discount = line_discount.format
+        self._adjustment = adjustment.format
+
+    def render(self, sale):
+        """Receipt text for a sale dict as returned by CheckoutEngine or Storage.get_receipt; amounts in paise."""
+        parts = [self._header(copy="** REPRINT **\n" if sale.get("reprint") else "", sale_id=sale["sale_id"],
+                              date=sale["date"])]
+        for item in sale["items"]:
+            parts.append(self._line(name=item["name"], quantity=item["quantity"], price=format_amount(item["price"]),
+                                    amount=format_amount(item["price"] * item["quantity"])))
+            if item.get("discount"):
+                parts.append(self._line_discount(discount=format_amount(item["discount"])))
+        adjustments = []
+        if sale.get("discount") or sale.get("taxes"):
+            adjustments.append(self._adjustment(label="Subtotal", amount=format_amount(sale["subtotal"])))
+            if sale.get("discount"):
+                adjustments.append(self._adjustment(label="Discount", amount=format_amount(-sale["discount"])))
+            for label, rate, amount in sale.get("taxes", ()):
+                label += f" {rate / 100:g}%" if rate is not None else ""
+                if sale.get("tax_inclusive"):
+                    label = f"incl. {label}"
+                adjustments.append(self._adjustment(label=label, amount=format_amount(amount)))
+        parts.append(self._footer(adjustments="".join(adjustments), total=format_amount(sale["total"])))
+        return "".join(parts)
+
+
+# --- Printers ---
+def _win32print():
+    """pywin32's win32print module, or None when it is not installed."""
+    try:
+        import win32print
+    except ImportError:
+        return None
+    return win32print
+
+
+class NullPrinter:
+    """Discards receipts; counts them so tests can tell something was printed."""
+
+    def __init__(self):
+        self.printed = 0
+
+    def print_receipt(self, text):
+        self.printed += 1
+
+
+class FilePrinter:
+    """Appends each receipt as plain text to a file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def print_receipt(self, text):
+        with open(self.path, "a", encoding="utf-8") as handle:
+            handle.write(text + "\n")
+
+
+class EscPosPrinter:
+    """Writes raw ESC/POS to a printer device such as /dev/usb/lp0, or to a file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def print_receipt(self, text):
+        data = ESCPOS_INIT + text.encode(ESCPOS_ENCODING, errors="replace") + ESCPOS_CUT
+        with open(self.path, "ab") as handle:
+            handle.write(data)
+
+
+class CupsPrinter:
+    """Prints through CUPS with ``lp``, to ``name`` or the default queue."""
+
+    def __init__(self, name=None):
+        self.name = name
+
+    def print_receipt(self, text):
+        command = ["lp", "-s", "-t", RECEIPT_TITLE] + (["-d", self.name] if self.name else [])
+        result = subprocess.run(command, input=text.encode(), capture_output=True, timeout=LP_TIMEOUT)
+        if result.returncode:
+            raise OSError(result.stderr.decode(errors="replace").strip() or f"lp exited with {result.returncode}")
+
+
+class WindowsPrinter:
+    """Sends a raw job to a Windows printer, ``name`` or the default one."""
+
+    def __init__(self, name=None):
+        self.win32print = _win32print()
+        if self.win32print is None:
+            raise OSError("Windows printing needs pywin32")
+        self.name = name
+
+    def print_receipt(self, text):
+        win32print = self.win32print
+        printer = win32print.OpenPrinter(self.name or win32print.GetDefaultPrinter())
+        try:
+            win32print.StartDocPrinter(printer, 1, (RECEIPT_TITLE, None, "RAW"))
+            try:
+                win32print.StartPagePrinter(printer)
+                win32print.WritePrinter(printer, text.encode())
+                win32print.EndPagePrinter(printer)
+            finally:
+                win32print.EndDocPrinter(printer)
+        finally:
+            win32print.ClosePrinter(printer)
+
+
+def default_printer_spec():
+    """The spec used until one is saved: the platform's own spooler, or null if there is none."""
+    if _win32print() is not None:
+        return "windows"
+    if shutil.which("lp"):
+        return "cups"
+    return "null"
+
+
+def make_printer(spec):
+    """Build the printer described by ``spec`` (see the module docstring). Raises ValueError if it is invalid."""
+    spec = (spec or default_printer_spec()).strip()
+    kind, _, target = spec.partition(":")
+    kind, target = kind.lower(), target.strip()
+    if kind == "null":
+        return NullPrinter()
+    if kind == "cups":
+        return CupsPrinter(target or None)
+    if kind == "windows":
+        try:
+            return WindowsPrinter(target or None)
+        except OSError as e:
+            raise ValueError(str(e)) from None
+    if kind in ("escpos", "file"):
+        if not target:
+            raise ValueError(f"'{kind}:' needs a device or file path")
+        return EscPosPrinter(target) if kind == "escpos" else FilePrinter(os.path.expanduser(target))
+    raise ValueError(f"Unknown printer '{spec}'; use escpos:, cups:, windows:, file: or null")
+
+
+# --- Spooler ---
+class ReceiptSpooler:
+    """Prints queued receipts one at a time on a background thread, retrying failed jobs."""
+
+    def __init__(self, printer, template=None, retries=PRINT_RETRIES, retry_delay=PRINT_RETRY_DELAY):
+        self.printer = printer
+        self.template = template or ReceiptTemplate()
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="receipts", daemon=True)
+        self._thread.start()
+
+    def submit(self, sale):
+        """Queue the receipt for ``sale`` and return a Future that resolves once it has printed.
+
+        The receipt is rendered here, so later changes to ``sale`` do not
+        affect it. The Future raises the last error if every attempt failed.
+        """
+        future = Future()
+        self._queue.put((self.template.render(sale), future))
+        return future
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            text, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._print(text)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+
+    def _print(self, text):
+        # The printer can be swapped from Settings while jobs are queued; each attempt uses the current one.
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                return self.printer.print_receipt(text)
+            except Exception:
+                if attempt == self.retries or self._stopping.wait(delay):
+                    raise
+                delay *= 2
+
+    def shutdown(self, timeout=5.0):
+        """Stop after the queued receipts, giving up on retries and waiting at most ``timeout`` seconds."""
+        self._stopping.set()
+        self._queue.put(None)
+        self._thread.join(timeout)
@@ -3,17 +3,45 @@ from tkinter import ttk, messagebox, filedialog
 import customtkinter as ctk
 import sqlite3
 import os
-import hashlib
-from openpyxl import Workbook
+import time
 from datetime import datetime
-from PIL import Image, ImageTk
-import win32api
-import win32print
+
+from cart import Cart, parse_discount, parse_tax_rates, format_tax_rates
+from catalog import Catalog
+from checkout import CheckoutEngine
+from image_cache import ThumbnailCache
+from maintenance import MaintenanceScheduler, JOB_INTERVALS, take_backup, rotate_backups
+from metrics import recorder, timed, open_slow_log, SLOW_OPERATION_MS
+from money import format_amount, to_paise
+from product_grid import ProductGrid, TILE_IMAGE_SIZE
+from receipts import ReceiptSpooler, make_printer
+from scanner import ScannerListener
+from storage import (Storage, ThreadLocalStorage, hash_password, parse_barcodes, InsufficientStockError,
+                     SALES_PAGE_SIZE, ARCHIVE_KEEP_MONTHS)
+from tasks import TaskRunner
+from tree_sync import TreeSync
 
 # Set appearance mode and color theme
 ctk.set_appearance_mode("Light")
 ctk.set_default_color_theme("blue")
 
+# Wait this long after the last key press before running a product search.
+SEARCH_DEBOUNCE_MS = 150
+# Fetch the next page of sales once the list is scrolled past this fraction.
+SALES_PREFETCH_AT = 0.9
+# How often to check whether another terminal (or a worker thread) changed the database.
+CHANGE_POLL_MS = 500
+# How often to look for due maintenance, and how long the till and the database must be quiet before it runs.
+MAINTENANCE_POLL_MS = 60_000
+MAINTENANCE_IDLE_SECONDS = 300
+# Analytics tabs and their columns; each tab's rows are keyed by the first column.
+ANALYTICS_TABS = (("Top Sellers", ("Rank", "Product", "Quantity", "Revenue (Rs.)", "Class")),
+                  ("ABC Classes", ("Class", "Products", "Revenue (Rs.)", "Share")),
+                  ("By Hour", ("Hour", "Sales", "Revenue (Rs.)", "Average Sale (Rs.)")),
+                  ("By Weekday", ("Weekday", "Sales", "Revenue (Rs.)", "Average Sale (Rs.)")),
+                  ("Basket Sizes", ("Products", "Sales", "Share")),
+                  ("Bought Together", ("Rank", "Product", "With", "Sales", "Support", "Lift")))
+
 
 class PasswordDialog(ctk.CTkToplevel):
     """A dialog for password entry."""
@@ -51,6 +79,63 @@ class PasswordDialog(ctk.CTkToplevel):
         return self.password_ok
 
 
+class ExportRangeDialog(ctk.CTkToplevel):
+    """Asks for the inclusive date range of sales to export."""
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Export Sales")
+        self.transient(parent)
+        self.grab_set()
+        self.date_range = None
+        today = datetime.now().strftime("%Y-%m-%d")
+        ctk.CTkLabel(self, text="Export sales from / to (YYYY-MM-DD):").pack(padx=20, pady=(20, 10))
+        self.from_entry = ctk.CTkEntry(self)
+        self.from_entry.insert(0, today)
+        self.from_entry.pack(padx=20, pady=5, fill="x")
+        self.to_entry = ctk.CTkEntry(self)
+        self.to_entry.insert(0, today)
+        self.to_entry.pack(padx=20, pady=5, fill="x")
+        ctk.CTkButton(self, text="OK", command=self.on_ok).pack(side="left", padx=(20, 10), pady=20, expand=True)
+        ctk.CTkButton(self, text="Cancel", command=self.destroy).pack(side="right", padx=(10, 20), pady=20,
+                                                                       expand=True)
+
+    def on_ok(self):
+        date_from, date_to = self.from_entry.get().strip(), self.to_entry.get().strip()
+        try:
+            if datetime.strptime(date_from, "%Y-%m-%d") > datetime.strptime(date_to, "%Y-%m-%d"):
+                return messagebox.showerror("Error", "The start date is after the end date.", parent=self)
+        except ValueError:
+            return messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format.", parent=self)
+        self.date_range = (date_from, date_to)
+        self.destroy()
+
+    def show(self):
+        self.wait_window()
+        return self.date_range
+
+
+class ProgressDialog(ctk.CTkToplevel):
+    """Shows how far a background export or import has got and lets the user cancel it."""
+
+    def __init__(self, parent, on_cancel, title="Exporting", verb="Exported"):
+        super().__init__(parent)
+        self.title(title)
+        self.transient(parent)
+        self.verb = verb
+        self.label = ctk.CTkLabel(self, text=f"Preparing {title.lower()}...")
+        self.label.pack(padx=20, pady=(20, 10))
+        self.progress_bar = ctk.CTkProgressBar(self, width=300)
+        self.progress_bar.set(0)
+        self.progress_bar.pack(padx=20, pady=10)
+        ctk.CTkButton(self, text="Cancel", command=on_cancel).pack(padx=20, pady=(10, 20))
+        self.protocol("WM_DELETE_WINDOW", on_cancel)
+
+    def update_progress(self, done, total):
+        self.progress_bar.set(min(done / total, 1) if total else 0)
+        self.label.configure(text=f"{self.verb} {done:,} of {total:,} rows" if total else f"{self.verb} {done:,} rows")
+
+
 class RetailApp(ctk.CTk):
     def __init__(self):
         super().__init__()
@@ -64,9 +149,46 @@ class RetailApp(ctk.CTk):
         app_data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
         os.makedirs(app_data_path, exist_ok=True)
         self.db_path = os.path.join(app_data_path, "retail.db")
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
+        self.storage = Storage(self.db_path)
+        self.storage.create_tables()
+        # Latency of the hot paths; slow operations are logged with their SQL, stats saved from Settings.
+        recorder.slow_ms = self.storage.get_slow_operation_ms() or SLOW_OPERATION_MS
+        open_slow_log(os.path.join(app_data_path, "slow_operations.log"))
+        self.stats_path = os.path.join(app_data_path, "performance_stats.json")
+        self.thumbnails = ThumbnailCache(os.path.join(app_data_path, "thumbnails"))
+        # Products live in memory; screens write every change through to it.
+        self.catalog = Catalog()
+        self.catalog_seq, rows = self.storage.load_catalog()  # seq: last product change the catalog reflects
+        self.catalog.load(rows)
+        self._data_version, self._syncing_catalog = self.storage.data_version(), False
+        self.importing = False  # A bulk import pauses change polling and reloads the catalog when done.
+        self._grid_state = None  # (search term, catalog version) the product grid last showed
+        # Barcode scanners type like a keyboard; bursts ending in Enter on the POS screen go to the cart.
+        self.scanner = ScannerListener(self.on_scan)
+        self._search_job = None
+        self.checkout_engine = CheckoutEngine(self.db_path)
+        # Slow work runs on worker threads, each with its own connection from worker_storage.
+        self.tasks = TaskRunner(self, on_busy=self.set_busy)
+        self.worker_storage = ThreadLocalStorage(self.db_path)
+        # Receipts print on the spooler's own thread; a saved printer that is unusable here falls back to the default.
+        self.printer_spec, self.auto_print_receipts = self.storage.get_receipt_printer()
+        try:
+            printer = make_printer(self.printer_spec)
+        except ValueError:
+            printer = make_printer(None)
+        self.receipts = None  # Started by the first receipt; see spool_receipt.
+        self.analytics = None  # Created when the Analytics screen is first opened; keeps its totals between visits.
+        self.forecast, self._forecasting = None, False  # Loaded on a worker after startup; see update_forecast.
+        self.printer = printer
+        # The sale being rung up; its tax rates come from Settings, shared by every till on the database.
+        tax_rates, tax_inclusive = self.storage.get_tax()
+        self.cart = Cart(parse_tax_rates(tax_rates or ""), tax_inclusive)
+        self._thumbnail_requests = {}  # (path, size) -> callbacks waiting for the decoded image
+        self._unreadable_thumbnails = set()
+        # Vacuum, statistics, checkpoints, integrity checks and backups run while the shop is quiet.
+        self.maintenance = MaintenanceScheduler(os.path.join(app_data_path, "backups"))
+        self.last_input = self.last_db_change = time.monotonic()
+        self._maintaining = False
 
         # --- Configure Styles ---
         style = ttk.Style()
@@ -78,30 +200,46 @@ class RetailApp(ctk.CTk):
         # --- Sidebar ---
         self.navigation_frame = ctk.CTkFrame(self, corner_radius=0)
         self.navigation_frame.grid(row=0, column=0, sticky="nsew")
-        self.navigation_frame.grid_rowconfigure(6, weight=1)
+        self.navigation_frame.grid_rowconfigure(7, weight=1)
         self.navigation_frame_label = ctk.CTkLabel(self.navigation_frame, text="SAMARA trade center",
                                                    font=ctk.CTkFont(size=20, weight="bold"))
         self.navigation_frame_label.grid(row=0, column=0, padx=20, pady=20)
         self.inventory_button = self.create_nav_button("Inventory", self.inventory_button_event, 1)
         self.pos_button = self.create_nav_button("POS", self.pos_button_event, 2)
         self.sales_button = self.create_nav_button("Sales", self.sales_button_event, 3)
-        self.export_button = self.create_nav_button("Export to Excel", self.export_to_excel_secure, 4)
-        self.settings_button = self.create_nav_button("Settings", self.settings_button_event, 5)
+        self.analytics_button = self.create_nav_button("Analytics", self.analytics_button_event, 4)
+        self.export_button = self.create_nav_button("Export to Excel", self.export_to_excel_secure, 5)
+        self.settings_button = self.create_nav_button("Settings", self.settings_button_event, 6)
+        self.busy_bar = ctk.CTkProgressBar(self.navigation_frame, mode="indeterminate", height=6)
 
         # --- Main Frames ---
         self.inventory_frame = ctk.CTkFrame(self, corner_radius=0, fg_color="transparent")
         self.pos_frame = ctk.CTkFrame(self, corner_radius=0, fg_color="transparent")
         self.sales_frame = ctk.CTkFrame(self, corner_radius=0, fg_color="transparent")
+        self.analytics_frame = ctk.CTkFrame(self, corner_radius=0, fg_color="transparent")
         self.settings_frame = ctk.CTkFrame(self, corner_radius=0, fg_color="transparent")
 
-        self.create_inventory_ui()
-        self.create_pos_ui()
-        self.create_sales_ui()
-        self.create_settings_ui()
-        self.select_frame_by_name("inventory")
+        # Each screen is built the first time it is opened; the till starts on the POS screen.
+        self.screen_builders = {"inventory": self.create_inventory_ui, "pos": self.create_pos_ui,
+                                "sales": self.create_sales_ui, "analytics": self.create_analytics_ui,
+                                "settings": self.create_settings_ui}
+        self.built_screens = set()
+        self.select_frame_by_name("pos")
 
         # --- Global Key Bindings for Navigation ---
-        self.bind_all("<Key>", self.handle_key_press)
+        # The scanner sees keys first so the Enter ending a scan is not also taken as a button press.
+        self.bind_all("<Key>", self.on_key_press)
+        self.bind_all("<Key>", self.handle_key_press, add="+")
+        self.bind_all("<Key>", self.note_input, add="+")
+        self.bind_all("<Button>", self.note_input, add="+")
+
+        # --- Multi-terminal sync ---
+        self.query("prune_changes")
+        # Closed months move to data/archive so the live database stays small; history still reads them.
+        self.query("archive_sales")
+        self.update_forecast()
+        self.after(CHANGE_POLL_MS, self.poll_changes)
+        self.after(MAINTENANCE_POLL_MS, self.run_maintenance)
 
     def handle_key_press(self, event):
         """Main handler for keyboard navigation."""
@@ -128,41 +266,148 @@ class RetailApp(ctk.CTk):
         button.grid(row=row, column=0, sticky="ew")
         return button
 
+    # --- Background Work ---
+    def set_busy(self, busy):
+        """Shows the sidebar activity bar while background tasks are running."""
+        if busy:
+            self.busy_bar.grid(row=8, column=0, padx=20, pady=10, sticky="ew")
+            self.busy_bar.start()
+        else:
+            self.busy_bar.stop()
+            self.busy_bar.grid_remove()
+
+    def query(self, method, *args, on_done=None, on_error=None, **kwargs):
+        """Call a Storage method on a worker thread and hand its result to on_done on the Tk thread."""
+        return self.tasks.submit(lambda: getattr(self.worker_storage.get(), method)(*args, **kwargs),
+                                 on_done=on_done, on_error=on_error)
+
+    def poll_changes(self):
+        """Pick up product and tax changes made by other terminals sharing the database, and by our own workers."""
+        version = self.storage.data_version()
+        if version != self._data_version and not self._maintaining:
+            self.last_db_change = time.monotonic()  # Our own maintenance writes do not keep the shop busy.
+        if version != self._data_version and not self._syncing_catalog and not self.importing:
+            self._data_version, self._syncing_catalog = version, True
+            self.query("product_changes_since", self.catalog_seq, on_done=self.apply_product_changes,
+                       on_error=lambda e: setattr(self, "_syncing_catalog", False))
+            self.query("get_tax", on_done=self.apply_tax)
+        self.after(CHANGE_POLL_MS, self.poll_changes)
+
+    # --- Maintenance ---
+    def note_input(self, event=None):
+        self.last_input = time.monotonic()
+
+    def is_idle(self):
+        """Nobody has touched this till for a while; checked between maintenance steps so they stop at once."""
+        return time.monotonic() - self.last_input >= MAINTENANCE_IDLE_SECONDS
+
+    def run_maintenance(self):
+        """Run the maintenance that is due once this till is idle, no sale is open and no till has written lately."""
+        self.after(MAINTENANCE_POLL_MS, self.run_maintenance)
+        quiet = time.monotonic() - self.last_db_change >= MAINTENANCE_IDLE_SECONDS
+        if self._maintaining or self.importing or self.tasks.busy or self.cart or not quiet or not self.is_idle():
+            return
+        self._maintaining = True
+
+        def done(results):
+            self._maintaining = False
+            results = dict(results)
+            if results.get("integrity", "ok") != "ok":
+                messagebox.showwarning("Database Check", f"The database check found a problem: {results['integrity']}\n"
+                                                         "Close every till and restore the latest backup with "
+                                                         "maintenance.py.")
+            if results.get("backup", "").startswith("failed"):
+                messagebox.showwarning("Backup", f"The daily backup {results['backup']}")
+            if results and "settings" in self.built_screens: self.refresh_maintenance_status()
+
+        def failed(e):
+            self._maintaining = False
+
+        self.tasks.submit(lambda: self.maintenance.run_due(self.worker_storage.get(), idle=self.is_idle),
+                          on_done=done, on_error=failed)
+
+    def refresh_maintenance_status(self):
+        def show(state):
+            lines = []
+            for job, _ in JOB_INTERVALS:
+                last_run, result = state.get(job, (None, None))
+                lines.append(f"{job.capitalize()}: {last_run}, {result or 'running'}" if last_run
+                             else f"{job.capitalize()}: not run yet")
+            self.maintenance_label.configure(text="\n".join(lines))
+
+        self.query("maintenance_state", on_done=show)
+
+    def back_up_now(self):
+        def backup():
+            storage = self.worker_storage.get()
+            name = take_backup(storage, self.maintenance.backup_dir)
+            rotate_backups(self.maintenance.backup_dir, self.maintenance.keep)
+            return name
+
+        self.tasks.submit(backup, on_done=lambda name: messagebox.showinfo(
+            "Backup", f"Backed up to {os.path.join(self.maintenance.backup_dir, name)}"),
+                          on_error=lambda e: messagebox.showerror("Backup", f"The backup failed: {e}"))
+
+    def backed_up(self, method, label):
+        """A task that backs up the database, then calls a Storage method; returns the backup's name."""
+        def task():
+            storage = self.worker_storage.get()
+            name = take_backup(storage, self.maintenance.backup_dir, label=label)
+            getattr(storage, method)()
+            return name
+
+        return task
+
+    def apply_product_changes(self, changes):
+        if changes is None:
+            # Too far behind the change log; start over from a fresh snapshot.
+            return self.query("load_catalog", on_done=self.reload_catalog,
+                              on_error=lambda e: setattr(self, "_syncing_catalog", False))
+        self._syncing_catalog = False
+        seq, deleted, rows = changes
+        version = self.catalog.version
+        for product_id in deleted:
+            self.catalog.remove(product_id)
+        for row in rows:
+            self.catalog.apply(row)
+        self.catalog_seq = max(self.catalog_seq, seq)
+        if self.catalog.version != version: self.refresh_product_views()
+
+    def reload_catalog(self, snapshot):
+        self._syncing_catalog = False
+        self.catalog_seq, rows = snapshot
+        self.catalog.load(rows)
+        self.refresh_product_views()
+
+    def refresh_product_views(self):
+        if self.inventory_frame.winfo_ismapped(): self.refresh_inventory_list()
+        if self.pos_frame.winfo_ismapped(): self.populate_product_grid(self.search_entry.get())
+
+    def request_thumbnail(self, path, size, on_ready):
+        """Decode a product thumbnail on a worker and call on_ready(CTkImage or None) on the Tk thread."""
+        key = (path, size)
+        if key in self._unreadable_thumbnails: return on_ready(None)
+        if key in self._thumbnail_requests: return self._thumbnail_requests[key].append(on_ready)
+        self._thumbnail_requests[key] = [on_ready]
+
+        def decoded(pil_image):
+            image = self.thumbnails.store(path, pil_image, size) if pil_image is not None else None
+            if image is None: self._unreadable_thumbnails.add(key)
+            for callback in self._thumbnail_requests.pop(key): callback(image)
+
+        self.tasks.submit(self.thumbnails.decode, path, on_done=decoded,
+                          on_error=lambda e: self._thumbnail_requests.pop(key, None))
+
     def hash_password(self, password):
-        return hashlib.sha256(password.encode()).hexdigest()
+        return hash_password(password)
 
     def verify_password(self, entered_password):
-        self.cursor.execute("SELECT password FROM settings WHERE id = 1")
-        stored_hash = self.cursor.fetchone()
-        return stored_hash[0] == self.hash_password(entered_password) if stored_hash else False
+        stored_hash = self.storage.get_password_hash()
+        return stored_hash == self.hash_password(entered_password) if stored_hash else False
 
     def ask_password(self):
         return PasswordDialog(self).show()
 
-    def create_tables(self):
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,
-                price REAL NOT NULL, quantity INTEGER NOT NULL,
-                image_path TEXT DEFAULT '')''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, total_price REAL NOT NULL,
-                sale_date TIMESTAMP DEFAULT (datetime('now', 'localtime')))''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sale_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT, sale_id INTEGER, product_id INTEGER,
-                product_name TEXT, quantity INTEGER, price REAL,
-                FOREIGN KEY (sale_id) REFERENCES sales (id),
-                FOREIGN KEY (product_id) REFERENCES products (id))''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                id INTEGER PRIMARY KEY CHECK (id = 1), password TEXT NOT NULL)''')
-        self.cursor.execute("SELECT * FROM settings WHERE id = 1")
-        if not self.cursor.fetchone():
-            self.cursor.execute("INSERT INTO settings (id, password) VALUES (1, ?)", (self.hash_password("admin"),))
-        self.conn.commit()
-
     # --- Inventory Section ---
     def create_inventory_ui(self):
         form_frame = ctk.CTkFrame(self.inventory_frame)
@@ -182,30 +427,46 @@ class RetailApp(ctk.CTk):
         self.product_price_entry.grid(row=2, column=0, padx=10, pady=5, sticky="ew")
         self.product_qty_entry = ctk.CTkEntry(form_frame, placeholder_text="Quantity")
         self.product_qty_entry.grid(row=2, column=1, padx=10, pady=5, sticky="ew")
+        self.product_barcode_entry = ctk.CTkEntry(form_frame, placeholder_text="Barcodes / SKUs (comma separated)")
+        self.product_barcode_entry.grid(row=4, column=0, columnspan=2, padx=10, pady=5, sticky="ew")
         ctk.CTkButton(form_frame, text="Add Image", command=self.add_image).grid(row=3, column=0, padx=10, pady=10,
                                                                                  sticky="ew")
         self.image_path_label = ctk.CTkLabel(form_frame, text="No image selected")
         self.image_path_label.grid(row=3, column=1, padx=10, pady=10, sticky="w")
         self.product_image_label = ctk.CTkLabel(form_frame, text="")
         self.product_image_label.grid(row=1, column=2, rowspan=3, padx=20)
-        ctk.CTkButton(form_frame, text="Add Product", command=self.add_product_secure).grid(row=4, column=0, padx=10,
+        ctk.CTkButton(form_frame, text="Add Product", command=self.add_product_secure).grid(row=5, column=0, padx=10,
                                                                                             pady=10, sticky="ew")
-        ctk.CTkButton(form_frame, text="Update Product", command=self.update_product_secure).grid(row=4, column=1,
+        ctk.CTkButton(form_frame, text="Update Product", command=self.update_product_secure).grid(row=5, column=1,
                                                                                                   padx=10, pady=10,
                                                                                                   sticky="ew")
+        ctk.CTkButton(form_frame, text="Import Price List", command=self.import_products_secure).grid(
+            row=6, column=0, padx=10, pady=10, sticky="ew")
         ctk.CTkButton(form_frame, text="Clear All Stock", command=self.clear_stock_secure, fg_color="red",
-                      hover_color="darkred").grid(row=5, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
+                      hover_color="darkred").grid(row=6, column=1, padx=10, pady=10, sticky="ew")
         inventory_list_frame = ctk.CTkFrame(self.inventory_frame)
         inventory_list_frame.pack(fill="both", expand=True, padx=20, pady=10)
-        self.inventory_tree = ttk.Treeview(inventory_list_frame, columns=("ID", "Name", "Price", "Quantity"),
+        stock_frame = ctk.CTkFrame(inventory_list_frame)
+        stock_frame.pack(fill="x", pady=(0, 5))
+        self.low_stock_label = ctk.CTkLabel(stock_frame, text="", anchor="w")
+        self.low_stock_label.pack(side="left", padx=10)
+        ctk.CTkButton(stock_frame, text="Purchase Order", command=self.save_purchase_order).pack(side="right",
+                                                                                               padx=10, pady=5)
+        self.low_stock_only_var = tk.BooleanVar(value=False)
+        ctk.CTkCheckBox(stock_frame, text="Low stock only", variable=self.low_stock_only_var,
+                        command=self.refresh_inventory_list).pack(side="right", padx=10)
+        self.inventory_tree = ttk.Treeview(inventory_list_frame,
+                                           columns=("ID", "Name", "Price", "Quantity", "Cover", "Reorder"),
                                            show='headings')
         self.inventory_tree.heading("ID", text="ID");
         self.inventory_tree.heading("Name", text="Name");
         self.inventory_tree.heading("Price", text="Price (Rs.)");
         self.inventory_tree.heading("Quantity", text="Quantity")
+        self.inventory_tree.heading("Cover", text="Days of Cover")
+        self.inventory_tree.heading("Reorder", text="Reorder At")
         self.inventory_tree.pack(fill="both", expand=True)
+        self.inventory_sync = TreeSync(self.inventory_tree)
         self.inventory_tree.bind("<<TreeviewSelect>>", self.on_product_select)
-        self.refresh_inventory_list()
 
     def add_image(self):
         path = filedialog.askopenfilename(filetypes=[("Image Files", "*.jpg *.jpeg *.png")])
@@ -214,9 +475,63 @@ class RetailApp(ctk.CTk):
             self.image_path = path
 
     def refresh_inventory_list(self):
-        for item in self.inventory_tree.get_children(): self.inventory_tree.delete(item)
-        for row in self.cursor.execute("SELECT id, name, price, quantity FROM products"):
-            self.inventory_tree.insert("", "end", values=row)
+        """List the products with their days of cover and reorder point; low stock only if ticked."""
+        forecast, low_only = self.forecast, self.low_stock_only_var.get()
+        if forecast is not None and forecast.stale(): self.update_forecast()
+        rows, low = [], 0
+        for product_id, name, price, quantity in self.catalog.inventory_rows():
+            status = forecast.status(product_id, quantity) if forecast is not None else None
+            if status is not None and status.low:
+                low += 1
+            elif low_only:
+                continue
+            rows.append((product_id, name, format_amount(price), quantity,
+                         "" if status is None else f"{status.days_of_cover:.1f}",
+                         "" if status is None else status.reorder_point))
+        self.inventory_sync.sync(rows)
+        self.low_stock_label.configure(
+            text="Forecast loading..." if forecast is None else f"{low} products at or below their reorder point")
+
+    def update_forecast(self):
+        """Fold the days completed since the last update into the stock forecast, on a worker."""
+        if self._forecasting: return
+        self._forecasting = True
+        forecast = self.forecast
+
+        def run():
+            nonlocal forecast
+            if forecast is None:
+                from forecast import StockForecast  # NumPy; kept off the startup path.
+                forecast = StockForecast()
+            return forecast, forecast.update(self.worker_storage.get())
+
+        def done(result):
+            loaded, changed = result
+            self._forecasting = False
+            if changed or self.forecast is None:
+                self.forecast = loaded
+                self.refresh_product_views()
+
+        self.tasks.submit(run, on_done=done, on_error=lambda e: setattr(self, "_forecasting", False))
+
+    def save_purchase_order(self):
+        """Save an order for every product at or below its reorder point, enough to cover the next weeks."""
+        if self.forecast is None:
+            return messagebox.showinfo("Purchase Order", "The stock forecast is still loading.")
+        lines = self.forecast.purchase_order(
+            (record.id, record.name, record.quantity) for record in self.catalog.records.values())
+        if not lines:
+            return messagebox.showinfo("Purchase Order", "No product is at or below its reorder point.")
+        filename = filedialog.asksaveasfilename(
+            initialfile=f"purchase_order_{datetime.now().strftime('%Y%m%d')}.csv", defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")])
+        if not filename: return
+        from forecast import write_purchase_order
+        try:
+            write_purchase_order(lines, filename)
+        except OSError as e:
+            return messagebox.showerror("Purchase Order", f"The order could not be saved: {e}")
+        messagebox.showinfo("Purchase Order", f"Saved an order for {len(lines)} products to {filename}")
 
     def add_product_secure(self):
         if self.ask_password(): self.add_product()
@@ -224,17 +539,27 @@ class RetailApp(ctk.CTk):
     def add_product(self):
         name, price_str, qty_str = self.product_name_entry.get(), self.product_price_entry.get(), self.product_qty_entry.get()
         image_path = getattr(self, 'image_path', "")
+        barcodes = parse_barcodes(self.product_barcode_entry.get())
         if not all([name, price_str, qty_str]): return messagebox.showerror("Error", "Please fill out all fields.")
         try:
-            price, qty = float(price_str), int(qty_str)
-            self.cursor.execute("INSERT INTO products (name, price, quantity, image_path) VALUES (?, ?, ?, ?)",
-                                (name, price, qty, image_path))
-            self.conn.commit()
+            price, qty = to_paise(price_str), int(qty_str)
+        except ValueError as e:
+            return messagebox.showerror("Error", f"Invalid input or database error: {e}")
+
+        def save():
+            storage = self.worker_storage.get()
+            product_id = storage.add_product(name, price, qty, image_path, barcodes)
+            self.thumbnails.write_thumbnail(image_path)
+            return storage.get_catalog_row(product_id)
+
+        def saved(row):
+            self.catalog.apply(row)
             messagebox.showinfo("Success", f"Product '{name}' added.")
             self.clear_inventory_form();
             self.refresh_inventory_list()
-        except (ValueError, sqlite3.Error) as e:
-            messagebox.showerror("Error", f"Invalid input or database error: {e}")
+
+        self.tasks.submit(save, on_done=saved,
+                          on_error=lambda e: messagebox.showerror("Error", f"Invalid input or database error: {e}"))
 
     def update_product_secure(self):
         if self.ask_password(): self.update_product()
@@ -242,55 +567,133 @@ class RetailApp(ctk.CTk):
     def update_product(self):
         product_id, name, price_str, qty_str = self.product_id_entry.get(), self.product_name_entry.get(), self.product_price_entry.get(), self.product_qty_entry.get()
         image_path = getattr(self, 'image_path', None)
+        barcodes = parse_barcodes(self.product_barcode_entry.get())
         if not product_id: return messagebox.showerror("Error", "Please select a product.")
         if not all([name, price_str, qty_str]): return messagebox.showerror("Error", "Please fill out all fields.")
         try:
-            price, qty = float(price_str), int(qty_str)
-            if image_path is not None:
-                self.cursor.execute("UPDATE products SET name=?, price=?, quantity=?, image_path=? WHERE id=?",
-                                    (name, price, qty, image_path, product_id))
-            else:
-                self.cursor.execute("UPDATE products SET name=?, price=?, quantity=? WHERE id=?",
-                                    (name, price, qty, product_id))
-            self.conn.commit()
+            product_id, price, qty = int(product_id), to_paise(price_str), int(qty_str)
+        except ValueError as e:
+            return messagebox.showerror("Error", f"Invalid input or database error: {e}")
+
+        def save():
+            storage = self.worker_storage.get()
+            storage.update_product(product_id, name, price, qty, image_path, barcodes)
+            self.thumbnails.write_thumbnail(image_path)
+            return storage.get_catalog_row(product_id)
+
+        def saved(row):
+            if row: self.catalog.apply(row)
             messagebox.showinfo("Success", f"Product ID '{product_id}' updated.")
             self.clear_inventory_form();
             self.refresh_inventory_list()
-        except (ValueError, sqlite3.Error) as e:
-            messagebox.showerror("Error", f"Invalid input or database error: {e}")
+
+        self.tasks.submit(save, on_done=saved,
+                          on_error=lambda e: messagebox.showerror("Error", f"Invalid input or database error: {e}"))
 
     def clear_stock_secure(self):
         if self.ask_password(): self.clear_stock()
 
     def clear_stock(self):
-        if messagebox.askyesno("Confirm Clear Stock", "Are you sure? This cannot be undone."):
-            try:
-                self.cursor.execute("DELETE FROM products");
-                self.cursor.execute("DELETE FROM sqlite_sequence WHERE name='products'")
-                self.conn.commit()
-                messagebox.showinfo("Success", "All products cleared.");
+        if messagebox.askyesno("Confirm Clear Stock", "Are you sure? A backup is taken first, but restoring it "
+                                                      "means closing every till."):
+            def cleared(backup):
+                self.catalog.clear()
+                messagebox.showinfo("Success", f"All products cleared. Backup {backup} has them; restore it with "
+                                               f"maintenance.py if needed.");
                 self.refresh_inventory_list()
-            except sqlite3.Error as e:
-                messagebox.showerror("Database Error", f"An error occurred: {e}")
+
+            self.tasks.submit(self.backed_up("clear_products", "before-clear-stock"), on_done=cleared,
+                              on_error=lambda e: messagebox.showerror("Database Error", f"An error occurred: {e}"))
+
+    def import_products_secure(self):
+        if self.ask_password(): self.import_products()
+
+    def import_products(self):
+        filename = filedialog.askopenfilename(filetypes=[("Price lists", "*.xlsx *.csv"), ("Excel files", "*.xlsx"),
+                                                         ("CSV files", "*.csv"), ("All files", "*.*")])
+        if not filename: return
+        add_quantities = messagebox.askyesnocancel(
+            "Import Quantities", "Add the file's quantities to the current stock?\n\n"
+                                 "Yes adds them (a delivery); No replaces the stock levels (a stock count).")
+        if add_quantities is None: return
+
+        def run(task):
+            from importer import import_products
+            return import_products(self.worker_storage.get(), filename, add_quantities,
+                                   progress=task.report, cancelled=task.cancelled)
+
+        def finished(report):
+            dialog.destroy()
+            message = report.summary()
+            if report.errors:
+                from importer import write_error_report
+                message += "\n\n" + "\n".join(f"Line {line}: {error}" for line, error in report.errors[:10])
+                try:
+                    path = write_error_report(report.errors, os.path.splitext(filename)[0] + "_errors.csv")
+                    message += f"\n\nEvery skipped row is listed in {path}"
+                except OSError:
+                    pass
+            self.finish_import()
+            with recorder.idle():
+                (messagebox.showwarning if report.errors else messagebox.showinfo)("Import Finished", message)
+
+        def failed(e):
+            dialog.destroy()
+            self.finish_import()
+            with recorder.idle():
+                messagebox.showerror("Import Error", f"The price list could not be imported: {e}")
+
+        def cancel():
+            # The worker stops before its next chunk; chunks already written are kept and shown.
+            task.cancel()
+            dialog.destroy()
+            self.finish_import()
+            messagebox.showinfo("Import Cancelled", "The import was cancelled. Rows imported so far were kept.")
+
+        # Other tills' changes are still picked up afterwards: the catalog is reloaded once the import ends.
+        self.importing = True
+        with recorder.operation("import_products"):
+            dialog = ProgressDialog(self, on_cancel=cancel, title="Importing", verb="Read")
+            task = self.tasks.submit(run, with_task=True, on_progress=dialog.update_progress, on_done=finished,
+                                     on_error=failed)
+
+    def finish_import(self):
+        """Reload the catalog once, rather than once per imported chunk, and resume change polling."""
+        self.importing = False
+        self._syncing_catalog = True
+        self.query("load_catalog", on_done=self.reload_catalog,
+                   on_error=lambda e: setattr(self, "_syncing_catalog", False))
 
     def on_product_select(self, event):
         selected_item = self.inventory_tree.focus()
         if not selected_item: return
-        values = self.inventory_tree.item(selected_item)['values']
+        product = self.catalog.get(int(selected_item))
+        if product is None: return
         self.product_id_entry.delete(0, tk.END);
-        self.product_id_entry.insert(0, values[0])
+        self.product_id_entry.insert(0, product.id)
         self.product_name_entry.delete(0, tk.END);
-        self.product_name_entry.insert(0, values[1])
+        self.product_name_entry.insert(0, product.name)
         self.product_price_entry.delete(0, tk.END);
-        self.product_price_entry.insert(0, values[2])
+        self.product_price_entry.insert(0, format_amount(product.price))
         self.product_qty_entry.delete(0, tk.END);
-        self.product_qty_entry.insert(0, values[3])
-        path = self.cursor.execute("SELECT image_path FROM products WHERE id=?", (values[0],)).fetchone()[0]
+        self.product_qty_entry.insert(0, product.quantity)
+        self.product_barcode_entry.delete(0, tk.END);
+        self.product_barcode_entry.insert(0, ", ".join(product.barcodes))
+        self.show_product_image(selected_item, product.image_path)
+
+    def show_product_image(self, item, path):
+        if self.inventory_tree.focus() != item: return  # The selection moved on while the path was loading.
         if path and os.path.exists(path):
             self.image_path = path
             self.image_path_label.configure(text=os.path.basename(path))
-            img = ctk.CTkImage(light_image=Image.open(path), size=(100, 100))
-            self.product_image_label.configure(image=img, text="")
+            img = self.thumbnails.cached(path, (100, 100))
+            if img is not None:
+                self.product_image_label.configure(image=img, text="")
+            else:
+                self.product_image_label.configure(image=None, text="Loading...")
+                self.request_thumbnail(path, (100, 100),
+                                       lambda image: self.show_product_image(item, path) if image else
+                                       self.product_image_label.configure(image=None, text="No Image"))
         else:
             self.product_image_label.configure(image=None, text="No Image")
             self.image_path_label.configure(text="No image selected");
@@ -301,6 +704,7 @@ class RetailApp(ctk.CTk):
         self.product_name_entry.delete(0, tk.END)
         self.product_price_entry.delete(0, tk.END);
         self.product_qty_entry.delete(0, tk.END)
+        self.product_barcode_entry.delete(0, tk.END)
         self.image_path_label.configure(text="No image selected")
         self.product_image_label.configure(image=None, text="No Image");
         self.image_path = ""
@@ -313,21 +717,28 @@ class RetailApp(ctk.CTk):
         pos_left_frame = ctk.CTkFrame(self.pos_frame)
         pos_left_frame.grid(row=0, column=0, sticky="nsew", padx=10, pady=10)
         ctk.CTkLabel(pos_left_frame, text="Products", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=5)
-        self.search_entry = ctk.CTkEntry(pos_left_frame, placeholder_text="Search by name...")
+        self.search_entry = ctk.CTkEntry(pos_left_frame, placeholder_text="Search by name or scan a barcode...")
         self.search_entry.pack(fill="x", padx=10, pady=5)
         self.search_entry.bind("<KeyRelease>", self.search_product)
-        self.product_grid_frame = ctk.CTkScrollableFrame(pos_left_frame, label_text="")
-        self.product_grid_frame.pack(fill="both", expand=True, padx=10, pady=10)
+        self.product_grid = ProductGrid(pos_left_frame, on_select=lambda pid: self.add_to_cart(pid, 1),
+                                        image_loader=self.load_tile_image)
+        self.product_grid.pack(fill="both", expand=True, padx=10, pady=10)
 
         pos_right_frame = ctk.CTkFrame(self.pos_frame)
         pos_right_frame.grid(row=0, column=1, sticky="nsew", padx=10, pady=10)
         ctk.CTkLabel(pos_right_frame, text="Cart", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=5)
-        self.cart_tree = ttk.Treeview(pos_right_frame, columns=("ID", "Name", "Price", "Quantity"), show='headings')
+        self.cart_tree = ttk.Treeview(pos_right_frame, columns=("ID", "Name", "Price", "Quantity", "Amount"),
+                                      show='headings')
         self.cart_tree.heading("ID", text="ID");
         self.cart_tree.heading("Name", text="Name");
         self.cart_tree.heading("Price", text="Price (Rs.)");
         self.cart_tree.heading("Quantity", text="Quantity")
+        self.cart_tree.heading("Amount", text="Amount (Rs.)")
         self.cart_tree.pack(fill="both", expand=True, padx=10, pady=10)
+        # Rows are CartLines; a line's discount shows after its amount.
+        self.cart_sync = TreeSync(self.cart_tree, key=lambda line: line.product_id, values=lambda line: (
+            line.product_id, line.name, format_amount(line.price), line.quantity,
+            format_amount(line.amount) + (f" (-{format_amount(line.discount)})" if line.discount else "")))
 
         cart_controls_frame = ctk.CTkFrame(pos_right_frame)
         cart_controls_frame.pack(fill="x", padx=10, pady=(0, 5))
@@ -338,6 +749,8 @@ class RetailApp(ctk.CTk):
                       command=self.decrease_cart_quantity).grid(row=0, column=1, padx=2, sticky="ew")
         ctk.CTkButton(cart_controls_frame, text="Remove Item", fg_color="red", hover_color="darkred",
                       command=self.remove_from_cart).grid(row=0, column=2, padx=2, sticky="ew")
+        ctk.CTkButton(cart_controls_frame, text="Discount", command=self.discount_secure).grid(
+            row=1, column=0, columnspan=3, padx=2, pady=(5, 0), sticky="ew")
 
         self.total_label = ctk.CTkLabel(pos_right_frame, text="Total: Rs.0.00",
                                         font=ctk.CTkFont(size=18, weight="bold"))
@@ -347,51 +760,76 @@ class RetailApp(ctk.CTk):
         checkout_frame.pack(fill="x", padx=10, pady=5)
         checkout_frame.grid_columnconfigure((0, 1), weight=1)
         # --- THIS IS THE CHANGE ---
-        ctk.CTkButton(checkout_frame, text="Checkout", command=self.checkout_secure, fg_color="green",
-                      hover_color="darkgreen").grid(row=0, column=0, padx=2, sticky="ew")
+        self.checkout_button = ctk.CTkButton(checkout_frame, text="Checkout", command=self.checkout_secure,
+                                             fg_color="green", hover_color="darkgreen")
+        self.checkout_button.grid(row=0, column=0, padx=2, sticky="ew")
         self.print_button = ctk.CTkButton(checkout_frame, text="Print Receipt", command=self.print_receipt,
                                           state="disabled")
         self.print_button.grid(row=0, column=1, padx=2, sticky="ew")
 
         ctk.CTkButton(pos_right_frame, text="Clear Cart", command=self.clear_cart).pack(fill="x", padx=10, pady=5)
-        self.cart = {}
+        self.refresh_cart_tree()
 
+    @timed("populate_product_grid")
     def populate_product_grid(self, search_term=""):
-        for widget in self.product_grid_frame.winfo_children(): widget.destroy()
-        products = self.cursor.execute(
-            "SELECT id, name, price, image_path FROM products WHERE quantity > 0 AND name LIKE ?",
-            (f"%{search_term}%",)).fetchall()
-        for i, (pid, name, price, path) in enumerate(products):
-            row, col = divmod(i, 4)
-            item_frame = ctk.CTkFrame(self.product_grid_frame)
-            item_frame.grid(row=row, column=col, padx=10, pady=10, sticky="nsew")
-            try:
-                img = Image.open(path) if path and os.path.exists(path) else Image.new('RGB', (150, 120), color='grey')
-                ctk_img = ctk.CTkImage(light_image=img, size=(150, 120))
-                img_label = ctk.CTkLabel(item_frame, image=ctk_img, text="")
-            except Exception:
-                img_label = ctk.CTkLabel(item_frame, text="No Image", width=150, height=120)
-            img_label.pack(pady=(10, 5))
-            ctk.CTkLabel(item_frame, text=name, font=ctk.CTkFont(size=14, weight="bold")).pack()
-            ctk.CTkLabel(item_frame, text=f"Rs.{price:.2f}", font=ctk.CTkFont(size=12)).pack(pady=(0, 10))
-
-            add_func = lambda e, p=pid: self.add_to_cart(p, 1)
-            item_frame.bind("<Button-1>", add_func);
-            img_label.bind("<Button-1>", add_func)
+        state = (search_term, self.catalog.version)
+        if state == self._grid_state: return  # Same search over an unchanged catalog.
+        self._grid_state = state
+        self.product_grid.set_products(self.catalog.search(search_term))
+
+    def load_tile_image(self, path):
+        """Image for a grid tile: the cached thumbnail, or a placeholder while it is decoded in the background."""
+        if path:
+            if (img := self.thumbnails.cached(path)) is not None:
+                return img
+            self.request_thumbnail(path, TILE_IMAGE_SIZE,
+                                   lambda image: image and self.product_grid.refresh_image(path))
+        if not hasattr(self, '_placeholder_image'):
+            from PIL import Image
+            self._placeholder_image = ctk.CTkImage(light_image=Image.new('RGB', TILE_IMAGE_SIZE, color='grey'),
+                                                   size=TILE_IMAGE_SIZE)
+        return self._placeholder_image
 
     def search_product(self, event=None):
+        # Debounced: a burst of key presses runs a single search once typing pauses.
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(SEARCH_DEBOUNCE_MS, self._run_search)
+
+    @timed("search_product")
+    def _run_search(self):
+        self._search_job = None
         self.populate_product_grid(self.search_entry.get())
 
+    def on_key_press(self, event):
+        if self.pos_frame.winfo_ismapped() and self.scanner.feed(event.char, event.keysym, event.time):
+            return "break"
+
+    def on_scan(self, code):
+        """A scanned code: add its product to the cart without touching the product grid."""
+        widget = self.focus_get()
+        # The scanner typed into whatever had focus, usually the search box; take the code back out.
+        if isinstance(widget, tk.Entry) and widget.get().endswith(code):
+            widget.delete(len(widget.get()) - len(code), tk.END)
+            if widget is self.search_entry._entry and self._search_job is not None:
+                self.after_cancel(self._search_job)
+                self._search_job = None
+        product = self.catalog.lookup_barcode(code)
+        if product is None:
+            return messagebox.showwarning("Unknown Barcode", f"No product has the barcode '{code}'.")
+        self.add_to_cart(product.id, 1)
+
+    @timed("add_to_cart")
     def add_to_cart(self, product_id, quantity):
-        name, price, stock = self.cursor.execute("SELECT name, price, quantity FROM products WHERE id=?",
-                                                 (product_id,)).fetchone()
-        cart_qty = self.cart.get(product_id, {}).get('quantity', 0)
-        if (quantity + cart_qty) > stock: return messagebox.showwarning("Out of Stock",
-                                                                        f"Only {stock - cart_qty} more available.")
-        if product_id in self.cart:
-            self.cart[product_id]['quantity'] += quantity
-        else:
-            self.cart[product_id] = {'name': name, 'price': price, 'quantity': quantity}
+        product = self.catalog.get(product_id)
+        if product is None:
+            with recorder.idle():
+                return messagebox.showerror("Error", "This product no longer exists.")
+        cart_qty = self.cart.quantity(product_id)
+        if (quantity + cart_qty) > product.quantity:
+            with recorder.idle():
+                return messagebox.showwarning("Out of Stock", f"Only {product.quantity - cart_qty} more available.")
+        self.cart.add(product_id, product.name, product.price, quantity)
         self.refresh_cart_tree()
 
     def get_selected_cart_product_id(self):
@@ -403,93 +841,121 @@ class RetailApp(ctk.CTk):
 
     def decrease_cart_quantity(self):
         pid = self.get_selected_cart_product_id()
-        if not pid: return
-        if self.cart[pid]['quantity'] > 1:
-            self.cart[pid]['quantity'] -= 1
-        else:
-            del self.cart[pid]
+        if not pid or pid not in self.cart: return
+        self.cart.set_quantity(pid, self.cart.quantity(pid) - 1)
         self.refresh_cart_tree()
 
     def remove_from_cart(self):
         if pid := self.get_selected_cart_product_id():
-            if pid in self.cart: del self.cart[pid]; self.refresh_cart_tree()
+            if pid in self.cart: self.cart.remove(pid); self.refresh_cart_tree()
 
+    def discount_secure(self):
+        if self.ask_password(): self.apply_discount()
+
+    def apply_discount(self):
+        """Discount the selected line, or the whole sale when no line is selected; in rupees or as a percentage."""
+        if not self.cart: return messagebox.showerror("Error", "Cart is empty.")
+        pid = self.get_selected_cart_product_id()
+        line = self.cart.get(pid) if pid else None
+        if line is not None:
+            prompt, amount = f"Discount on {line.name}, in Rs. or %:", line.gross
+        else:
+            prompt, amount = "Discount on the whole sale, in Rs. or %:", self.cart.subtotal - self.cart.line_discounts
+        text = ctk.CTkInputDialog(title="Discount", text=prompt).get_input()
+        if text is None: return
+        try:
+            paise = parse_discount(text, amount)
+            if line is not None:
+                self.cart.set_line_discount(pid, paise)
+            else:
+                self.cart.set_discount(paise)
+        except ValueError as e:
+            return messagebox.showerror("Discount", str(e))
+        self.refresh_cart_tree()
+
+    @timed("refresh_cart_tree")
     def refresh_cart_tree(self):
-        for item in self.cart_tree.get_children(): self.cart_tree.delete(item)
-        total = sum(item['price'] * item['quantity'] for item in self.cart.values())
-        self.total_label.configure(text=f"Total: Rs.{total:.2f}")
-        for pid, item in self.cart.items():
-            self.cart_tree.insert("", "end", values=(pid, item['name'], item['price'], item['quantity']))
+        cart = self.cart
+        text = f"Total: Rs.{format_amount(cart.total)}"
+        if cart.total_discount or cart.tax_rates:
+            lines = [f"Subtotal: Rs.{format_amount(cart.subtotal)}"]
+            if cart.total_discount:
+                lines.append(f"Discount: Rs.{format_amount(-cart.total_discount)}")
+            for label, rate, amount in cart.taxes():
+                lines.append(f"{'incl. ' if cart.tax_inclusive else ''}{label} {rate / 100:g}%: "
+                             f"Rs.{format_amount(amount)}")
+            text = "\n".join(lines + [text])
+        self.total_label.configure(text=text)
+        self.cart_sync.sync(cart)
         self.print_button.configure(state="disabled")
 
     def clear_cart(self):
-        self.cart = {};
+        self.cart.clear();
         self.refresh_cart_tree()
 
+    def apply_tax(self, tax):
+        """Use the tax settings (rates as text, prices include tax) for the sale being rung up and the next."""
+        rates, inclusive = parse_tax_rates(tax[0] or ""), tax[1]
+        if (rates, inclusive) == (self.cart.tax_rates, self.cart.tax_inclusive): return
+        self.cart.tax_rates, self.cart.tax_inclusive = rates, inclusive
+        if "pos" in self.built_screens: self.refresh_cart_tree()
+
     def checkout_secure(self):
         if self.ask_password(): self.checkout()
 
+    @timed("checkout")
     def checkout(self):
-        if not self.cart: return messagebox.showerror("Error", "Cart is empty.")
-        total_price = sum(item['price'] * item['quantity'] for item in self.cart.values())
-        try:
-            self.cursor.execute("INSERT INTO sales (total_price) VALUES (?)", (total_price,))
-            sale_id = self.cursor.lastrowid
-            self.last_sale_details = {"sale_id": sale_id, "items": [], "total": total_price,
-                                      "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-            for pid, item in self.cart.items():
-                self.cursor.execute(
-                    "INSERT INTO sale_items (sale_id, product_id, product_name, quantity, price) VALUES (?, ?, ?, ?, ?)",
-                    (sale_id, pid, item['name'], item['quantity'], item['price']))
-                self.cursor.execute("UPDATE products SET quantity = quantity - ? WHERE id = ?", (item['quantity'], pid))
-                self.last_sale_details["items"].append(item)
-            self.conn.commit()
-            messagebox.showinfo("Success", "Checkout complete.")
-            self.clear_cart();
-            self.populate_product_grid()
-            self.print_button.configure(state="normal")
-        except sqlite3.Error as e:
-            self.conn.rollback();
-            messagebox.showerror("Database Error", f"Checkout failed: {e}")
+        if not self.cart:
+            with recorder.idle():
+                return messagebox.showerror("Error", "Cart is empty.")
+        self.checkout_button.configure(state="disabled")
+        future = self.checkout_engine.submit(self.cart)
+        self.tasks.watch(future, on_done=self.checkout_done, on_error=self.checkout_failed)
+
+    def checkout_done(self, sale):
+        self.checkout_button.configure(state="normal")
+        self.last_sale_details = sale
+        if self.auto_print_receipts:
+            self.after_idle(self.spool_receipt, sale)  # Outside the checkout span: printing is not checkout time.
+        message = "Checkout complete."
+        for row in sale['products']:
+            self.catalog.apply(row)
+            status = self.forecast.status(row[0], row[3]) if self.forecast is not None else None
+            if status is not None and status.low:
+                message += f"\n{row[1]} is running low: {row[3]} left, about {status.days_of_cover:.0f} days."
+        with recorder.idle():
+            messagebox.showinfo("Success", message)
+        self.clear_cart();
+        self.populate_product_grid()
+        self.print_button.configure(state="normal")
+
+    def checkout_failed(self, error):
+        self.checkout_button.configure(state="normal")
+        if isinstance(error, InsufficientStockError):
+            # Another till sold it first; bring this till's view of the product up to date.
+            def reload(row):
+                if row: self.catalog.apply(row)
+                self.populate_product_grid()
+
+            self.query("get_catalog_row", error.product_id, on_done=reload)
+            with recorder.idle():
+                return messagebox.showwarning("Out of Stock", f"Checkout failed: {error}")
+        with recorder.idle():
+            messagebox.showerror("Database Error", f"Checkout failed: {error}")
 
     def print_receipt(self):
         if not self.last_sale_details:
             return messagebox.showerror("Error", "No sale has been made yet.")
-        receipt = f"""
-        SAMARA TRADE CENTER
-        --------------------------
-        Sale ID: {self.last_sale_details['sale_id']}
-        Date: {self.last_sale_details['date']}
-        --------------------------
-        Items:
-        """
-        for item in self.last_sale_details['items']:
-            receipt += f"\n  {item['name']} x {item['quantity']}"
-            receipt += f"\n    (Rs.{item['price']:.2f} each) = Rs.{item['price'] * item['quantity']:.2f}"
-
-        receipt += f"""
-        --------------------------
-        Total: Rs.{self.last_sale_details['total']:.2f}
-
-        Thank you!
-        """
+        self.spool_receipt(self.last_sale_details, announce=True)
 
-        try:
-            printer_name = win32print.GetDefaultPrinter()
-            hPrinter = win32print.OpenPrinter(printer_name)
-            try:
-                hJob = win32print.StartDocPrinter(hPrinter, 1, ("Sale Receipt", None, "RAW"))
-                try:
-                    win32print.StartPagePrinter(hPrinter)
-                    win32print.WritePrinter(hPrinter, receipt.encode())
-                    win32print.EndPagePrinter(hPrinter)
-                finally:
-                    win32print.EndDocPrinter(hPrinter)
-            finally:
-                win32print.ClosePrinter(hPrinter)
-            messagebox.showinfo("Success", "Receipt sent to printer.")
-        except Exception as e:
-            messagebox.showerror("Printing Error", f"Could not print receipt: {e}")
+    def spool_receipt(self, sale, announce=False):
+        """Queue a receipt; the printer works through the queue in the background and retries failures."""
+        if self.receipts is None:
+            self.receipts = ReceiptSpooler(self.printer)
+        self.tasks.watch(self.receipts.submit(sale),
+                         on_done=lambda _: announce and messagebox.showinfo("Success", "Receipt sent to printer."),
+                         on_error=lambda e: messagebox.showerror(
+                             "Printing Error", f"Could not print the receipt for sale {sale['sale_id']}: {e}"))
 
     # --- Sales Section ---
     def create_sales_ui(self):
@@ -506,85 +972,261 @@ class RetailApp(ctk.CTk):
                                                                                                           padx=10)
         ctk.CTkButton(controls_frame, text="Clear All Sales", command=self.clear_sales_secure, fg_color="red",
                       hover_color="darkred").pack(side="right", padx=10)
+        filter_frame = ctk.CTkFrame(sales_list_frame)
+        filter_frame.pack(fill="x", padx=10)
+        self.sales_from_entry = ctk.CTkEntry(filter_frame, placeholder_text="From (YYYY-MM-DD)", width=140)
+        self.sales_from_entry.grid(row=0, column=0, padx=5, pady=5)
+        self.sales_to_entry = ctk.CTkEntry(filter_frame, placeholder_text="To (YYYY-MM-DD)", width=140)
+        self.sales_to_entry.grid(row=0, column=1, padx=5, pady=5)
+        self.sales_min_entry = ctk.CTkEntry(filter_frame, placeholder_text="Min Rs.", width=90)
+        self.sales_min_entry.grid(row=0, column=2, padx=5, pady=5)
+        self.sales_max_entry = ctk.CTkEntry(filter_frame, placeholder_text="Max Rs.", width=90)
+        self.sales_max_entry.grid(row=0, column=3, padx=5, pady=5)
+        ctk.CTkButton(filter_frame, text="Filter", width=70, command=self.apply_sales_filter).grid(row=0, column=4,
+                                                                                                  padx=5, pady=5)
+        ctk.CTkButton(filter_frame, text="Reset", width=70, command=self.reset_sales_filter).grid(row=0, column=5,
+                                                                                                 padx=5, pady=5)
+        self.sales_summary_label = ctk.CTkLabel(sales_list_frame, text="", anchor="w")
+        self.sales_summary_label.pack(fill="x", padx=15)
         self.sales_tree = ttk.Treeview(sales_list_frame, columns=("ID", "Total", "Date"), show='headings')
         self.sales_tree.heading("ID", text="Sale ID");
         self.sales_tree.heading("Total", text="Total (Rs.)");
         self.sales_tree.heading("Date", text="Date")
+        self.sales_scrollbar = ttk.Scrollbar(sales_list_frame, orient="vertical", command=self.sales_tree.yview)
+        self.sales_scrollbar.pack(side="right", fill="y", pady=10)
+        self.sales_tree.configure(yscrollcommand=self.on_sales_scroll)
         self.sales_tree.pack(fill="both", expand=True, padx=10, pady=10)
+        self.sales_sync = TreeSync(self.sales_tree, values=lambda row: (row[0], format_amount(row[1]), row[2]))
+        self.sales_rows, self.sales_filters, self.sales_exhausted = [], {}, True
+        # Bumped on every refresh so pages requested for an older listing are dropped.
+        self.sales_generation, self.sales_loading = 0, False
         self.sales_tree.bind("<<TreeviewSelect>>", self.on_sale_select)
         sale_details_frame = ctk.CTkFrame(sales_main_frame)
         sale_details_frame.grid(row=0, column=1, sticky="nsew");
         sale_details_frame.grid_rowconfigure(1, weight=1)
         ctk.CTkLabel(sale_details_frame, text="Sale Details", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=10)
-        self.sale_items_tree = ttk.Treeview(sale_details_frame, columns=("Product", "Qty", "Price"), show='headings')
+        self.sale_items_tree = ttk.Treeview(sale_details_frame, columns=("Product", "Qty", "Price", "Amount"),
+                                            show='headings')
         self.sale_items_tree.heading("Product", text="Product");
         self.sale_items_tree.heading("Qty", text="Quantity");
         self.sale_items_tree.heading("Price", text="Price (Rs.)")
+        self.sale_items_tree.heading("Amount", text="Amount (Rs.)")
         self.sale_items_tree.pack(fill="both", expand=True, padx=10, pady=10)
+        ctk.CTkButton(sale_details_frame, text="Reprint Receipt", command=self.reprint_selected_sale).pack(
+            padx=10, pady=(0, 10))
+        # Rows come back as (sale_item_id, product_name, quantity, price, discount); the id only keys the row.
+        self.sale_items_sync = TreeSync(self.sale_items_tree, values=lambda row: (
+            row[1], row[2], format_amount(row[3]),
+            format_amount(row[2] * row[3] - row[4]) + (f" (-{format_amount(row[4])})" if row[4] else "")))
+
+    @timed("refresh_sales_list")
+    def refresh_sales_list(self):
+        """Show the newest page of sales; older pages load as the list is scrolled."""
+        self.sales_generation += 1
+        generation, self.sales_loading = self.sales_generation, True
+
+        def loaded(rows):
+            if generation != self.sales_generation: return
+            self.sales_rows, self.sales_loading = rows, False
+            self.sales_exhausted = len(rows) < SALES_PAGE_SIZE
+            self.sales_sync.sync(self.sales_rows)
+
+        self.query("list_sales_page", on_done=loaded, **self.sales_filters)
+        self.refresh_sales_summary(generation)
+
+    def refresh_sales_summary(self, generation):
+        """Totals for the filtered date range, read from the daily rollup rather than the sales themselves."""
+        filters = self.sales_filters
+        if filters.get("min_total") is not None or filters.get("max_total") is not None:
+            return self.sales_summary_label.configure(text="")
+
+        def loaded(totals):
+            if generation != self.sales_generation: return
+            sale_count, item_count, revenue = totals
+            self.sales_summary_label.configure(
+                text=f"{sale_count} sales, {item_count} items, Rs.{format_amount(revenue or 0)}")
+
+        self.query("range_totals", filters.get("date_from") or "0000-01-01", filters.get("date_to") or "9999-12-31",
+                   on_done=loaded)
+
+    def load_more_sales(self):
+        if self.sales_loading or self.sales_exhausted or not self.sales_rows: return
+        generation, self.sales_loading = self.sales_generation, True
+        last_id, _, last_date = self.sales_rows[-1]
+
+        def loaded(page):
+            if generation != self.sales_generation: return
+            self.sales_loading = False
+            self.sales_exhausted = len(page) < SALES_PAGE_SIZE
+            self.sales_rows.extend(page)
+            self.sales_sync.sync(self.sales_rows)
+
+        self.query("list_sales_page", after=(last_date, last_id), on_done=loaded, **self.sales_filters)
+
+    def on_sales_scroll(self, first, last):
+        self.sales_scrollbar.set(first, last)
+        if float(last) >= SALES_PREFETCH_AT and not self.sales_exhausted:
+            # Deferred so the page loads after Tk has finished the current scroll.
+            self.after_idle(self.load_more_sales)
+
+    def apply_sales_filter(self):
+        date_from, date_to = self.sales_from_entry.get().strip(), self.sales_to_entry.get().strip()
+        min_str, max_str = self.sales_min_entry.get().strip(), self.sales_max_entry.get().strip()
+        try:
+            for value in (date_from, date_to):
+                if value: datetime.strptime(value, "%Y-%m-%d")
+            min_total = to_paise(min_str) if min_str else None
+            max_total = to_paise(max_str) if max_str else None
+        except ValueError:
+            return messagebox.showerror("Error", "Dates must be YYYY-MM-DD and amounts must be numbers.")
+        self.sales_filters = {"date_from": date_from or None, "date_to": date_to or None,
+                              "min_total": min_total, "max_total": max_total}
         self.refresh_sales_list()
 
-    def refresh_sales_list(self):
-        for item in self.sales_tree.get_children(): self.sales_tree.delete(item)
-        for row in self.cursor.execute("SELECT id, total_price, sale_date FROM sales ORDER BY sale_date DESC"):
-            self.sales_tree.insert("", "end", values=row)
+    def reset_sales_filter(self):
+        for entry in (self.sales_from_entry, self.sales_to_entry, self.sales_min_entry, self.sales_max_entry):
+            entry.delete(0, tk.END)
+        self.sales_filters = {}
+        self.refresh_sales_list()
 
     def on_sale_select(self, event):
         selected_item = self.sales_tree.focus()
         if not selected_item: return
         sale_id = self.sales_tree.item(selected_item)['values'][0]
-        for item in self.sale_items_tree.get_children(): self.sale_items_tree.delete(item)
-        for row in self.cursor.execute("SELECT product_name, quantity, price FROM sale_items WHERE sale_id=?",
-                                       (sale_id,)):
-            self.sale_items_tree.insert("", "end", values=row)
+        self.query("get_sale_items", sale_id,
+                   on_done=lambda rows: self.sales_tree.focus() == selected_item and self.sale_items_sync.sync(rows))
+
+    def reprint_selected_sale(self):
+        selected_item = self.sales_tree.focus()
+        if not selected_item:
+            return messagebox.showerror("Error", "Select a sale to reprint.")
+        sale_id = self.sales_tree.item(selected_item)['values'][0]
+
+        def loaded(sale):
+            if sale is None:
+                return messagebox.showerror("Error", f"Sale {sale_id} no longer exists.")
+            self.spool_receipt(sale, announce=True)
+
+        self.query("get_receipt", sale_id, on_done=loaded,
+                   on_error=lambda e: messagebox.showerror("Database Error", f"An error occurred: {e}"))
 
     def clear_sales_secure(self):
         if self.ask_password(): self.clear_sales()
 
     def clear_sales(self):
-        if messagebox.askyesno("Confirm Clear Sales", "Are you sure? This cannot be undone."):
-            try:
-                self.cursor.execute("DELETE FROM sales");
-                self.cursor.execute("DELETE FROM sale_items")
-                self.cursor.execute("DELETE FROM sqlite_sequence WHERE name IN ('sales', 'sale_items')")
-                self.conn.commit()
-                messagebox.showinfo("Success", "All sales history has been cleared.")
+        if messagebox.askyesno("Confirm Clear Sales", "Are you sure? A backup is taken first, but restoring it "
+                                                      "means closing every till."):
+            def cleared(backup):
+                if self.analytics is not None:
+                    self.analytics.reset()
+                if self.forecast is not None:
+                    self.forecast.reset()
+                messagebox.showinfo("Success", f"All sales history has been cleared. Backup {backup} has it; "
+                                               f"restore it with maintenance.py if needed.")
                 self.refresh_sales_list();
-                [self.sale_items_tree.delete(i) for i in self.sale_items_tree.get_children()]
-            except sqlite3.Error as e:
-                messagebox.showerror("Database Error", f"An error occurred: {e}")
+                self.sale_items_sync.clear()
+
+            self.tasks.submit(self.backed_up("clear_sales", "before-clear-sales"), on_done=cleared,
+                              on_error=lambda e: messagebox.showerror("Database Error", f"An error occurred: {e}"))
+
+    # --- Analytics Section ---
+    def create_analytics_ui(self):
+        analytics_main_frame = ctk.CTkFrame(self.analytics_frame)
+        analytics_main_frame.pack(fill="both", expand=True, padx=20, pady=20)
+        controls_frame = ctk.CTkFrame(analytics_main_frame)
+        controls_frame.pack(fill="x", pady=10)
+        ctk.CTkLabel(controls_frame, text="Sales Analytics", font=ctk.CTkFont(size=16, weight="bold")).pack(
+            side="left", padx=10)
+        ctk.CTkButton(controls_frame, text="Refresh", command=self.refresh_analytics).pack(side="right", padx=10)
+        self.analytics_summary_label = ctk.CTkLabel(analytics_main_frame, text="", anchor="w")
+        self.analytics_summary_label.pack(fill="x", padx=15)
+        analytics_tabs = ctk.CTkTabview(analytics_main_frame)
+        analytics_tabs.pack(fill="both", expand=True, padx=10, pady=10)
+        self.analytics_syncs = {}
+        for tab, columns in ANALYTICS_TABS:
+            tree = ttk.Treeview(analytics_tabs.add(tab), columns=columns, show='headings')
+            for column in columns:
+                tree.heading(column, text=column)
+            tree.pack(fill="both", expand=True)
+            self.analytics_syncs[tab] = TreeSync(tree)
+
+    def refresh_analytics(self):
+        """Bring the analytics up to the newest sale on a worker; only sales since the last refresh are read."""
+        if self.analytics is None:
+            from analytics import SalesAnalytics  # NumPy is only imported once the screen is opened.
+            self.analytics = SalesAnalytics()
+        self.tasks.submit(lambda: self.analytics.refresh(self.worker_storage.get()), on_done=self.show_analytics,
+                          on_error=lambda e: messagebox.showerror("Analytics Error", f"An error occurred: {e}"))
+
+    def show_analytics(self, report):
+        def name(product_id):
+            record = self.catalog.get(product_id)
+            return record.name if record is not None else f"Product #{product_id}"
+
+        def average(sales, revenue):
+            return format_amount(revenue / sales) if sales else ""
+
+        sales = report["sales"]
+        self.analytics_summary_label.configure(
+            text=f"{sales:,} sales, {report['lines']:,} lines, Rs.{format_amount(report['revenue'], grouping=True)}"
+                 + (f", {report['lines'] / sales:.2f} products per sale" if sales else ""))
+        rows = {
+            "Top Sellers": [(rank, name(product_id), f"{quantity:g}", format_amount(revenue), abc_class)
+                            for rank, (product_id, quantity, revenue, abc_class) in
+                            enumerate(report["top_sellers"], 1)],
+            "ABC Classes": [(abc_class, products, format_amount(revenue), f"{share:.1%}")
+                            for abc_class, products, revenue, share in report["abc"]],
+            "By Hour": [(f"{hour:02d}:00", count, format_amount(revenue), average(count, revenue))
+                        for hour, count, revenue in report["hours"]],
+            "By Weekday": [(weekday, count, format_amount(revenue), average(count, revenue))
+                           for weekday, count, revenue in report["weekdays"]],
+            "Basket Sizes": [(size, count, f"{share:.1%}") for size, count, share in report["basket_sizes"]],
+            "Bought Together": [(rank, name(first), name(second), count, f"{support:.2%}", f"{lift:.1f}")
+                                for rank, (first, second, count, support, lift) in enumerate(report["pairs"], 1)],
+        }
+        for tab, sync in self.analytics_syncs.items():
+            sync.sync(rows[tab])
 
     # --- Export Section ---
     def export_to_excel_secure(self):
         if self.ask_password(): self.export_to_excel()
 
     def export_to_excel(self):
+        date_range = ExportRangeDialog(self).show()
+        if not date_range: return
+        date_from, date_to = date_range
         filename = filedialog.asksaveasfilename(
-            initialfile=f"retail_export_{datetime.now().strftime('%Y%m%d')}.xlsx",
-            defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx"), ("All files", "*.*")])
+            initialfile=f"retail_export_{date_from.replace('-', '')}_{date_to.replace('-', '')}.xlsx",
+            defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv"),
+                                                 ("All files", "*.*")])
         if not filename: return
-        try:
-            wb = Workbook()
-            ws_products = wb.active;
-            ws_products.title = "Products"
-            ws_products.append(["ID", "Name", "Price (Rs.)", "Quantity", "Image Path"])
-            for row in self.cursor.execute(
-                "SELECT id, name, price, quantity, image_path FROM products"): ws_products.append(row)
-            ws_sales = wb.create_sheet(title="Recent Sales")
-            ws_sales.append(["Sale ID", "Total Price (Rs.)", "Date"])
-            today_sales = self.cursor.execute(
-                "SELECT id, total_price, sale_date FROM sales WHERE date(sale_date) = date('now')").fetchall()
-            sale_ids = [row[0] for row in today_sales]
-            for row in today_sales: ws_sales.append(row)
-            ws_sale_items = wb.create_sheet(title="Recent Sale Items")
-            ws_sale_items.append(["Sale Item ID", "Sale ID", "Product ID", "Product Name", "Quantity", "Price (Rs.)"])
-            if sale_ids:
-                placeholders = ','.join('?' * len(sale_ids))
-                query = f"SELECT id, sale_id, product_id, product_name, quantity, price FROM sale_items WHERE sale_id IN ({placeholders})"
-                for row in self.cursor.execute(query, sale_ids): ws_sale_items.append(row)
-            wb.save(filename)
-            messagebox.showinfo("Success", f"Data exported to {filename}")
-        except Exception as e:
-            messagebox.showerror("Export Error", f"An error occurred during export: {e}")
+
+        def run(task):
+            from export import export
+            return export(self.worker_storage.get(), filename, date_from, date_to,
+                          progress=task.report, cancelled=task.cancelled)
+
+        def finished(_):
+            dialog.destroy()
+            with recorder.idle():
+                messagebox.showinfo("Success", f"Data exported to {filename}")
+
+        def failed(e):
+            dialog.destroy()
+            with recorder.idle():
+                messagebox.showerror("Export Error", f"An error occurred during export: {e}")
+
+        def cancel():
+            # The worker stops at its next chunk and removes the partial file; its outcome is ignored.
+            task.cancel()
+            dialog.destroy()
+            messagebox.showinfo("Export Cancelled", "The export was cancelled.")
+
+        # Timed from here: the dialogs above wait on the user.
+        with recorder.operation("export_to_excel"):
+            dialog = ProgressDialog(self, on_cancel=cancel)
+            task = self.tasks.submit(run, with_task=True, on_progress=dialog.update_progress, on_done=finished,
+                                     on_error=failed)
 
     # --- Settings Section ---
     def create_settings_ui(self):
@@ -601,6 +1243,52 @@ class RetailApp(ctk.CTk):
         self.confirm_password_entry.pack(fill="x", padx=20, pady=5)
         ctk.CTkButton(settings_main_frame, text="Save New Password", command=self.change_password).pack(padx=20,
                                                                                                         pady=20)
+        performance_frame = ctk.CTkFrame(self.settings_frame)
+        performance_frame.pack(padx=20, pady=(0, 20), fill="x")
+        ctk.CTkLabel(performance_frame, text="Performance", font=ctk.CTkFont(size=18, weight="bold")).pack(
+            pady=(0, 10))
+        self.checkout_stats_label = ctk.CTkLabel(performance_frame, text="")
+        self.checkout_stats_label.pack(padx=20, pady=5)
+        self.slow_ms_entry = ctk.CTkEntry(performance_frame, placeholder_text="Log operations slower than (ms)")
+        self.slow_ms_entry.insert(0, str(recorder.slow_ms))
+        self.slow_ms_entry.pack(fill="x", padx=20, pady=5)
+        ctk.CTkButton(performance_frame, text="Save Threshold", command=self.save_slow_threshold).pack(padx=20,
+                                                                                                       pady=5)
+        ctk.CTkButton(performance_frame, text="Save Performance Stats", command=self.dump_performance_stats).pack(
+            padx=20, pady=5)
+        ctk.CTkButton(performance_frame, text=f"Archive Sales Older Than {ARCHIVE_KEEP_MONTHS} Months",
+                      command=self.archive_sales).pack(padx=20, pady=(5, 20))
+        printer_frame = ctk.CTkFrame(self.settings_frame)
+        printer_frame.pack(padx=20, pady=(0, 20), fill="x")
+        ctk.CTkLabel(printer_frame, text="Receipt Printer", font=ctk.CTkFont(size=18, weight="bold")).pack(
+            pady=(0, 10))
+        self.printer_entry = ctk.CTkEntry(printer_frame,
+                                          placeholder_text="escpos:/dev/usb/lp0, cups:NAME, windows, file:PATH or null")
+        if self.printer_spec:
+            self.printer_entry.insert(0, self.printer_spec)
+        self.printer_entry.pack(fill="x", padx=20, pady=5)
+        self.auto_print_var = tk.BooleanVar(value=self.auto_print_receipts)
+        ctk.CTkCheckBox(printer_frame, text="Print a receipt after every sale", variable=self.auto_print_var).pack(
+            padx=20, pady=5)
+        ctk.CTkButton(printer_frame, text="Save Printer", command=self.save_printer).pack(padx=20, pady=(5, 20))
+        tax_frame = ctk.CTkFrame(self.settings_frame)
+        tax_frame.pack(padx=20, pady=(0, 20), fill="x")
+        ctk.CTkLabel(tax_frame, text="Tax", font=ctk.CTkFont(size=18, weight="bold")).pack(pady=(0, 10))
+        self.tax_entry = ctk.CTkEntry(tax_frame, placeholder_text="Tax rates, e.g. CGST 9%, SGST 9% (blank for none)")
+        if self.cart.tax_rates:
+            self.tax_entry.insert(0, format_tax_rates(self.cart.tax_rates))
+        self.tax_entry.pack(fill="x", padx=20, pady=5)
+        self.tax_inclusive_var = tk.BooleanVar(value=self.cart.tax_inclusive)
+        ctk.CTkCheckBox(tax_frame, text="Prices include tax", variable=self.tax_inclusive_var).pack(padx=20, pady=5)
+        ctk.CTkButton(tax_frame, text="Save Tax", command=self.save_tax_secure).pack(padx=20, pady=(5, 20))
+        maintenance_frame = ctk.CTkFrame(self.settings_frame)
+        maintenance_frame.pack(padx=20, pady=(0, 20), fill="x")
+        ctk.CTkLabel(maintenance_frame, text="Maintenance", font=ctk.CTkFont(size=18, weight="bold")).pack(
+            pady=(0, 10))
+        self.maintenance_label = ctk.CTkLabel(maintenance_frame, text="", justify="left")
+        self.maintenance_label.pack(padx=20, pady=5)
+        ctk.CTkButton(maintenance_frame, text="Back Up Now", command=self.back_up_now).pack(padx=20, pady=(5, 20))
+        self.refresh_maintenance_status()
 
     def change_password(self):
         old_password, new_password, confirm_password = self.old_password_entry.get(), self.new_password_entry.get(), self.confirm_password_entry.get()
@@ -608,8 +1296,7 @@ class RetailApp(ctk.CTk):
         if not new_password: return messagebox.showerror("Error", "New password cannot be empty.")
         if new_password != confirm_password: return messagebox.showerror("Error", "New passwords do not match.")
         try:
-            self.cursor.execute("UPDATE settings SET password = ? WHERE id = 1", (self.hash_password(new_password),))
-            self.conn.commit()
+            self.storage.set_password_hash(self.hash_password(new_password))
             messagebox.showinfo("Success", "Password changed successfully.")
             self.old_password_entry.delete(0, tk.END);
             self.new_password_entry.delete(0, tk.END);
@@ -617,16 +1304,85 @@ class RetailApp(ctk.CTk):
         except sqlite3.Error as e:
             messagebox.showerror("Database Error", f"An error occurred: {e}")
 
+    def save_slow_threshold(self):
+        try:
+            milliseconds = int(self.slow_ms_entry.get())
+            if milliseconds <= 0: raise ValueError
+        except ValueError:
+            return messagebox.showerror("Error", "The threshold must be a whole number of milliseconds.")
+        try:
+            self.storage.set_slow_operation_ms(milliseconds)
+            recorder.slow_ms = milliseconds
+            messagebox.showinfo("Success", f"Operations slower than {milliseconds} ms will be logged.")
+        except sqlite3.Error as e:
+            messagebox.showerror("Database Error", f"An error occurred: {e}")
+
+    def save_printer(self):
+        spec, auto_print = self.printer_entry.get().strip(), self.auto_print_var.get()
+        try:
+            printer = make_printer(spec)
+        except ValueError as e:
+            return messagebox.showerror("Error", str(e))
+        try:
+            self.storage.set_receipt_printer(spec, auto_print)
+        except sqlite3.Error as e:
+            return messagebox.showerror("Database Error", f"An error occurred: {e}")
+        self.printer = printer
+        if self.receipts is not None: self.receipts.printer = printer
+        self.printer_spec, self.auto_print_receipts = spec, auto_print
+        messagebox.showinfo("Success", "Receipt printer saved.")
+
+    def save_tax_secure(self):
+        if self.ask_password(): self.save_tax()
+
+    def save_tax(self):
+        """Save the tax rates for every till on the database; the sale being rung up uses them at once."""
+        try:
+            rates = parse_tax_rates(self.tax_entry.get())
+        except ValueError as e:
+            return messagebox.showerror("Error", str(e))
+        inclusive = self.tax_inclusive_var.get()
+        try:
+            self.storage.set_tax(format_tax_rates(rates), inclusive)
+        except sqlite3.Error as e:
+            return messagebox.showerror("Database Error", f"An error occurred: {e}")
+        self.apply_tax((format_tax_rates(rates), inclusive))
+        messagebox.showinfo("Success", "Tax rates saved." if rates else "Sales will not be taxed.")
+
+    def archive_sales(self):
+        def archived(months):
+            moved = sum(count for _, count in months)
+            messagebox.showinfo("Sales Archive", f"Moved {moved:,} sales from {len(months)} months to "
+                                                 f"{self.storage.archive_dir}." if moved else "Nothing to archive.")
+
+        self.query("archive_sales", on_done=archived,
+                   on_error=lambda e: messagebox.showerror("Database Error", f"An error occurred: {e}"))
+
+    def refresh_checkout_stats(self):
+        engine = self.checkout_engine
+        self.checkout_stats_label.configure(
+            text=f"Checkouts on this till: {engine.completed:,} recorded, {engine.failed:,} refused, "
+                 f"{engine.sales_per_second():.2f} sales/s over the last minute")
+
+    def dump_performance_stats(self):
+        try:
+            messagebox.showinfo("Success", f"Performance statistics saved to {recorder.dump(self.stats_path)}")
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save statistics: {e}")
+
     # --- Frame Navigation ---
     def select_frame_by_name(self, name):
         buttons = {"inventory": self.inventory_button, "pos": self.pos_button, "sales": self.sales_button,
-                   "settings": self.settings_button}
+                   "analytics": self.analytics_button, "settings": self.settings_button}
         frames = {"inventory": self.inventory_frame, "pos": self.pos_frame, "sales": self.sales_frame,
-                  "settings": self.settings_frame}
+                  "analytics": self.analytics_frame, "settings": self.settings_frame}
         for frame_name, button in buttons.items():
             button.configure(fg_color=("gray75", "gray25") if name == frame_name else "transparent")
         for frame in frames.values():
             frame.grid_forget()
+        if name not in self.built_screens:
+            self.built_screens.add(name)
+            self.screen_builders[name]()
         frames[name].grid(row=0, column=1, sticky="nsew", padx=20, pady=20)
         if name == "inventory":
             self.refresh_inventory_list()
@@ -634,6 +1390,10 @@ class RetailApp(ctk.CTk):
             self.populate_product_grid()
         elif name == "sales":
             self.refresh_sales_list()
+        elif name == "analytics":
+            self.refresh_analytics()
+        elif name == "settings":
+            self.refresh_checkout_stats()
 
     def inventory_button_event(self):
         self.select_frame_by_name("inventory")
@@ -644,6 +1404,9 @@ class RetailApp(ctk.CTk):
     def sales_button_event(self):
         self.select_frame_by_name("sales")
 
+    def analytics_button_event(self):
+        self.select_frame_by_name("analytics")
+
     def settings_button_event(self):
         self.select_frame_by_name("settings")
 
@@ -651,4 +1414,9 @@ class RetailApp(ctk.CTk):
 if __name__ == "__main__":
     app = RetailApp()
     app.mainloop()
-    app.conn.close()
+    recorder.dump(app.stats_path)
+    app.tasks.shutdown()
+    app.checkout_engine.shutdown()
+    if app.receipts: app.receipts.shutdown()
+    app.worker_storage.close_all()
+    app.storage.close()
@@ -0,0 +1,48 @@
+"""Keyboard-wedge barcode scanner detection.
+
+Most USB scanners pretend to be a keyboard: they type the code a few
+milliseconds per character and finish with Enter. People do not type that
+fast, so a run of printable keys with short gaps between them, ending in
+Enter, is taken to be a scan. Timing comes from the Tk event timestamps,
+which are set when the key was pressed rather than when the event loop got
+round to it, so a busy UI does not make typing look like a scan.
+"""
+
+# The longest pause between two keys of one scan, in milliseconds.
+MAX_KEY_GAP_MS = 50
+# Shorter bursts are more likely to be a fast typist than a barcode.
+MIN_CODE_LENGTH = 4
+ENTER_KEYSYMS = ("Return", "KP_Enter")
+
+
+class ScannerListener:
+    """Turns a stream of key presses into scanned codes for ``on_scan(code)``."""
+
+    def __init__(self, on_scan, max_gap_ms=MAX_KEY_GAP_MS, min_length=MIN_CODE_LENGTH):
+        self.on_scan = on_scan
+        self.max_gap_ms = max_gap_ms
+        self.min_length = min_length
+        self._chars = []
+        self._last_ms = None
+
+    def reset(self):
+        self._chars.clear()
+        self._last_ms = None
+
+    def feed(self, char, keysym, time_ms):
+        """Process one key press. Returns True if it completed a scan, which has then been handed on."""
+        gap_ok = self._last_ms is not None and 0 <= time_ms - self._last_ms <= self.max_gap_ms
+        if keysym in ENTER_KEYSYMS:
+            code = "".join(self._chars) if gap_ok and len(self._chars) >= self.min_length else None
+            self.reset()
+            if code is None:
+                return False
+            self.on_scan(code)
+            return True
+        if not char or not char.isprintable():
+            return False  # Shift and other modifiers arrive between the characters of some scanners.
+        if not gap_ok:
+            self._chars.clear()
+        self._chars.append(char)
+        self._last_ms = time_ms
+        return False
@@ -0,0 +1,213 @@
+"""In-memory product search for the POS screen.
+
+Names are kept in one newline separated string so substring matching runs at
+C speed through ``str.find`` instead of a ``LIKE '%term%'`` table scan.
+Matches are ranked name-prefix first, then word-prefix, then anywhere in the
+name. When a query finds only a handful of exact matches, each query word is
+matched against the distinct words of the catalog through a trigram index,
+which adds typo-tolerant matches ranked by how closely the words agree. The
+fuzzy structures are only built the first time a query needs them, so
+loading the catalog stays cheap.
+
+The index is headless and is owned by the Catalog, which keeps it in sync
+on product inserts, updates, stock clears and checkouts.
+"""
+import heapq
+import math
+from bisect import bisect_right
+
+# A search for a term stops after this many hits; the grid only ever shows a screenful at a time.
+MAX_RESULTS = 500
+# Below this many exact hits the fuzzy index is consulted for near misses.
+FUZZY_MIN_RESULTS = 10
+FUZZY_LIMIT = 50
+# Share of a query word's trigrams a catalog word must contain to count as a match.
+FUZZY_MIN_SIMILARITY = 0.5
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Ranked, typo-tolerant name search over the product catalog."""
+
+    def __init__(self):
+        self.products = {}  # id -> (id, name, price, image_path) as shown on a grid tile
+        self.stock = {}  # id -> quantity
+        self.names = {}  # id -> normalized name
+        # Fuzzy structures, built on first use.
+        self.word_products = {}  # word -> set of product ids whose name contains it
+        self.word_grams = {}  # word -> its trigrams
+        self.gram_words = {}  # trigram -> set of words containing it
+        self._fuzzy_ready = False
+        self._dirty = True
+        self._blob = ""
+        self._starts = []
+        self._order = []
+
+    def __len__(self):
+        return len(self.products)
+
+    def rebuild(self, rows):
+        """Replace the index contents with ``rows`` of (id, name, price, quantity, image_path)."""
+        self.clear()
+        for row in rows:
+            self.upsert(*row)
+
+    def clear(self):
+        self.products.clear()
+        self.stock.clear()
+        self.names.clear()
+        self.word_products.clear()
+        self.word_grams.clear()
+        self.gram_words.clear()
+        self._fuzzy_ready = False
+        self._dirty = True
+
+    def upsert(self, product_id, name, price, quantity, image_path=""):
+        self.products[product_id] = (product_id, name, price, image_path or "")
+        self.stock[product_id] = quantity
+        normalized = normalize(name)
+        if self.names.get(product_id) == normalized:
+            return
+        self._unindex(product_id)
+        self.names[product_id] = normalized
+        if self._fuzzy_ready:
+            self._index_words(product_id, normalized)
+        self._dirty = True
+
+    def remove(self, product_id):
+        self._unindex(product_id)
+        self.products.pop(product_id, None)
+        self.stock.pop(product_id, None)
+        self._dirty = True
+
+    def _unindex(self, product_id):
+        normalized = self.names.pop(product_id, None)
+        if normalized is None or not self._fuzzy_ready:
+            return
+        for word in set(normalized.split()):
+            ids = self.word_products[word]
+            ids.discard(product_id)
+            if not ids:
+                del self.word_products[word]
+                for gram in self.word_grams.pop(word):
+                    words = self.gram_words[gram]
+                    words.discard(word)
+                    if not words:
+                        del self.gram_words[gram]
+
+    def _index_words(self, product_id, normalized):
+        for word in normalized.split():
+            ids = self.word_products.get(word)
+            if ids is not None:
+                ids.add(product_id)
+                continue
+            self.word_products[word] = {product_id}
+            grams = self.word_grams[word] = trigrams(word)
+            for gram in grams:
+                words = self.gram_words.get(gram)
+                if words is None:
+                    self.gram_words[gram] = {word}
+                else:
+                    words.add(word)
+
+    def _ensure_fuzzy(self):
+        if not self._fuzzy_ready:
+            for product_id, normalized in self.names.items():
+                self._index_words(product_id, normalized)
+            self._fuzzy_ready = True
+
+    def _ensure_blob(self):
+        if not self._dirty:
+            return
+        self._order = sorted(self.products)
+        self._starts = []
+        position = 1
+        for product_id in self._order:
+            self._starts.append(position)
+            position += len(self.names[product_id]) + 1
+        self._blob = "\n" + "\n".join(self.names[pid] for pid in self._order) + "\n"
+        self._dirty = False
+
+    def search(self, term, in_stock_only=True):
+        """Return matching products as (id, name, price, image_path), best match first."""
+        query = normalize(term)
+        self._ensure_blob()
+        products, stock = self.products, self.stock
+        if not query:
+            # Browsing the whole catalog lists every product in id order.
+            if in_stock_only:
+                return [products[pid] for pid in self._order if stock[pid] > 0]
+            return [products[pid] for pid in self._order]
+
+        seen = set()
+        results = []
+        for needle in (f"\n{query}", f" {query}", query):
+            self._collect(needle, seen, results, in_stock_only)
+            if len(results) >= MAX_RESULTS:
+                return results
+
+        if len(results) < FUZZY_MIN_RESULTS:
+            results.extend(products[pid] for pid in self._fuzzy(query, seen)
+                           if not in_stock_only or stock[pid] > 0)
+        return results
+
+    def _collect(self, needle, seen, results, in_stock_only):
+        """Append names containing ``needle`` up to MAX_RESULTS, skipping to the next name after each hit."""
+        blob, starts, order = self._blob, self._starts, self._order
+        products, stock = self.products, self.stock
+        offset = 1 if needle[0] in "\n " else 0
+        position = blob.find(needle)
+        while position != -1:
+            line = bisect_right(starts, position + offset) - 1
+            product_id = order[line]
+            if product_id not in seen:
+                seen.add(product_id)
+                if not in_stock_only or stock[product_id] > 0:
+                    results.append(products[product_id])
+                    if len(results) >= MAX_RESULTS:
+                        return
+            next_start = starts[line + 1] if line + 1 < len(starts) else len(blob)
+            position = blob.find(needle, next_start - offset)
+
+    def _similar_words(self, query_word):
+        """Map catalog words resembling ``query_word`` to their similarity in (0, 1]."""
+        query_grams = trigrams(query_word)
+        needed = max(1, math.ceil(FUZZY_MIN_SIMILARITY * len(query_grams)))
+        # A word sharing `needed` trigrams with the query contains at least one of
+        # its len - needed + 1 rarest trigrams, so only those lists are read.
+        by_rarity = sorted(query_grams, key=lambda gram: len(self.gram_words.get(gram, ())))
+        candidates = set().union(*(self.gram_words.get(gram, ()) for gram in by_rarity[:len(by_rarity) - needed + 1]))
+        similar = {}
+        for word in candidates:
+            shared = len(query_grams & self.word_grams[word])
+            if shared >= needed:
+                similar[word] = shared / (len(query_grams) + len(self.word_grams[word]) - shared)
+        return similar
+
+    def _fuzzy(self, query, exclude):
+        """Ids of names whose words best match the words of ``query``, skipping ``exclude``."""
+        if len(query) < 3:
+            return []
+        self._ensure_fuzzy()
+        query_words = query.split()
+        totals = {}
+        for query_word in query_words:
+            best = {}
+            for word, similarity in self._similar_words(query_word).items():
+                for product_id in self.word_products[word]:
+                    if similarity > best.get(product_id, 0.0):
+                        best[product_id] = similarity
+            for product_id, similarity in best.items():
+                totals[product_id] = totals.get(product_id, 0.0) + similarity
+        # Every query word must on average find a reasonable partner in the name.
+        cutoff = FUZZY_MIN_SIMILARITY * len(query_words) / 2
+        scored = [(total, -pid) for pid, total in totals.items() if total >= cutoff and pid not in exclude]
+        return [-neg_id for _, neg_id in heapq.nlargest(FUZZY_LIMIT, scored)]
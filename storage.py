@@ -0,0 +1,1424 @@
+"""SQLite storage layer for the Retail POS.
+
+Every SQL statement the application runs lives in this module so the Tk
+screens only ever call plain methods. Statements are kept as module level
+constants: sqlite3 caches prepared statements per connection keyed by their
+exact text, so reusing the same strings means each one is compiled once.
+Amounts of money are integers in paise throughout (see money.py).
+"""
+import functools
+import hashlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date
+
+from metrics import recorder
+
+# Number of prepared statements sqlite3 keeps compiled per connection.
+STATEMENT_CACHE_SIZE = 256
+# Rows fetched per page of the Sales History view.
+SALES_PAGE_SIZE = 200
+# Write transactions that still find the database locked after busy_timeout are retried this often,
+# backing off from WRITE_RETRY_DELAY seconds. Several tills can share one database file.
+WRITE_RETRIES = 5
+WRITE_RETRY_DELAY = 0.05
+# Rows of the change log kept for terminals catching up; one that falls further behind reloads everything.
+CHANGES_KEEP = 200000
+# Rows an export has yet to read are kept too, up to this many; an export further behind starts over in full.
+EXPORT_CHANGES_KEEP = 2000000
+# Months of sales kept in the live database, counting the current one; older ones are archived.
+ARCHIVE_KEEP_MONTHS = 3
+# SQLite attaches at most 10 databases to a connection; archive years beyond this are detached, oldest use first.
+MAX_ATTACHED_ARCHIVES = 8
+BUSY_TIMEOUT_MS = 5000
+# A truncating checkpoint holds up writers while it waits, so it gives up after this long.
+CHECKPOINT_BUSY_MS = 100
+# Rows ANALYZE samples per index; enough for good plans at a few milliseconds per run.
+ANALYSIS_LIMIT = 1000
+# Backups copy this many pages per step and pause between steps, so the tills keep writing meanwhile.
+BACKUP_STEP_PAGES = 1024
+BACKUP_STEP_PAUSE = 0.01
+# A stepped backup starts over whenever another connection writes; after this many restarts it copies in one step.
+BACKUP_RESTARTS = 3
+
+PRAGMAS = (
+    # Only takes effect on a new database; Storage.enable_incremental_vacuum() converts an existing one.
+    "PRAGMA auto_vacuum = INCREMENTAL",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",  # Safe with WAL; fsync happens at checkpoint time.
+    "PRAGMA cache_size = -32000",  # ~32 MB page cache.
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA mmap_size = 134217728",
+    # Wait for another writer instead of failing with "database is locked".
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+)
+
+# --- Settings ---
+SQL_GET_PASSWORD = "SELECT password FROM settings WHERE id = 1"
+SQL_INSERT_DEFAULT_PASSWORD = "INSERT OR IGNORE INTO settings (id, password) VALUES (1, ?)"
+SQL_SET_PASSWORD = "UPDATE settings SET password = ? WHERE id = 1"
+SQL_GET_SLOW_OPERATION_MS = "SELECT slow_operation_ms FROM settings WHERE id = 1"
+SQL_SET_SLOW_OPERATION_MS = "UPDATE settings SET slow_operation_ms = ? WHERE id = 1"
+SQL_GET_RECEIPT_PRINTER = "SELECT receipt_printer, auto_print_receipts FROM settings WHERE id = 1"
+SQL_SET_RECEIPT_PRINTER = "UPDATE settings SET receipt_printer = ?, auto_print_receipts = ? WHERE id = 1"
+SQL_GET_DEMAND_THROUGH = "SELECT demand_through FROM settings WHERE id = 1"
+SQL_SET_DEMAND_THROUGH = "UPDATE settings SET demand_through = ? WHERE id = 1"
+SQL_GET_TAX = "SELECT tax_rates, tax_inclusive FROM settings WHERE id = 1"
+SQL_SET_TAX = "UPDATE settings SET tax_rates = ?, tax_inclusive = ? WHERE id = 1"
+
+# --- Products ---
+SQL_LIST_PRODUCTS = "SELECT id, name, price, quantity FROM products"
+SQL_GET_PRODUCT = "SELECT name, price, quantity FROM products WHERE id = ?"
+SQL_GET_IMAGE_PATH = "SELECT image_path FROM products WHERE id = ?"
+# Every UPDATE of a product bumps its version, which lets the in-memory catalog spot stale rows.
+# Catalog rows end with the product's barcodes, comma separated.
+SQL_LIST_CATALOG = ("SELECT id, name, price, quantity, image_path, version, (SELECT group_concat(barcode) "
+                    "FROM product_barcodes b WHERE b.product_id = p.id) FROM products p ORDER BY id")
+SQL_GET_CATALOG_ROW = ("SELECT id, name, price, quantity, image_path, version, (SELECT group_concat(barcode) "
+                       "FROM product_barcodes b WHERE b.product_id = p.id) FROM products p WHERE id = ?")
+SQL_DATA_VERSION = "PRAGMA data_version"
+SQL_LATEST_CHANGE = "SELECT COALESCE(MAX(seq), 0) FROM changes"
+SQL_FIRST_CHANGE = "SELECT MIN(seq) FROM changes"
+SQL_PRODUCT_CHANGES = ("SELECT seq, row_id, op FROM changes WHERE seq > ? AND table_name = 'products' "
+                       "ORDER BY seq")
+# Keeps the newest CHANGES_KEEP rows, and those after the oldest export watermark up to EXPORT_CHANGES_KEEP.
+SQL_PRUNE_CHANGES = ("DELETE FROM changes WHERE seq <= (SELECT MAX(MIN(last - :keep, COALESCE(w.seq, last)), "
+                     "last - :export_keep) FROM (SELECT MAX(seq) AS last FROM changes), "
+                     "(SELECT MIN(seq) AS seq FROM export_watermarks) w)")
+SQL_FIND_BARCODE = "SELECT product_id FROM product_barcodes WHERE barcode = ?"
+SQL_INSERT_BARCODE = "INSERT INTO product_barcodes (barcode, product_id) VALUES (?, ?)"
+SQL_DELETE_BARCODES = "DELETE FROM product_barcodes WHERE product_id = ?"
+SQL_INSERT_PRODUCT = "INSERT INTO products (name, price, quantity, image_path) VALUES (?, ?, ?, ?)"
+# Bulk import: a NULL price or quantity leaves the current value.
+SQL_IMPORT_PRODUCT_KEYS = "SELECT id, name FROM products"
+SQL_IMPORT_BARCODE_KEYS = "SELECT barcode, product_id FROM product_barcodes"
+SQL_IMPORT_SET_STOCK = ("UPDATE products SET price = COALESCE(?, price), quantity = COALESCE(?, quantity), "
+                        "version = version + 1 WHERE id = ?")
+SQL_IMPORT_ADD_STOCK = ("UPDATE products SET price = COALESCE(?, price), quantity = quantity + COALESCE(?, 0), "
+                        "version = version + 1 WHERE id = ?")
+# A stock adjustment never takes the count below zero.
+SQL_ADJUST_STOCK = "UPDATE products SET quantity = MAX(quantity + ?, 0), version = version + 1 WHERE id = ?"
+SQL_UPDATE_PRODUCT = "UPDATE products SET name = ?, price = ?, quantity = ?, version = version + 1 WHERE id = ?"
+SQL_UPDATE_PRODUCT_WITH_IMAGE = ("UPDATE products SET name = ?, price = ?, quantity = ?, image_path = ?, "
+                                 "version = version + 1 WHERE id = ?")
+SQL_EXPORT_PRODUCTS = "SELECT id, name, price, quantity, image_path FROM products"
+
+# --- Sales ---
+SQL_INSERT_SALE = "INSERT INTO sales (total_price, discount, tax) VALUES (?, ?, ?)"
+SQL_INSERT_SALE_ITEM = ("INSERT INTO sale_items (sale_id, product_id, product_name, quantity, price, discount) "
+                        "VALUES (?, ?, ?, ?, ?, ?)")
+# Only succeeds while enough stock is left, so two tills can never sell the same last unit.
+SQL_DECREMENT_STOCK = ("UPDATE products SET quantity = quantity - ?, version = version + 1 "
+                       "WHERE id = ? AND quantity >= ?")
+SQL_SALES_PAGE = "SELECT id, total_price, sale_date FROM sales {where} ORDER BY sale_date DESC, id DESC LIMIT ?"
+SQL_GET_SALE_ITEMS = "SELECT id, product_name, quantity, price, discount FROM sale_items WHERE sale_id = ?"
+SQL_GET_SALE = "SELECT id, total_price, sale_date, discount, tax FROM sales WHERE id = ?"
+# Inclusive 'YYYY-MM-DD' date ranges as a range predicate on the raw column, so idx_sales_date_id_total
+# is usable. Results follow the index order to avoid a sort.
+SQL_EXPORT_SALES = ("SELECT id, total_price, sale_date, discount, tax FROM sales "
+                    "WHERE sale_date >= ? AND sale_date < date(?, '+1 day') ORDER BY sale_date, id")
+SQL_EXPORT_SALE_ITEMS = ("SELECT si.id, si.sale_id, si.product_id, si.product_name, si.quantity, si.price, "
+                         "si.discount "
+                         "FROM sales s JOIN sale_items si ON si.sale_id = s.id "
+                         "WHERE s.sale_date >= ? AND s.sale_date < date(?, '+1 day') ORDER BY s.sale_date, s.id")
+# --- Rollups ---
+# 'YYYY-MM-DD' and 'YYYY-MM-DD HH' keys are prefixes of sale_date.
+SQL_GET_SALE_DATE = "SELECT sale_date FROM sales WHERE id = ?"
+SQL_ROLLUP_DAY = ("INSERT INTO sales_daily (day, sale_count, item_count, revenue) VALUES (?, 1, ?, ?) "
+                  "ON CONFLICT (day) DO UPDATE SET sale_count = sale_count + 1, "
+                  "item_count = item_count + excluded.item_count, revenue = revenue + excluded.revenue")
+SQL_ROLLUP_HOUR = ("INSERT INTO sales_hourly (hour, sale_count, item_count, revenue) VALUES (?, 1, ?, ?) "
+                   "ON CONFLICT (hour) DO UPDATE SET sale_count = sale_count + 1, "
+                   "item_count = item_count + excluded.item_count, revenue = revenue + excluded.revenue")
+SQL_ROLLUP_PRODUCT = ("INSERT INTO product_sales_daily (day, product_id, product_name, quantity, revenue) "
+                      "VALUES (?, ?, ?, ?, ?) ON CONFLICT (day, product_id) DO UPDATE SET "
+                      "product_name = excluded.product_name, quantity = quantity + excluded.quantity, "
+                      "revenue = revenue + excluded.revenue")
+SQL_REBUILD_DAILY = ("INSERT INTO sales_daily (day, sale_count, item_count, revenue) "
+                     "SELECT substr(s.sale_date, 1, 10), COUNT(*), SUM(i.items), SUM(s.total_price) FROM sales s "
+                     "JOIN (SELECT sale_id, SUM(quantity) AS items FROM sale_items GROUP BY sale_id) i "
+                     "ON i.sale_id = s.id GROUP BY 1")
+SQL_REBUILD_HOURLY = ("INSERT INTO sales_hourly (hour, sale_count, item_count, revenue) "
+                      "SELECT substr(s.sale_date, 1, 13), COUNT(*), SUM(i.items), SUM(s.total_price) FROM sales s "
+                      "JOIN (SELECT sale_id, SUM(quantity) AS items FROM sale_items GROUP BY sale_id) i "
+                      "ON i.sale_id = s.id GROUP BY 1")
+# The most recent name a product was sold under wins, as it does for the incremental upsert: with MAX(si.id)
+# in the same select, SQLite takes the bare product_name from the newest line of each group.
+SQL_REBUILD_PRODUCT_DAILY = ("INSERT INTO product_sales_daily (day, product_id, product_name, quantity, revenue) "
+                             "SELECT day, product_id, product_name, quantity, revenue FROM ("
+                             "SELECT substr(s.sale_date, 1, 10) AS day, si.product_id AS product_id, "
+                             "si.product_name AS product_name, SUM(si.quantity) AS quantity, "
+                             "SUM(si.quantity * si.price - si.discount) AS revenue, MAX(si.id) FROM sales s "
+                             "JOIN sale_items si ON si.sale_id = s.id GROUP BY 1, 2)")
+SQL_DAILY_TOTALS = ("SELECT day, sale_count, item_count, revenue FROM sales_daily "
+                    "WHERE day >= ? AND day <= ? ORDER BY day")
+SQL_HOURLY_TOTALS = ("SELECT hour, sale_count, item_count, revenue FROM sales_hourly "
+                     "WHERE hour >= ? AND hour < date(?, '+1 day') ORDER BY hour")
+SQL_PRODUCT_TOTALS = ("SELECT product_id, MAX(product_name), SUM(quantity), SUM(revenue) FROM product_sales_daily "
+                      "WHERE day >= ? AND day <= ? GROUP BY product_id ORDER BY SUM(revenue) DESC")
+SQL_RANGE_TOTALS = ("SELECT COALESCE(SUM(sale_count), 0), COALESCE(SUM(item_count), 0), COALESCE(SUM(revenue), 0) "
+                    "FROM sales_daily WHERE day >= ? AND day <= ?")
+SQL_COUNT_DAILY = "SELECT COUNT(*) FROM sales_daily WHERE day >= ? AND day <= ?"
+SQL_COUNT_PRODUCT_TOTALS = ("SELECT COUNT(DISTINCT product_id) FROM product_sales_daily "
+                            "WHERE day >= ? AND day <= ?")
+
+SQL_COUNT_PRODUCTS = "SELECT COUNT(*) FROM products"
+SQL_COUNT_SALES = "SELECT COUNT(*) FROM sales WHERE sale_date >= ? AND sale_date < date(?, '+1 day')"
+SQL_COUNT_SALE_ITEMS = ("SELECT COUNT(*) FROM sales s JOIN sale_items si ON si.sale_id = s.id "
+                        "WHERE s.sale_date >= ? AND s.sale_date < date(?, '+1 day')")
+
+# --- Archive ---
+# Closed months are moved out of the live database into one file per year under the archive directory,
+# attached on demand as archive_YYYY. sales_archive records which months went where; sale ids grow with
+# time, so each month covers one id range. {db} is the attached schema name.
+# Archive files record their format in user_version; files from before amounts were kept in paise are
+# converted when first attached.
+ARCHIVE_VERSION = 1
+ARCHIVE_SALES = ("(id INTEGER PRIMARY KEY, total_price INTEGER NOT NULL, sale_date TIMESTAMP, "
+                 "discount INTEGER NOT NULL DEFAULT 0, tax INTEGER NOT NULL DEFAULT 0)")
+ARCHIVE_SALE_ITEMS = ("(id INTEGER PRIMARY KEY, sale_id INTEGER, product_id INTEGER, product_name TEXT, "
+                      "quantity INTEGER, price INTEGER, discount INTEGER NOT NULL DEFAULT 0)")
+ARCHIVE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS {db}.idx_sale_items_sale_id ON sale_items (sale_id)",
+    "CREATE INDEX IF NOT EXISTS {db}.idx_sales_date_id_total ON sales (sale_date, id, total_price)",
+)
+ARCHIVE_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS {db}.sales " + ARCHIVE_SALES,
+    "CREATE TABLE IF NOT EXISTS {db}.sale_items " + ARCHIVE_SALE_ITEMS,
+    *ARCHIVE_INDEXES,
+    f"PRAGMA {{db}}.user_version = {ARCHIVE_VERSION}",
+)
+SQL_ARCHIVE_VERSION = "PRAGMA {db}.user_version"
+SQL_ARCHIVE_HAS_SALES = "SELECT COUNT(*) FROM {db}.sqlite_master WHERE type = 'table' AND name = 'sales'"
+SQL_ARCHIVED_MONTHS = "SELECT month FROM sales_archive ORDER BY month DESC"
+SQL_ARCHIVED_UNTIL = "SELECT date(MAX(month) || '-01', '+1 month') FROM sales_archive"
+SQL_ARCHIVE_FOR_SALE = "SELECT month FROM sales_archive WHERE ? BETWEEN first_sale_id AND last_sale_id"
+SQL_MONTHS_BEFORE = "SELECT DISTINCT substr(sale_date, 1, 7) FROM sales WHERE sale_date < ? ORDER BY 1"
+SQL_LIVE_MONTH = "SELECT COUNT(*), MIN(id), MAX(id) FROM main.sales WHERE sale_date >= ? AND sale_date < ?"
+SQL_ARCHIVE_MONTH_COUNT = "SELECT COUNT(*) FROM {db}.sales WHERE sale_date >= ? AND sale_date < ?"
+# Rows of months the registry does not list are leftovers of an interrupted run or of cleared history.
+SQL_ARCHIVE_PURGE_SALES = ("DELETE FROM {db}.sales WHERE substr(sale_date, 1, 7) NOT IN "
+                           "(SELECT month FROM main.sales_archive)")
+SQL_ARCHIVE_PURGE_ITEMS = "DELETE FROM {db}.sale_items WHERE sale_id NOT IN (SELECT id FROM {db}.sales)"
+SQL_ARCHIVE_COPY_SALES = ("INSERT OR REPLACE INTO {db}.sales (id, total_price, sale_date, discount, tax) "
+                          "SELECT id, total_price, sale_date, discount, tax FROM main.sales "
+                          "WHERE sale_date >= ? AND sale_date < ?")
+SQL_ARCHIVE_COPY_ITEMS = ("INSERT OR REPLACE INTO {db}.sale_items (id, sale_id, product_id, product_name, quantity, "
+                          "price, discount) SELECT si.id, si.sale_id, si.product_id, si.product_name, si.quantity, "
+                          "si.price, si.discount "
+                          "FROM main.sales s JOIN main.sale_items si ON si.sale_id = s.id "
+                          "WHERE s.sale_date >= ? AND s.sale_date < ?")
+SQL_RECORD_ARCHIVE = ("INSERT INTO sales_archive (month, first_sale_id, last_sale_id, sale_count) VALUES (?, ?, ?, ?) "
+                      "ON CONFLICT (month) DO UPDATE SET first_sale_id = MIN(first_sale_id, excluded.first_sale_id), "
+                      "last_sale_id = MAX(last_sale_id, excluded.last_sale_id), "
+                      "sale_count = sale_count + excluded.sale_count")
+SQL_ARCHIVE_DELETE_ITEMS = ("DELETE FROM main.sale_items WHERE sale_id IN "
+                            "(SELECT id FROM main.sales WHERE sale_date >= ? AND sale_date < ?)")
+SQL_ARCHIVE_DELETE_SALES = "DELETE FROM main.sales WHERE sale_date >= ? AND sale_date < ?"
+SQL_ARCHIVE_SALES_PAGE = ("SELECT id, total_price, sale_date FROM {db}.sales {where} "
+                          "ORDER BY sale_date DESC, id DESC LIMIT ?")
+SQL_ARCHIVE_GET_SALE = "SELECT id, total_price, sale_date, discount, tax FROM {db}.sales WHERE id = ?"
+SQL_ARCHIVE_SALE_ITEMS = "SELECT id, product_name, quantity, price, discount FROM {db}.sale_items WHERE sale_id = ?"
+# Exports spanning archived months read the attached files and the live tables as one ordered result.
+SQL_EXPORT_SALES_PART = ("SELECT id, total_price, sale_date, discount, tax FROM {db}.sales "
+                         "WHERE sale_date >= :date_from AND sale_date < date(:date_to, '+1 day')")
+SQL_EXPORT_SALE_ITEMS_PART = ("SELECT si.id, si.sale_id, si.product_id, si.product_name, si.quantity, si.price, "
+                              "si.discount "
+                              "FROM {db}.sales s JOIN {db}.sale_items si ON si.sale_id = s.id "
+                              "WHERE s.sale_date >= :date_from AND s.sale_date < date(:date_to, '+1 day')")
+SQL_ARCHIVE_COUNT_SALES = ("SELECT COUNT(*) FROM {db}.sales "
+                           "WHERE sale_date >= :date_from AND sale_date < date(:date_to, '+1 day')")
+SQL_ARCHIVE_COUNT_SALE_ITEMS = ("SELECT COUNT(*) FROM {db}.sales s JOIN {db}.sale_items si ON si.sale_id = s.id "
+                                "WHERE s.sale_date >= :date_from AND s.sale_date < date(:date_to, '+1 day')")
+
+# --- Analytics ---
+# The sales newer than a given id and their lines, both in sale order, for the columnar loader in
+# analytics.py. Day and hour come once per sale rather than once per line; day counts days since
+# 1970-01-01, so the weekday follows from it without a strftime per row.
+SQL_SALE_DAYS = ("SELECT id, CAST(julianday(substr(sale_date, 1, 10)) - 2440587.5 AS INTEGER), "
+                 "CAST(substr(sale_date, 12, 2) AS INTEGER) FROM {db}.sales WHERE id > ? AND id <= ? ORDER BY id")
+# A line discount is spread over the line's units, so quantity times price is what the line took.
+SQL_SALE_LINES = ("SELECT sale_id, IFNULL(product_id, 0), IFNULL(quantity, 0), "
+                  "IFNULL(price - CAST(discount AS REAL) / quantity, 0) "
+                  "FROM {db}.sale_items WHERE sale_id > ? AND sale_id <= ? ORDER BY sale_id")
+SQL_NEWEST_SALE_ID = ("SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM main.sales "
+                      "UNION ALL SELECT MAX(last_sale_id) FROM sales_archive)")
+# Bounded by the registered months, so rows a crashed archive run left in a file are not read twice.
+SQL_ARCHIVED_YEARS_AFTER = ("SELECT substr(month, 1, 4), MAX(last_sale_id) FROM sales_archive "
+                            "WHERE last_sale_id > ? GROUP BY 1 ORDER BY 1")
+
+# --- Demand forecast ---
+SQL_DEMAND_ROWS = "SELECT product_id, mean, variance FROM product_demand"
+SQL_SAVE_DEMAND = "INSERT OR REPLACE INTO product_demand (product_id, mean, variance) VALUES (?, ?, ?)"
+SQL_DAILY_QUANTITIES = ("SELECT day, product_id, quantity FROM product_sales_daily WHERE day > ? AND day < ? "
+                        "ORDER BY day")
+
+# --- Maintenance ---
+SQL_GET_MAINTENANCE = "SELECT job, last_run, result FROM maintenance"
+# Claims a job unless another till ran it since the given time; changes no row when it did.
+SQL_CLAIM_MAINTENANCE = ("INSERT INTO maintenance (job, last_run) VALUES (?, ?) "
+                         "ON CONFLICT (job) DO UPDATE SET last_run = excluded.last_run, result = NULL "
+                         "WHERE maintenance.last_run <= ?")
+SQL_SET_MAINTENANCE_RESULT = "UPDATE maintenance SET result = ? WHERE job = ?"
+SQL_CHECKPOINT = "PRAGMA main.wal_checkpoint(PASSIVE)"
+SQL_CHECKPOINT_TRUNCATE = "PRAGMA main.wal_checkpoint(TRUNCATE)"
+SQL_CHECKPOINT_BUSY_TIMEOUT = f"PRAGMA busy_timeout = {CHECKPOINT_BUSY_MS}"
+SQL_BUSY_TIMEOUT = f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}"
+SQL_ANALYSIS_LIMIT = f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}"
+SQL_ANALYZE = "ANALYZE main"
+SQL_AUTO_VACUUM = "PRAGMA main.auto_vacuum"
+SQL_SET_INCREMENTAL_VACUUM = "PRAGMA main.auto_vacuum = INCREMENTAL"
+SQL_VACUUM = "VACUUM main"
+# sqlite3 steps a statement without result columns only once, and each step of this one frees one page.
+SQL_INCREMENTAL_VACUUM = "PRAGMA main.incremental_vacuum(1)"
+SQL_FREE_PAGES = "SELECT freelist_count, page_count FROM pragma_freelist_count, pragma_page_count"
+SQL_QUICK_CHECK = "PRAGMA main.quick_check"
+SQL_INTEGRITY_CHECK = "PRAGMA main.integrity_check"
+SQL_ROLLBACK_JOURNAL = "PRAGMA journal_mode = DELETE"
+
+# --- Change export ---
+# Rows written in the change log range (after, until], read against the live tables. A product appears once, with
+# its current values; 'I' if it was added in the range, 'D' if it is gone.
+SQL_CHANGED_PRODUCTS = ("SELECT CASE WHEN p.id IS NULL THEN 'D' WHEN c.inserted THEN 'I' ELSE 'U' END, c.row_id, "
+                        "p.name, p.price, p.quantity, p.image_path FROM (SELECT row_id, MAX(seq) AS seq, "
+                        "MAX(op = 'I') AS inserted FROM changes WHERE seq > ? AND seq <= ? "
+                        "AND table_name = 'products' GROUP BY row_id) c "
+                        "LEFT JOIN products p ON p.id = c.row_id ORDER BY c.seq")
+SQL_CHANGED_SALES = ("SELECT s.id, s.total_price, s.sale_date, s.discount, s.tax FROM changes c "
+                     "JOIN sales s ON s.id = c.row_id WHERE c.seq > ? AND c.seq <= ? AND c.table_name = 'sales' "
+                     "ORDER BY c.seq")
+SQL_CHANGED_SALE_ITEMS = ("SELECT si.id, si.sale_id, si.product_id, si.product_name, si.quantity, si.price, "
+                          "si.discount FROM changes c JOIN sale_items si ON si.id = c.row_id "
+                          "WHERE c.seq > ? AND c.seq <= ? AND c.table_name = 'sale_items' ORDER BY c.seq")
+# A full export: everything in the live tables.
+SQL_ALL_PRODUCTS = "SELECT 'I', id, name, price, quantity, image_path FROM products ORDER BY id"
+SQL_ALL_SALES = "SELECT id, total_price, sale_date, discount, tax FROM sales ORDER BY id"
+SQL_ALL_SALE_ITEMS = ("SELECT id, sale_id, product_id, product_name, quantity, price, discount FROM sale_items "
+                      "ORDER BY id")
+SQL_GET_EXPORT_WATERMARK = "SELECT seq FROM export_watermarks WHERE target = ?"
+# Only moves a watermark still where the export found it, so two exports of one target cannot both advance it.
+SQL_SET_EXPORT_WATERMARK = ("INSERT INTO export_watermarks (target, seq, exported_at) "
+                            "VALUES (?, ?, datetime('now', 'localtime')) ON CONFLICT (target) DO UPDATE "
+                            "SET seq = excluded.seq, exported_at = excluded.exported_at WHERE export_watermarks.seq = ?")
+SQL_LIST_EXPORT_WATERMARKS = "SELECT target, seq, exported_at FROM export_watermarks ORDER BY target"
+SQL_DELETE_EXPORT_WATERMARK = "DELETE FROM export_watermarks WHERE target = ?"
+
+# --- Schema migrations ---
+# Applied in order, each once, and recorded in schema_migrations; a launch on an up-to-date database
+# only reads the version. Databases from before the version table have no record at all, so the steps
+# up to SCHEMA_BASELINE tolerate objects that are already there.
+SQL_CREATE_MIGRATIONS = ("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, "
+                         "applied_at TIMESTAMP DEFAULT (datetime('now', 'localtime')))")
+SQL_SCHEMA_VERSION = "SELECT MAX(version) FROM schema_migrations"
+SQL_RECORD_MIGRATION = "INSERT INTO schema_migrations (version) VALUES (?)"
+PRODUCT_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS trg_products_insert AFTER INSERT ON products BEGIN
+        INSERT INTO product_changes (product_id, op) VALUES (new.id, 'I'); END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_products_update AFTER UPDATE ON products BEGIN
+        INSERT INTO product_changes (product_id, op) VALUES (new.id, 'U'); END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_products_delete AFTER DELETE ON products BEGIN
+        INSERT INTO product_changes (product_id, op) VALUES (old.id, 'D'); END''')
+# Sales and their lines are never changed once recorded, so only their inserts are logged. Archiving a month
+# or clearing the history is housekeeping of the till, not a change to the accounts, and is not logged.
+CHANGE_TRIGGERS = (
+    "DROP TRIGGER IF EXISTS trg_products_insert",
+    "DROP TRIGGER IF EXISTS trg_products_update",
+    "DROP TRIGGER IF EXISTS trg_products_delete",
+    '''CREATE TRIGGER trg_products_insert AFTER INSERT ON products BEGIN
+        INSERT INTO changes (table_name, row_id, op) VALUES ('products', new.id, 'I'); END''',
+    '''CREATE TRIGGER trg_products_update AFTER UPDATE ON products BEGIN
+        INSERT INTO changes (table_name, row_id, op) VALUES ('products', new.id, 'U'); END''',
+    '''CREATE TRIGGER trg_products_delete AFTER DELETE ON products BEGIN
+        INSERT INTO changes (table_name, row_id, op) VALUES ('products', old.id, 'D'); END''',
+    '''CREATE TRIGGER trg_sales_insert AFTER INSERT ON sales BEGIN
+        INSERT INTO changes (table_name, row_id, op) VALUES ('sales', new.id, 'I'); END''',
+    '''CREATE TRIGGER trg_sale_items_insert AFTER INSERT ON sale_items BEGIN
+        INSERT INTO changes (table_name, row_id, op) VALUES ('sale_items', new.id, 'I'); END''')
+
+
+def _paise(column):
+    # An amount in rupees, stored as REAL, as whole paise.
+    return f"CAST(round({column} * 100) AS INTEGER)"
+
+
+def _rebuild_table(table, definition, columns, values, db="main"):
+    """Statements replacing ``table`` with one of ``definition`` holding ``values``, SQL over the old rows, in
+    ``columns``; SQLite cannot change the type of a column in place. Indexes and triggers go with the old
+    table. An AUTOINCREMENT counter is carried over, so the ids of deleted or archived rows stay used."""
+    statements = [f"CREATE TABLE {db}.{table}_new {definition}",
+                  f"INSERT INTO {db}.{table}_new ({columns}) SELECT {values} FROM {db}.{table}"]
+    if "AUTOINCREMENT" in definition:
+        statements += [f"DELETE FROM {db}.sqlite_sequence WHERE name = '{table}_new'",
+                       f"UPDATE {db}.sqlite_sequence SET name = '{table}_new' WHERE name = '{table}'"]
+    return (*statements, f"DROP TABLE {db}.{table}", f"ALTER TABLE {db}.{table}_new RENAME TO {table}")
+
+
+MIGRATIONS = (
+    # 1: the original tables.
+    ('''CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,
+        price REAL NOT NULL, quantity INTEGER NOT NULL, image_path TEXT DEFAULT '')''',
+     '''CREATE TABLE IF NOT EXISTS sales (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, total_price REAL NOT NULL,
+        sale_date TIMESTAMP DEFAULT (datetime('now', 'localtime')))''',
+     '''CREATE TABLE IF NOT EXISTS sale_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, sale_id INTEGER, product_id INTEGER,
+        product_name TEXT, quantity INTEGER, price REAL,
+        FOREIGN KEY (sale_id) REFERENCES sales (id),
+        FOREIGN KEY (product_id) REFERENCES products (id))''',
+     '''CREATE TABLE IF NOT EXISTS settings (
+        id INTEGER PRIMARY KEY CHECK (id = 1), password TEXT NOT NULL)''',
+     # Databases created before product images were supported lack this column.
+     "ALTER TABLE products ADD COLUMN image_path TEXT DEFAULT ''"),
+    # 2: indexes for the sales history and product lookups.
+    ("CREATE INDEX IF NOT EXISTS idx_sale_items_sale_id ON sale_items (sale_id)",
+     # Covers the sales history: keyset order on (sale_date, id) with the amount filter read from the index.
+     "CREATE INDEX IF NOT EXISTS idx_sales_date_id_total ON sales (sale_date, id, total_price)",
+     "DROP INDEX IF EXISTS idx_sales_sale_date",
+     "CREATE INDEX IF NOT EXISTS idx_products_name ON products (name)"),
+    # 3: rollups kept current by record_sale, so reports read a row per day/hour/product instead of every
+    # line. Built from the raw sales once.
+    ('''CREATE TABLE IF NOT EXISTS sales_daily (
+        day TEXT PRIMARY KEY, sale_count INTEGER NOT NULL, item_count INTEGER NOT NULL,
+        revenue REAL NOT NULL) WITHOUT ROWID''',
+     '''CREATE TABLE IF NOT EXISTS sales_hourly (
+        hour TEXT PRIMARY KEY, sale_count INTEGER NOT NULL, item_count INTEGER NOT NULL,
+        revenue REAL NOT NULL) WITHOUT ROWID''',
+     '''CREATE TABLE IF NOT EXISTS product_sales_daily (
+        day TEXT NOT NULL, product_id INTEGER NOT NULL, product_name TEXT, quantity INTEGER NOT NULL,
+        revenue REAL NOT NULL, PRIMARY KEY (day, product_id)) WITHOUT ROWID''',
+     "DELETE FROM sales_daily", "DELETE FROM sales_hourly", "DELETE FROM product_sales_daily",
+     SQL_REBUILD_DAILY, SQL_REBUILD_HOURLY,
+     # SQL_REBUILD_PRODUCT_DAILY as it was before line discounts.
+     "INSERT INTO product_sales_daily (day, product_id, product_name, quantity, revenue) "
+     "SELECT day, product_id, product_name, quantity, revenue FROM (SELECT substr(s.sale_date, 1, 10) AS day, "
+     "si.product_id AS product_id, si.product_name AS product_name, SUM(si.quantity) AS quantity, "
+     "SUM(si.quantity * si.price) AS revenue, MAX(si.id) FROM sales s JOIN sale_items si ON si.sale_id = s.id "
+     "GROUP BY 1, 2)"),
+    # 4: slow-operation log threshold.
+    ("ALTER TABLE settings ADD COLUMN slow_operation_ms INTEGER",),
+    # 5: product versions for the in-memory catalog, and barcodes/SKUs; a product may have several
+    # (pack sizes, supplier codes), a code belongs to one product.
+    ("ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0",
+     '''CREATE TABLE IF NOT EXISTS product_barcodes (
+        barcode TEXT PRIMARY KEY, product_id INTEGER NOT NULL REFERENCES products (id)) WITHOUT ROWID''',
+     "CREATE INDEX IF NOT EXISTS idx_product_barcodes_product ON product_barcodes (product_id)"),
+    # 6: every product write is logged with an increasing sequence number, so other terminals sharing the
+    # database can fetch just the products that changed since they last looked.
+    ('''CREATE TABLE IF NOT EXISTS product_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, product_id INTEGER NOT NULL, op TEXT NOT NULL)''',
+     *PRODUCT_TRIGGERS),
+    # 7: receipt printer.
+    ("ALTER TABLE settings ADD COLUMN receipt_printer TEXT",
+     "ALTER TABLE settings ADD COLUMN auto_print_receipts INTEGER NOT NULL DEFAULT 0"),
+    # 8: registry of months moved to the sales archive.
+    ('''CREATE TABLE sales_archive (
+        month TEXT PRIMARY KEY, first_sale_id INTEGER NOT NULL, last_sale_id INTEGER NOT NULL,
+        sale_count INTEGER NOT NULL, archived_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))) WITHOUT ROWID''',),
+    # 9: daily demand statistics per product for the stock forecast, and the last day folded into them.
+    ('''CREATE TABLE product_demand (
+        product_id INTEGER PRIMARY KEY, mean REAL NOT NULL, variance REAL NOT NULL)''',
+     "ALTER TABLE settings ADD COLUMN demand_through TEXT"),
+    # 10: amounts of money as whole paise in INTEGER columns rather than rupees in REAL ones, so sums are
+    # exact; the discount and tax of each sale and the discount of each line; the tax rates of the till.
+    (*_rebuild_table("products", '''(
+        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, price INTEGER NOT NULL,
+        quantity INTEGER NOT NULL, image_path TEXT DEFAULT '', version INTEGER NOT NULL DEFAULT 0)''',
+                     "id, name, price, quantity, image_path, version",
+                     f"id, name, {_paise('price')}, quantity, image_path, version"),
+     *_rebuild_table("sales", '''(
+        id INTEGER PRIMARY KEY AUTOINCREMENT, total_price INTEGER NOT NULL,
+        sale_date TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+        discount INTEGER NOT NULL DEFAULT 0, tax INTEGER NOT NULL DEFAULT 0)''',
+                     "id, total_price, sale_date", f"id, {_paise('total_price')}, sale_date"),
+     *_rebuild_table("sale_items", '''(
+        id INTEGER PRIMARY KEY AUTOINCREMENT, sale_id INTEGER, product_id INTEGER,
+        product_name TEXT, quantity INTEGER, price INTEGER, discount INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (sale_id) REFERENCES sales (id),
+        FOREIGN KEY (product_id) REFERENCES products (id))''',
+                     "id, sale_id, product_id, product_name, quantity, price",
+                     f"id, sale_id, product_id, product_name, quantity, {_paise('price')}"),
+     *_rebuild_table("sales_daily", '''(
+        day TEXT PRIMARY KEY, sale_count INTEGER NOT NULL, item_count INTEGER NOT NULL,
+        revenue INTEGER NOT NULL) WITHOUT ROWID''',
+                     "day, sale_count, item_count, revenue", f"day, sale_count, item_count, {_paise('revenue')}"),
+     *_rebuild_table("sales_hourly", '''(
+        hour TEXT PRIMARY KEY, sale_count INTEGER NOT NULL, item_count INTEGER NOT NULL,
+        revenue INTEGER NOT NULL) WITHOUT ROWID''',
+                     "hour, sale_count, item_count, revenue", f"hour, sale_count, item_count, {_paise('revenue')}"),
+     *_rebuild_table("product_sales_daily", '''(
+        day TEXT NOT NULL, product_id INTEGER NOT NULL, product_name TEXT, quantity INTEGER NOT NULL,
+        revenue INTEGER NOT NULL, PRIMARY KEY (day, product_id)) WITHOUT ROWID''',
+                     "day, product_id, product_name, quantity, revenue",
+                     f"day, product_id, product_name, quantity, {_paise('revenue')}"),
+     "CREATE INDEX idx_products_name ON products (name)",
+     "CREATE INDEX idx_sale_items_sale_id ON sale_items (sale_id)",
+     "CREATE INDEX idx_sales_date_id_total ON sales (sale_date, id, total_price)",
+     *PRODUCT_TRIGGERS,
+     "ALTER TABLE settings ADD COLUMN tax_rates TEXT",
+     "ALTER TABLE settings ADD COLUMN tax_inclusive INTEGER NOT NULL DEFAULT 0"),
+    # 11: when each maintenance job last ran on any till, and what came of it.
+    ('''CREATE TABLE maintenance (
+        job TEXT PRIMARY KEY, last_run TEXT NOT NULL, result TEXT) WITHOUT ROWID''',),
+    # 12: the product change log becomes one for sales and sale items as well, numbered on from where it was,
+    # and each change export keeps the last change it has written out.
+    ('''CREATE TABLE changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL, row_id INTEGER NOT NULL,
+        op TEXT NOT NULL)''',
+     "INSERT INTO changes (seq, table_name, row_id, op) SELECT seq, 'products', product_id, op FROM product_changes",
+     # The copy made a counter at the highest seq kept; carry over the old one, which pruning does not lower.
+     "DELETE FROM sqlite_sequence WHERE name = 'changes'",
+     "UPDATE sqlite_sequence SET name = 'changes' WHERE name = 'product_changes'",
+     *CHANGE_TRIGGERS,
+     "DROP TABLE product_changes",
+     '''CREATE TABLE export_watermarks (
+        target TEXT PRIMARY KEY, seq INTEGER NOT NULL, exported_at TEXT NOT NULL) WITHOUT ROWID'''),
+)
+# Archive files from before migration 10, converted the same way.
+ARCHIVE_UPGRADE = (
+    *_rebuild_table("sales", ARCHIVE_SALES, "id, total_price, sale_date", f"id, {_paise('total_price')}, sale_date",
+                    db="{db}"),
+    *_rebuild_table("sale_items", ARCHIVE_SALE_ITEMS, "id, sale_id, product_id, product_name, quantity, price",
+                    f"id, sale_id, product_id, product_name, quantity, {_paise('price')}", db="{db}"),
+    *ARCHIVE_INDEXES,
+    f"PRAGMA {{db}}.user_version = {ARCHIVE_VERSION}",
+)
+SCHEMA_BASELINE = 7
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+class InsufficientStockError(Exception):
+    """A sale asked for more of a product than is left in stock."""
+
+    def __init__(self, product_id, name, requested, available):
+        super().__init__(f"Only {available} of '{name}' left in stock ({requested} requested).")
+        self.product_id = product_id
+        self.name = name
+        self.requested = requested
+        self.available = available
+
+
+class BarcodeInUseError(Exception):
+    """A barcode being assigned already belongs to another product."""
+
+    def __init__(self, barcode, product_id):
+        super().__init__(f"Barcode '{barcode}' already belongs to product ID {product_id}.")
+        self.barcode = barcode
+        self.product_id = product_id
+
+
+class _StockShortfall(Exception):
+    """Raised inside record_sale to roll back when a stock decrement did not apply."""
+
+
+def _quantities(items):
+    """{product_id: (name, total quantity)} over sale ``items``, in the order the products first appear."""
+    quantities = {}
+    for pid, name, qty, _, _ in items:
+        first_name, total = quantities.get(pid, (name, 0))
+        quantities[pid] = (first_name, total + qty)
+    return quantities
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """Charges time spent inside SQLite to the operation being measured (see metrics)."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            recorder.charge("sql", time.perf_counter() - started, sql)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            recorder.charge("sql", time.perf_counter() - started, sql)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            recorder.charge("sql", time.perf_counter() - started)
+
+    def fetchmany(self, size=1):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(size)
+        finally:
+            recorder.charge("sql", time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            recorder.charge("sql", time.perf_counter() - started)
+
+
+class _TimedConnection(sqlite3.Connection):
+    def execute(self, sql, parameters=()):
+        return self.cursor(_TimedCursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor(_TimedCursor).executemany(sql, seq_of_parameters)
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def retry_when_busy(method):
+    """Re-run a write transaction that another terminal kept locked for longer than busy_timeout."""
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        for attempt in range(WRITE_RETRIES):
+            try:
+                return method(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == WRITE_RETRIES - 1:
+                    raise
+                # Jitter keeps the tills that were waiting on the same lock from colliding again.
+                time.sleep(WRITE_RETRY_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    return wrapper
+
+
+def parse_barcodes(text):
+    """Split a comma or whitespace separated list of barcodes, dropping blanks and repeats."""
+    return tuple(dict.fromkeys(code for code in text.replace(",", " ").split())) if text else ()
+
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+class _BackupRestarted(Exception):
+    """Other connections kept writing, so a stepped backup kept starting over."""
+
+
+def copy_database(source, path, pages=BACKUP_STEP_PAGES, pause=BACKUP_STEP_PAUSE):
+    """Copy the main database of the connection ``source`` to a new file at ``path`` with the online backup API.
+
+    The copy goes ``pages`` at a time with a pause after each step, which
+    leaves the tills free to write meanwhile. A write through any other
+    connection makes SQLite start a stepped copy over; after BACKUP_RESTARTS
+    of those the rest is copied in a single step, which under WAL still
+    does not hold up writers. The copy is switched to a rollback journal so
+    it is one self-contained file. Raises sqlite3.DatabaseError, leaving no
+    file behind, if the copy fails its quick check.
+    """
+    for step in (pages, -1):
+        left, restarts = None, 0
+
+        def progress(status, remaining, total):
+            nonlocal left, restarts
+            if left is not None and remaining > left:
+                restarts += 1
+                if restarts > BACKUP_RESTARTS:
+                    raise _BackupRestarted()
+            left = remaining
+            time.sleep(pause)
+
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target, pages=step, progress=progress if step > 0 else None)
+            target.execute(SQL_ROLLBACK_JOURNAL)
+            problems = [row[0] for row in target.execute(SQL_QUICK_CHECK)]
+        except _BackupRestarted:
+            target.close()
+            os.remove(path)
+            continue
+        except BaseException:
+            target.close()
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        target.close()
+        if problems != ["ok"]:
+            os.remove(path)
+            raise sqlite3.DatabaseError(f"The backup copy failed its check: {problems[0]}")
+        return path
+
+
+def copy_database_file(source_path, path):
+    """copy_database() for a database file no Storage has open, such as a sales archive."""
+    source = sqlite3.connect(source_path)
+    try:
+        return copy_database(source, path)
+    finally:
+        source.close()
+
+
+def restore_database(path, db_path):
+    """Replace the contents of the database at ``db_path``, created if missing, with the copy at ``path``.
+
+    Goes through the backup API, so a database in WAL mode is rewritten
+    consistently rather than overwritten under its log. No other connection
+    should have ``db_path`` open.
+    """
+    source, target = sqlite3.connect(path), sqlite3.connect(db_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+class Storage:
+    """Owns the SQLite connection and every query the application runs."""
+
+    def __init__(self, db_path, check_same_thread=True):
+        self.db_path = db_path
+        # Autocommit mode: transactions are opened explicitly by transaction().
+        self.conn = sqlite3.connect(db_path, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE,
+                                    check_same_thread=check_same_thread, factory=_TimedConnection)
+        for pragma in PRAGMAS:
+            self.conn.execute(pragma)
+        self.archive_dir = os.path.join(os.path.dirname(os.path.abspath(db_path)), "archive")
+        self._attached = OrderedDict()  # schema -> archive path, least recently used first
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """Run the enclosed statements in one transaction, rolling back on error."""
+        self.conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def schema_version(self):
+        """The newest migration applied to the database, 0 for a new or pre-versioning one."""
+        try:
+            return self.conn.execute(SQL_SCHEMA_VERSION).fetchone()[0] or 0
+        except sqlite3.OperationalError:  # No schema_migrations table yet.
+            return 0
+
+    @retry_when_busy
+    def create_tables(self):
+        """Bring the schema up to date by applying the migrations the database has not had yet."""
+        if self.schema_version() >= SCHEMA_VERSION:
+            return
+        with self.transaction(immediate=True):
+            self.conn.execute(SQL_CREATE_MIGRATIONS)
+            current = self.schema_version()  # Another till may have migrated while this one waited.
+            for version in range(current + 1, SCHEMA_VERSION + 1):
+                for statement in MIGRATIONS[version - 1]:
+                    try:
+                        self.conn.execute(statement)
+                    except sqlite3.OperationalError as e:
+                        # Pre-versioning databases may already have the column.
+                        if version > SCHEMA_BASELINE or "duplicate column" not in str(e):
+                            raise
+                self.conn.execute(SQL_RECORD_MIGRATION, (version,))
+            self.conn.execute(SQL_INSERT_DEFAULT_PASSWORD, (hash_password("admin"),))
+
+    # --- Settings ---
+    def get_password_hash(self):
+        row = self.conn.execute(SQL_GET_PASSWORD).fetchone()
+        return row[0] if row else None
+
+    @retry_when_busy
+    def set_password_hash(self, password_hash):
+        with self.transaction():
+            self.conn.execute(SQL_SET_PASSWORD, (password_hash,))
+
+    def get_slow_operation_ms(self):
+        """The configured slow-operation log threshold, or None for the default."""
+        row = self.conn.execute(SQL_GET_SLOW_OPERATION_MS).fetchone()
+        return row[0] if row else None
+
+    @retry_when_busy
+    def set_slow_operation_ms(self, milliseconds):
+        with self.transaction():
+            self.conn.execute(SQL_SET_SLOW_OPERATION_MS, (milliseconds,))
+
+    def get_receipt_printer(self):
+        """(printer spec or None for the default, whether to print every sale automatically)."""
+        row = self.conn.execute(SQL_GET_RECEIPT_PRINTER).fetchone()
+        return (row[0], bool(row[1])) if row else (None, False)
+
+    @retry_when_busy
+    def set_receipt_printer(self, spec, auto_print):
+        with self.transaction():
+            self.conn.execute(SQL_SET_RECEIPT_PRINTER, (spec or None, int(auto_print)))
+
+    def get_tax(self):
+        """(tax rates as text, e.g. 'GST 18%', or None, whether prices already include the tax)."""
+        row = self.conn.execute(SQL_GET_TAX).fetchone()
+        return (row[0], bool(row[1])) if row else (None, False)
+
+    @retry_when_busy
+    def set_tax(self, rates, inclusive):
+        with self.transaction():
+            self.conn.execute(SQL_SET_TAX, (rates or None, int(inclusive)))
+
+    # --- Products ---
+    def list_products(self):
+        return self.conn.execute(SQL_LIST_PRODUCTS).fetchall()
+
+    def get_product(self, product_id):
+        """Return (name, price, quantity) for a product, or None."""
+        return self.conn.execute(SQL_GET_PRODUCT, (product_id,)).fetchone()
+
+    def get_image_path(self, product_id):
+        row = self.conn.execute(SQL_GET_IMAGE_PATH, (product_id,)).fetchone()
+        return row[0] if row else None
+
+    def list_catalog(self):
+        """Every product as (id, name, price, quantity, image_path, version, barcodes), for the in-memory catalog."""
+        return self.conn.execute(SQL_LIST_CATALOG)
+
+    def get_catalog_row(self, product_id):
+        return self.conn.execute(SQL_GET_CATALOG_ROW, (product_id,)).fetchone()
+
+    def find_by_barcode(self, barcode):
+        """Id of the product a barcode belongs to, or None."""
+        row = self.conn.execute(SQL_FIND_BARCODE, (barcode,)).fetchone()
+        return row[0] if row else None
+
+    @retry_when_busy
+    def add_product(self, name, price, quantity, image_path="", barcodes=()):
+        with self.transaction(immediate=True):
+            product_id = self.conn.execute(SQL_INSERT_PRODUCT, (name, price, quantity, image_path)).lastrowid
+            self._set_barcodes(product_id, barcodes)
+            return product_id
+
+    @retry_when_busy
+    def update_product(self, product_id, name, price, quantity, image_path=None, barcodes=None):
+        """Update a product; ``image_path``/``barcodes`` of None leave the current ones in place."""
+        with self.transaction(immediate=True):
+            if image_path is not None:
+                self.conn.execute(SQL_UPDATE_PRODUCT_WITH_IMAGE, (name, price, quantity, image_path, product_id))
+            else:
+                self.conn.execute(SQL_UPDATE_PRODUCT, (name, price, quantity, product_id))
+            if barcodes is not None:
+                self.conn.execute(SQL_DELETE_BARCODES, (product_id,))
+                self._set_barcodes(product_id, barcodes)
+
+    def _set_barcodes(self, product_id, barcodes):
+        for barcode in barcodes:
+            owner = self.find_by_barcode(barcode)
+            if owner is not None:
+                raise BarcodeInUseError(barcode, owner)
+        self.conn.executemany(SQL_INSERT_BARCODE, [(barcode, product_id) for barcode in barcodes])
+
+    def import_keys(self):
+        """(id, name) of every product and (barcode, product_id) of every barcode, from one snapshot."""
+        with self.transaction():
+            return (self.conn.execute(SQL_IMPORT_PRODUCT_KEYS).fetchall(),
+                    self.conn.execute(SQL_IMPORT_BARCODE_KEYS).fetchall())
+
+    @retry_when_busy
+    def import_products(self, new, updates, add_quantities=False):
+        """Insert and update a batch of products in one transaction.
+
+        ``new`` holds (name, price, quantity, barcodes), ``updates`` holds
+        (product_id, price, quantity, barcodes); a price or quantity of None
+        is left alone and the barcodes are added to the product's existing
+        ones. ``add_quantities`` adds to the stock instead of replacing it.
+        """
+        with self.transaction(immediate=True):
+            barcodes = []
+            for name, price, quantity, codes in new:
+                product_id = self.conn.execute(SQL_INSERT_PRODUCT, (name, price, quantity or 0, "")).lastrowid
+                barcodes.extend((code, product_id) for code in codes)
+            self.conn.executemany(SQL_IMPORT_ADD_STOCK if add_quantities else SQL_IMPORT_SET_STOCK,
+                                  [(price, quantity, product_id) for product_id, price, quantity, _ in updates])
+            barcodes.extend((code, product_id) for product_id, _, _, codes in updates for code in codes)
+            self.conn.executemany(SQL_INSERT_BARCODE, barcodes)
+
+    @retry_when_busy
+    def clear_products(self):
+        with self.transaction():
+            self.conn.execute("DELETE FROM product_barcodes")
+            # The id counter is kept, so new products never reuse ids a change export has already sent.
+            self.conn.execute("DELETE FROM products")
+
+    def export_products(self):
+        return self.conn.execute(SQL_EXPORT_PRODUCTS)
+
+    @retry_when_busy
+    def adjust_stock(self, adjustments):
+        """Apply stock counts and deliveries in one transaction and return the products' catalog rows.
+
+        Each adjustment is (product_id, quantity, delta): the stock is set to
+        ``quantity`` unless it is None, otherwise ``delta`` is added to it.
+        Products that do not exist are left out of the result.
+        """
+        with self.transaction(immediate=True):
+            for product_id, quantity, delta in adjustments:
+                if quantity is not None:
+                    self.conn.execute(SQL_IMPORT_SET_STOCK, (None, quantity, product_id))
+                else:
+                    self.conn.execute(SQL_ADJUST_STOCK, (delta, product_id))
+            rows = [self.get_catalog_row(product_id) for product_id in dict.fromkeys(a[0] for a in adjustments)]
+        return [row for row in rows if row is not None]
+
+    # --- Change notification ---
+    def data_version(self):
+        """A number that changes whenever another connection commits; costs no table read."""
+        return self.conn.execute(SQL_DATA_VERSION).fetchone()[0]
+
+    def latest_change(self):
+        return self.conn.execute(SQL_LATEST_CHANGE).fetchone()[0]
+
+    def first_change(self):
+        """Sequence number of the oldest change still logged; None when the log is empty."""
+        return self.conn.execute(SQL_FIRST_CHANGE).fetchone()[0]
+
+    def load_catalog(self):
+        """(latest change seq, catalog rows) read from one snapshot, to seed a Catalog and its watermark."""
+        with self.transaction():
+            return self.latest_change(), self.list_catalog().fetchall()
+
+    def product_changes_since(self, seq):
+        """Products written since change ``seq``, as (latest seq, deleted ids, catalog rows of changed products).
+
+        Returns None if the log no longer reaches back to ``seq``; the caller
+        should reload the whole catalog then.
+        """
+        with self.transaction():
+            first = self.first_change()
+            if first is not None and first > seq + 1:
+                return None  # Sequence numbers have no gaps, so the entries after seq were pruned.
+            changes = self.conn.execute(SQL_PRODUCT_CHANGES, (seq,)).fetchall()
+            if not changes:
+                return seq, [], []
+            deleted = {pid for _, pid, op in changes if op == "D"}
+            changed = dict.fromkeys(pid for _, pid, _ in changes)
+            rows = [row for row in map(self.get_catalog_row, changed) if row is not None]
+            return changes[-1][0], sorted(deleted), rows
+
+    @retry_when_busy
+    def prune_changes(self, keep=CHANGES_KEEP, export_keep=EXPORT_CHANGES_KEEP):
+        with self.transaction():
+            self.conn.execute(SQL_PRUNE_CHANGES, {"keep": keep, "export_keep": export_keep})
+
+    # --- Change export ---
+    def changed_products(self, after, until):
+        """(op, id, name, price, quantity, image_path) of the products changed in changes ``after``..``until``;
+        every product when ``after`` is None. A deleted product has only its id."""
+        if after is None:
+            return self.conn.execute(SQL_ALL_PRODUCTS)
+        return self.conn.execute(SQL_CHANGED_PRODUCTS, (after, until))
+
+    def changed_sales(self, after, until):
+        """(id, total_price, sale_date, discount, tax) of the sales recorded in changes ``after``..``until``, or
+        of every live sale when ``after`` is None."""
+        if after is None:
+            return self.conn.execute(SQL_ALL_SALES)
+        return self.conn.execute(SQL_CHANGED_SALES, (after, until))
+
+    def changed_sale_items(self, after, until):
+        if after is None:
+            return self.conn.execute(SQL_ALL_SALE_ITEMS)
+        return self.conn.execute(SQL_CHANGED_SALE_ITEMS, (after, until))
+
+    def export_watermark(self, target):
+        """The last change export ``target`` has written out; None before its first export."""
+        row = self.conn.execute(SQL_GET_EXPORT_WATERMARK, (target,)).fetchone()
+        return row[0] if row else None
+
+    @retry_when_busy
+    def set_export_watermark(self, target, seq, expected):
+        """Move ``target``'s watermark from ``expected`` (None for a first export) to ``seq``. Returns False,
+        changing nothing, if another export of the target moved it first."""
+        with self.transaction(immediate=True):
+            if expected is None and self.export_watermark(target) is not None:
+                return False
+            return self.conn.execute(SQL_SET_EXPORT_WATERMARK, (target, seq, expected)).rowcount > 0
+
+    def export_watermarks(self):
+        """(target, seq, exported_at) of every change export."""
+        return self.conn.execute(SQL_LIST_EXPORT_WATERMARKS).fetchall()
+
+    @retry_when_busy
+    def forget_export(self, target):
+        """Stop keeping changes for ``target``; its next export is a full one."""
+        with self.transaction(immediate=True):
+            self.conn.execute(SQL_DELETE_EXPORT_WATERMARK, (target,))
+
+    # --- Sales ---
+    @retry_when_busy
+    def record_sale(self, items, total_price, discount=0, tax=0):
+        """Store a sale and its lines and take the sold quantities out of stock.
+
+        ``items`` is a list of (product_id, name, quantity, price, discount),
+        as Cart.items() gives them; amounts are paise. ``discount`` is the
+        sale's whole discount, its lines' included. Everything happens in
+        one immediate transaction; if any line has too little stock left the
+        whole sale is rolled back and InsufficientStockError is raised.
+        Returns the new sale id.
+        """
+        for attempt in range(WRITE_RETRIES):
+            try:
+                with self.transaction(immediate=True):
+                    return self._insert_sale(items, total_price, discount, tax)
+            except _StockShortfall:
+                # Rolled back; find the product that could not be covered for the error message. None means
+                # another till restocked in the meantime, so the sale can go through now.
+                error = self._shortfall(items, certain=attempt == WRITE_RETRIES - 1)
+                if error is not None:
+                    raise error from None
+
+    @retry_when_busy
+    def record_sales(self, sales):
+        """Store several sales, each (items, total_price, discount, tax) as for record_sale, in one transaction.
+
+        A sale with too little stock is rolled back to its own savepoint
+        and the rest are recorded regardless. Returns, per sale, its new id
+        or the InsufficientStockError that kept it out.
+        """
+        results = []
+        with self.transaction(immediate=True):
+            for items, total_price, discount, tax in sales:
+                self.conn.execute("SAVEPOINT sale")
+                try:
+                    results.append(self._insert_sale(items, total_price, discount, tax))
+                except _StockShortfall:
+                    self.conn.execute("ROLLBACK TO sale")
+                    # Nothing can restock while we hold the lock, so the shortfall is still there.
+                    results.append(self._shortfall(items, certain=True))
+                self.conn.execute("RELEASE sale")
+        return results
+
+    def _insert_sale(self, items, total_price, discount, tax):
+        # A product on several lines is taken out of stock once, for all of them together.
+        quantities = _quantities(items)
+        decremented = self.conn.executemany(SQL_DECREMENT_STOCK,
+                                            [(qty, pid, qty) for pid, (_, qty) in quantities.items()]).rowcount
+        if decremented != len(quantities):
+            raise _StockShortfall
+        sale_id = self.conn.execute(SQL_INSERT_SALE, (total_price, discount, tax)).lastrowid
+        self.conn.executemany(SQL_INSERT_SALE_ITEM, [(sale_id, *item) for item in items])
+        self._rollup_sale(sale_id, items, total_price)
+        return sale_id
+
+    def _shortfall(self, items, certain=False):
+        """InsufficientStockError for the first product the stock cannot cover, or None if it covers them all.
+
+        ``certain`` is for a decrement that failed with no chance of a
+        restock since: the product with the least to spare is blamed even if
+        the stock now looks enough, so a sale is never taken as recorded.
+        """
+        closest = None
+        for pid, (name, qty) in _quantities(items).items():
+            row = self.get_product(pid)
+            available = row[2] if row else 0
+            if available < qty:
+                return InsufficientStockError(pid, name, qty, available)
+            if closest is None or available - qty < closest[3] - closest[2]:
+                closest = (pid, name, qty, available)
+        return InsufficientStockError(*closest) if certain and closest else None
+
+    def _rollup_sale(self, sale_id, items, total_price):
+        sale_date = self.conn.execute(SQL_GET_SALE_DATE, (sale_id,)).fetchone()[0]
+        day, hour = sale_date[:10], sale_date[:13]
+        item_count = sum(qty for _, _, qty, _, _ in items)
+        self.conn.execute(SQL_ROLLUP_DAY, (day, item_count, total_price))
+        self.conn.execute(SQL_ROLLUP_HOUR, (hour, item_count, total_price))
+        self.conn.executemany(SQL_ROLLUP_PRODUCT, [(day, pid, name, qty, qty * price - discount)
+                                                   for pid, name, qty, price, discount in items])
+
+    def _rebuild_rollups(self):
+        # Only live sales can be recounted; the rollups of archived months are kept as they are.
+        archived_until = self.conn.execute(SQL_ARCHIVED_UNTIL).fetchone()[0] or ""
+        for table, key in (("sales_daily", "day"), ("sales_hourly", "hour"), ("product_sales_daily", "day")):
+            self.conn.execute(f"DELETE FROM {table} WHERE {key} >= ?", (archived_until,))
+        self.conn.execute(SQL_REBUILD_DAILY)
+        self.conn.execute(SQL_REBUILD_HOURLY)
+        self.conn.execute(SQL_REBUILD_PRODUCT_DAILY)
+
+    @retry_when_busy
+    def rebuild_rollups(self):
+        """Recompute every rollup table from the raw sales, e.g. after editing history by hand."""
+        with self.transaction(immediate=True):
+            self._rebuild_rollups()
+
+    def list_sales_page(self, after=None, limit=SALES_PAGE_SIZE, date_from=None, date_to=None,
+                        min_total=None, max_total=None):
+        """Return up to ``limit`` sales as (id, total_price, sale_date), newest first.
+
+        ``after`` is the (sale_date, id) of the last row of the previous page;
+        the next page continues strictly below it, so fetching page N costs
+        the same as fetching page 1. ``date_from``/``date_to`` are inclusive
+        'YYYY-MM-DD' dates and the totals are inclusive bounds.
+        """
+        clauses, params = [], []
+        if after is not None:
+            clauses.append("(sale_date, id) < (?, ?)")
+            params.extend(after)
+        if date_from:
+            clauses.append("sale_date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("sale_date < date(?, '+1 day')")
+            params.append(date_to)
+        if min_total is not None:
+            clauses.append("total_price >= ?")
+            params.append(min_total)
+        if max_total is not None:
+            clauses.append("total_price <= ?")
+            params.append(max_total)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.conn.execute(SQL_SALES_PAGE.format(where=where), (*params, limit)).fetchall()
+        # Archived months are older than everything live, so a short page continues into them, newest first.
+        if len(rows) < limit:
+            for year in self._archived_years(after, date_from, date_to):
+                schema = self._attach(year)
+                rows += self.conn.execute(SQL_ARCHIVE_SALES_PAGE.format(db=schema, where=where),
+                                          (*params, limit - len(rows))).fetchall()
+                if len(rows) >= limit:
+                    break
+        return rows
+
+    def _archive_of_sale(self, sale_id):
+        # Schema of the attached archive holding an archived sale, or None if it was never archived.
+        row = self.conn.execute(SQL_ARCHIVE_FOR_SALE, (sale_id,)).fetchone()
+        return self._attach(row[0][:4]) if row else None
+
+    def sale_date(self, sale_id):
+        """The date and time stored with a live sale, as 'YYYY-MM-DD HH:MM:SS'."""
+        return self.conn.execute(SQL_GET_SALE_DATE, (sale_id,)).fetchone()[0]
+
+    def get_sale_items(self, sale_id):
+        rows = self.conn.execute(SQL_GET_SALE_ITEMS, (sale_id,)).fetchall()
+        if not rows and (schema := self._archive_of_sale(sale_id)):
+            rows = self.conn.execute(SQL_ARCHIVE_SALE_ITEMS.format(db=schema), (sale_id,)).fetchall()
+        return rows
+
+    def get_receipt(self, sale_id):
+        """A past sale in the shape CheckoutEngine returns, marked as a reprint, or None if there is no such sale."""
+        with self.transaction():
+            sale = self.conn.execute(SQL_GET_SALE, (sale_id,)).fetchone()
+            items = self.conn.execute(SQL_GET_SALE_ITEMS, (sale_id,)).fetchall() if sale else []
+        if sale is None:
+            schema = self._archive_of_sale(sale_id)
+            sale = schema and self.conn.execute(SQL_ARCHIVE_GET_SALE.format(db=schema), (sale_id,)).fetchone()
+            if not sale:
+                return None
+            items = self.conn.execute(SQL_ARCHIVE_SALE_ITEMS.format(db=schema), (sale_id,)).fetchall()
+        sale_id, total, sale_date, discount, tax = sale
+        subtotal = sum(qty * price for _, _, qty, price, _ in items)
+        # Only the tax total is kept; prices included it if the total did not add it on.
+        taxes = [("Tax", None, tax)] if tax else []
+        return {"sale_id": sale_id, "total": total, "date": sale_date, "reprint": True, "subtotal": subtotal,
+                "discount": discount, "taxes": taxes, "tax_inclusive": bool(tax) and total == subtotal - discount,
+                "items": [{'name': name, 'quantity': qty, 'price': price, 'discount': line_discount}
+                          for _, name, qty, price, line_discount in items]}
+
+    def export_sales(self, date_from, date_to):
+        """Sales dated ``date_from``..``date_to``, archived ones included once attach_archives() has run."""
+        archives = self._attached_archives(date_from, date_to)
+        if not archives:
+            return self.conn.execute(SQL_EXPORT_SALES, (date_from, date_to))
+        parts = [SQL_EXPORT_SALES_PART.format(db=schema) for schema in archives + ["main"]]
+        return self.conn.execute(" UNION ALL ".join(parts) + " ORDER BY 3, 1",
+                                 {"date_from": date_from, "date_to": date_to})
+
+    def export_sale_items(self, date_from, date_to):
+        archives = self._attached_archives(date_from, date_to)
+        if not archives:
+            return self.conn.execute(SQL_EXPORT_SALE_ITEMS, (date_from, date_to))
+        parts = [SQL_EXPORT_SALE_ITEMS_PART.format(db=schema) for schema in archives + ["main"]]
+        return self.conn.execute(" UNION ALL ".join(parts) + " ORDER BY 2, 1",
+                                 {"date_from": date_from, "date_to": date_to})
+
+    # --- Reports ---
+    # All date bounds are inclusive 'YYYY-MM-DD' strings; these read only the rollup tables.
+    def daily_totals(self, date_from, date_to):
+        """(day, sale_count, item_count, revenue) per day with sales."""
+        return self.conn.execute(SQL_DAILY_TOTALS, (date_from, date_to))
+
+    def hourly_totals(self, date_from, date_to):
+        """('YYYY-MM-DD HH', sale_count, item_count, revenue) per hour with sales."""
+        return self.conn.execute(SQL_HOURLY_TOTALS, (date_from, date_to))
+
+    def product_totals(self, date_from, date_to):
+        """(product_id, product_name, quantity, revenue) per product sold, best sellers first."""
+        return self.conn.execute(SQL_PRODUCT_TOTALS, (date_from, date_to))
+
+    def range_totals(self, date_from, date_to):
+        """(sale_count, item_count, revenue) over the whole range."""
+        return self.conn.execute(SQL_RANGE_TOTALS, (date_from, date_to)).fetchone()
+
+    def count_export_rows(self, date_from, date_to):
+        """Number of rows an export of the given date range will write."""
+        return (self.conn.execute(SQL_COUNT_PRODUCTS).fetchone()[0]
+                + self.conn.execute(SQL_COUNT_DAILY, (date_from, date_to)).fetchone()[0]
+                + self.conn.execute(SQL_COUNT_PRODUCT_TOTALS, (date_from, date_to)).fetchone()[0]
+                + self.conn.execute(SQL_COUNT_SALES, (date_from, date_to)).fetchone()[0]
+                + self.conn.execute(SQL_COUNT_SALE_ITEMS, (date_from, date_to)).fetchone()[0]
+                + sum(self.conn.execute(sql.format(db=schema), {"date_from": date_from, "date_to": date_to}
+                                        ).fetchone()[0]
+                      for schema in self._attached_archives(date_from, date_to)
+                      for sql in (SQL_ARCHIVE_COUNT_SALES, SQL_ARCHIVE_COUNT_SALE_ITEMS)))
+
+    @retry_when_busy
+    def clear_sales(self):
+        """Delete every sale, live and archived. New sales carry on from the last id."""
+        with self.transaction():
+            years = {month[:4] for (month,) in self.conn.execute(SQL_ARCHIVED_MONTHS)}
+            self.conn.execute("DELETE FROM sales")
+            self.conn.execute("DELETE FROM sale_items")
+            for table in ("sales_daily", "sales_hourly", "product_sales_daily", "sales_archive", "product_demand"):
+                self.conn.execute(f"DELETE FROM {table}")
+            self.conn.execute(SQL_SET_DEMAND_THROUGH, (None,))
+            # Id counters are kept, as for products: a change export has already sent the old ids.
+        while self._attached:
+            self.conn.execute(f"DETACH DATABASE {self._attached.popitem()[0]}")
+        for year in years:
+            try:
+                os.remove(self.archive_path(year))
+            except OSError:
+                pass  # Still open on another till; archive_month() purges its unregistered months.
+
+    # --- Demand forecast ---
+    def demand_state(self):
+        """(last day folded into the demand statistics or None, [(product_id, mean, variance), ...])."""
+        with self.transaction():
+            row = self.conn.execute(SQL_GET_DEMAND_THROUGH).fetchone()
+            return row and row[0], self.conn.execute(SQL_DEMAND_ROWS).fetchall()
+
+    def daily_quantities(self, after_day, before_day):
+        """(day, product_id, quantity) per product and day strictly between the two, in day order."""
+        return self.conn.execute(SQL_DAILY_QUANTITIES, (after_day, before_day))
+
+    @retry_when_busy
+    def save_demand(self, rows, through, expected_through):
+        """Save demand statistics folded up to ``through``. Returns False, saving nothing, if another till
+        has moved them on from ``expected_through`` in the meantime."""
+        with self.transaction(immediate=True):
+            row = self.conn.execute(SQL_GET_DEMAND_THROUGH).fetchone()
+            if (row and row[0]) != expected_through:
+                return False
+            self.conn.executemany(SQL_SAVE_DEMAND, rows)
+            self.conn.execute(SQL_SET_DEMAND_THROUGH, (through,))
+        return True
+
+    # --- Archive ---
+    def archive_path(self, year):
+        return os.path.join(self.archive_dir, f"sales_{year}.db")
+
+    def _attach(self, year, create=False):
+        """Attach the archive file of ``year`` if it is not already, and return its schema name."""
+        schema = f"archive_{year}"
+        if schema in self._attached:
+            self._attached.move_to_end(schema)
+            return schema
+        path = self.archive_path(year)
+        if create:
+            os.makedirs(self.archive_dir, exist_ok=True)
+        elif not os.path.exists(path):
+            raise sqlite3.OperationalError(f"The sales archive {path} is missing.")
+        while len(self._attached) >= MAX_ATTACHED_ARCHIVES:
+            self.conn.execute(f"DETACH DATABASE {self._attached.popitem(last=False)[0]}")
+        self.conn.execute(f"ATTACH DATABASE ? AS {schema}", (path,))
+        self._attached[schema] = path
+        if self.conn.execute(SQL_ARCHIVE_VERSION.format(db=schema)).fetchone()[0] < ARCHIVE_VERSION:
+            self._upgrade_archive(schema)
+        return schema
+
+    @retry_when_busy
+    def _upgrade_archive(self, schema):
+        # An archive written before amounts were kept in paise; another till may be converting it too.
+        with self.transaction():
+            if self.conn.execute(SQL_ARCHIVE_VERSION.format(db=schema)).fetchone()[0] >= ARCHIVE_VERSION:
+                return
+            if self.conn.execute(SQL_ARCHIVE_HAS_SALES.format(db=schema)).fetchone()[0]:
+                for statement in ARCHIVE_UPGRADE:
+                    self.conn.execute(statement.format(db=schema))
+
+    def _archived_years(self, after=None, date_from=None, date_to=None):
+        """Archive years, newest first, holding months that can contain sales matching the filters."""
+        years = []
+        for (month,) in self.conn.execute(SQL_ARCHIVED_MONTHS):
+            if (after is not None and month > after[0][:7]) or (date_from and month < date_from[:7]) or (
+                    date_to and month > date_to[:7]):
+                continue
+            if month[:4] not in years:
+                years.append(month[:4])
+        return years
+
+    def attach_archives(self, date_from, date_to):
+        """Attach the archives ``date_from``..``date_to`` reaches into; call before a transaction that reads them."""
+        years = self._archived_years(date_from=date_from, date_to=date_to)
+        if len(years) > MAX_ATTACHED_ARCHIVES:
+            raise ValueError(f"A date range can reach into at most {MAX_ATTACHED_ARCHIVES} archived years.")
+        return [self._attach(year) for year in reversed(years)]
+
+    def _attached_archives(self, date_from, date_to):
+        # The archives attach_archives() attached for this range, oldest first.
+        return [f"archive_{year}" for year in reversed(self._archived_years(date_from=date_from, date_to=date_to))]
+
+    def newest_sale_id(self):
+        """Id of the most recent sale, archived or live; 0 when there are none."""
+        return self.conn.execute(SQL_NEWEST_SALE_ID).fetchone()[0] or 0
+
+    def sale_lines(self, after_sale_id, until_sale_id):
+        """For the sales with ids in ``after_sale_id`` (exclusive) .. ``until_sale_id``, a pair of cursors per
+        place they are kept, archive years oldest first and then the live tables: (id, day, hour) of the sales
+        and (sale_id, product_id, quantity, price) of their lines, both in sale id order.
+
+        Each pair is read in one transaction, so finish with it before taking the next.
+        """
+        years = self.conn.execute(SQL_ARCHIVED_YEARS_AFTER, (after_sale_id,)).fetchall()
+        for year, last_id in years + [(None, until_sale_id)]:
+            schema, last_id = "main" if year is None else self._attach(year), min(last_id, until_sale_id)
+            with self.transaction():
+                yield (self.conn.execute(SQL_SALE_DAYS.format(db=schema), (after_sale_id, last_id)),
+                       self.conn.execute(SQL_SALE_LINES.format(db=schema), (after_sale_id, last_id)))
+
+    def months_to_archive(self, keep_months=ARCHIVE_KEEP_MONTHS):
+        """'YYYY-MM' of every month with live sales older than the ``keep_months`` most recent ones."""
+        today = date.today()
+        first_kept = today.year * 12 + today.month - keep_months  # Months since year 0, counting from zero.
+        cutoff = date(first_kept // 12, first_kept % 12 + 1, 1).isoformat()
+        return [month for (month,) in self.conn.execute(SQL_MONTHS_BEFORE, (cutoff,))]
+
+    @retry_when_busy
+    def archive_month(self, month):
+        """Move the sales of ``month`` ('YYYY-MM') to its year's archive file. Returns the number moved.
+
+        The rows are copied and committed to the archive first and only then
+        deleted from the live database, in a second transaction, so a crash
+        in between leaves the month in the live database to be archived
+        again rather than lost. Rollups are kept, so reports still cover it.
+        """
+        year, number = int(month[:4]), int(month[5:7])
+        start, end = f"{month}-01", (date(year + number // 12, number % 12 + 1, 1)).isoformat()
+        schema = self._attach(month[:4], create=True)
+        with self.transaction():  # Writes only the archive; tills keep selling meanwhile.
+            for statement in ARCHIVE_SCHEMA:
+                self.conn.execute(statement.format(db=schema))
+            self.conn.execute(SQL_ARCHIVE_PURGE_SALES.format(db=schema))
+            self.conn.execute(SQL_ARCHIVE_PURGE_ITEMS.format(db=schema))
+            self.conn.execute(SQL_ARCHIVE_COPY_SALES.format(db=schema), (start, end))
+            self.conn.execute(SQL_ARCHIVE_COPY_ITEMS.format(db=schema), (start, end))
+        with self.transaction(immediate=True):
+            count, first_id, last_id = self.conn.execute(SQL_LIVE_MONTH, (start, end)).fetchone()
+            if not count:
+                return 0  # Another till archived it first.
+            archived = self.conn.execute(SQL_ARCHIVE_MONTH_COUNT.format(db=schema), (start, end)).fetchone()[0]
+            if archived < count:
+                raise sqlite3.DatabaseError(f"The archive copy of {month} is incomplete; nothing was removed.")
+            self.conn.execute(SQL_RECORD_ARCHIVE, (month, first_id, last_id, count))
+            self.conn.execute(SQL_ARCHIVE_DELETE_ITEMS, (start, end))
+            self.conn.execute(SQL_ARCHIVE_DELETE_SALES, (start, end))
+        return count
+
+    def archive_sales(self, keep_months=ARCHIVE_KEEP_MONTHS):
+        """Archive every closed month older than the ``keep_months`` most recent. Returns [(month, sales moved)]."""
+        return [(month, self.archive_month(month)) for month in self.months_to_archive(keep_months)]
+
+    # --- Maintenance ---
+    def maintenance_state(self):
+        """{job: (last run 'YYYY-MM-DD HH:MM:SS', result or None while it runs)} of the jobs run so far."""
+        return {job: (last_run, result) for job, last_run, result in self.conn.execute(SQL_GET_MAINTENANCE)}
+
+    @retry_when_busy
+    def claim_maintenance(self, job, now, since):
+        """Record ``job`` as run at ``now`` unless some till ran it after ``since``; True if this one should run it."""
+        with self.transaction(immediate=True):
+            return self.conn.execute(SQL_CLAIM_MAINTENANCE, (job, now, since)).rowcount > 0
+
+    @retry_when_busy
+    def record_maintenance(self, job, result):
+        with self.transaction():
+            self.conn.execute(SQL_SET_MAINTENANCE_RESULT, (result, job))
+
+    def checkpoint(self):
+        """Copy the write-ahead log into the database, and empty the log if no reader still needs it.
+        Returns (frames in the log, frames copied)."""
+        busy, frames, copied = self.conn.execute(SQL_CHECKPOINT).fetchone()
+        if not busy and frames == copied:
+            self.conn.execute(SQL_CHECKPOINT_BUSY_TIMEOUT)
+            try:
+                self.conn.execute(SQL_CHECKPOINT_TRUNCATE).fetchone()
+            finally:
+                self.conn.execute(SQL_BUSY_TIMEOUT)
+        return frames, copied
+
+    def analyze(self):
+        """Refresh the statistics the query planner picks indexes by, sampling ANALYSIS_LIMIT rows per index."""
+        self.conn.execute(SQL_ANALYSIS_LIMIT)
+        self.conn.execute(SQL_ANALYZE)
+
+    def free_pages(self):
+        """(unused pages, pages) of the database file."""
+        return self.conn.execute(SQL_FREE_PAGES).fetchone()
+
+    def incremental_vacuum_enabled(self):
+        return self.conn.execute(SQL_AUTO_VACUUM).fetchone()[0] == 2
+
+    @retry_when_busy
+    def enable_incremental_vacuum(self):
+        """Switch a database created before incremental vacuum to it. This rewrites the whole file with
+        VACUUM, holding the write lock throughout, so it is only run with the tills closed (maintenance.py
+        vacuum)."""
+        self.conn.execute(SQL_SET_INCREMENTAL_VACUUM)
+        self.conn.execute(SQL_VACUUM)
+
+    @retry_when_busy
+    def vacuum_step(self, pages):
+        """Give up to ``pages`` unused pages back to the file system in one short write. Returns the unused
+        pages left."""
+        with self.transaction(immediate=True):
+            for _ in range(pages):
+                self.conn.execute(SQL_INCREMENTAL_VACUUM)
+        return self.free_pages()[0]
+
+    def integrity_check(self, quick=True):
+        """The problems SQLite finds in the database, or an empty list. ``quick`` leaves out checking
+        that every index matches its table, which takes much longer."""
+        problems = [row[0] for row in self.conn.execute(SQL_QUICK_CHECK if quick else SQL_INTEGRITY_CHECK)]
+        return [] if problems == ["ok"] else problems
+
+    def backup(self, path):
+        """Copy the live database to ``path`` while the tills keep selling (see copy_database)."""
+        return copy_database(self.conn, path)
+
+
+class ThreadLocalStorage:
+    """Gives every worker thread its own Storage on the same database.
+
+    sqlite3 connections must not be used from two threads at once; with WAL
+    each thread's connection can read while another one writes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        storage = getattr(self._local, "storage", None)
+        if storage is None:
+            # Closed from the main thread by close_all() once the workers are gone.
+            storage = self._local.storage = Storage(self.db_path, check_same_thread=False)
+            with self._lock:
+                self._opened.append(storage)
+        return storage
+
+    def close_all(self):
+        with self._lock:
+            for storage in self._opened:
+                storage.close()
+            self._opened.clear()
@@ -0,0 +1,137 @@
+"""Background task execution for the Tk application.
+
+Slow work (SQLite, image decoding, printing, exports) runs on a small worker
+pool. Tk widgets may only be touched from the thread running ``mainloop``, so
+results are handed back by polling the pending futures with ``after()`` and
+running the callbacks there. Polling only happens while something is
+pending, at roughly the display refresh rate. Tasks inherit the metrics span
+they were started from, which stays open until their callbacks have run.
+"""
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import recorder
+
+DEFAULT_WORKERS = 4
+POLL_MS = 16
+
+
+class Task:
+    """Handle for one background job: cancel it, or report progress from inside it."""
+
+    def __init__(self, future=None, on_done=None, on_error=None, on_progress=None):
+        self.future = future
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.span = recorder.current()
+        self.progress = None  # Latest arguments passed to report(), replaced atomically.
+        self._delivered_progress = None
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Stop the job if it has not started, ask it to stop otherwise, and drop its callbacks."""
+        self._cancel.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def report(self, *progress):
+        """Called from the worker; on_progress(*progress) later runs on the Tk thread."""
+        self.progress = progress
+
+
+class TaskRunner:
+    """Runs callables on worker threads and delivers their outcome on the Tk thread."""
+
+    def __init__(self, root, workers=DEFAULT_WORKERS, on_busy=None):
+        self.root = root
+        self.on_busy = on_busy
+        self.pending = []
+        self._polling = False
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="task")
+
+    def submit(self, fn, *args, on_done=None, on_error=None, on_progress=None, with_task=False):
+        """Run ``fn(*args)`` in the background; with ``with_task`` the Task is passed as first argument.
+
+        ``on_done(result)`` or ``on_error(exception)`` runs on the Tk thread
+        afterwards unless the task was cancelled. Errors without an
+        ``on_error`` go to Tk's usual callback error report.
+        """
+        task = Task(on_done=on_done, on_error=on_error, on_progress=on_progress)
+        fn = recorder.bind(fn, task.span)
+        task.future = self._executor.submit(fn, task, *args) if with_task else self._executor.submit(fn, *args)
+        self._track(task)
+        return task
+
+    def watch(self, future, on_done=None, on_error=None):
+        """Deliver the outcome of a future created elsewhere (e.g. CheckoutEngine) on the Tk thread."""
+        task = Task(future, on_done=on_done, on_error=on_error)
+        self._track(task)
+        return task
+
+    @property
+    def busy(self):
+        return bool(self.pending)
+
+    def _track(self, task):
+        recorder.hold(task.span)
+        if not self.pending and self.on_busy:
+            self.on_busy(True)
+        self.pending.append(task)
+        if not self._polling:
+            self._polling = True
+            self.root.after(POLL_MS, self._poll)
+
+    def _poll(self):
+        # Callbacks may submit new tasks, which land in the fresh list.
+        current, self.pending = self.pending, []
+        finished = []
+        for task in current:
+            if task.future.done():
+                finished.append(task)
+            else:
+                self.pending.append(task)
+                if task.on_progress and task.progress is not task._delivered_progress:
+                    task._delivered_progress = task.progress
+                    with recorder.activate(task.span, widget=True):
+                        self._call(task.on_progress, *task.progress)
+        for task in finished:
+            try:
+                with recorder.activate(task.span, widget=True):
+                    self._deliver(task)
+            finally:
+                recorder.release(task.span)
+        if self.pending:
+            self.root.after(POLL_MS, self._poll)
+        else:
+            self._polling = False
+            if self.on_busy:
+                self.on_busy(False)
+
+    def _deliver(self, task):
+        if task.cancelled() or task.future.cancelled():
+            return
+        error = task.future.exception()
+        if error is None:
+            if task.on_done:
+                self._call(task.on_done, task.future.result())
+        elif task.on_error:
+            self._call(task.on_error, error)
+        else:
+            self.root.report_callback_exception(type(error), error, error.__traceback__)
+
+    def _call(self, callback, *args):
+        # A failing callback must not stop delivery for the other tasks.
+        try:
+            callback(*args)
+        except Exception:
+            self.root.report_callback_exception(*sys.exc_info())
+
+    def shutdown(self):
+        for task in self.pending:
+            task.cancel()
+        self._executor.shutdown(wait=True, cancel_futures=True)
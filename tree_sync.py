@@ -0,0 +1,56 @@
+"""Keyed, incremental updates for ttk.Treeview lists.
+
+Screens used to delete every row and reinsert the full result set on each
+refresh. ``TreeSync`` remembers what it last put in the tree and, given the
+new rows, only inserts, updates, deletes or moves the rows that changed, so
+selection and scroll position survive a refresh.
+"""
+
+
+def first_column(row):
+    return row[0]
+
+
+class TreeSync:
+    """Reconciles a Treeview against lists of rows keyed by a stable id."""
+
+    def __init__(self, tree, key=first_column, values=tuple):
+        self.tree = tree
+        self.key = key
+        self.values = values
+        self.shown = {}  # iid -> values currently displayed
+
+    def sync(self, rows):
+        tree, shown = self.tree, self.shown
+        top = tree.yview()[0]
+        wanted = {}
+        for row in rows:
+            wanted[str(self.key(row))] = self.values(row)
+
+        stale = [iid for iid in shown if iid not in wanted]
+        if stale:
+            tree.delete(*stale)
+            for iid in stale:
+                del shown[iid]
+
+        for index, (iid, values) in enumerate(wanted.items()):
+            current = shown.get(iid)
+            if current is None:
+                # Inserting at the final position keeps the order right for the usual
+                # case of rows added or removed without existing rows changing places.
+                tree.insert("", index, iid=iid, values=values)
+                shown[iid] = values
+            elif current != values:
+                tree.item(iid, values=values)
+                shown[iid] = values
+
+        order = tuple(wanted)
+        if tree.get_children() != order:
+            for index, iid in enumerate(order):
+                tree.move(iid, "", index)
+        tree.yview_moveto(top)
+
+    def clear(self):
+        if self.shown:
+            self.tree.delete(*self.shown)
+            self.shown.clear()